@@ -4,6 +4,8 @@ Full LLM capabilities with real-time screen vision
 """
 
 import os
+import hmac
+import time
 import uuid
 import base64
 import asyncio
@@ -11,10 +13,10 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form, Header, Depends, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from dotenv import load_dotenv
@@ -26,8 +28,17 @@ load_dotenv()
 from app.services.claude_service import ClaudeService
 from app.services.speech_service import SpeechService
 from app.services.session_manager import SessionManager
+from app.services.code_allocator import CodeSpaceExhausted
+from app.services.session_records import to_iso
 from app.services.knowledge_base import KnowledgeBase
 from app.services.task_planner import TaskPlanner
+from app.services.metrics import metrics
+from app.services.tracing import tracer, session_ref
+from app.services.profiler import profiler, slow_turns
+from app.services.serializer import FastJSONResponse, JSONDecodeError, backend_name, dumps_str, loads
+from app.services.prefetch import Speculation, prefetch_cache, normalize_input
+from app.services.batch_jobs import batch_jobs
+from app.services.usage import usage_tracker
 
 # Initialize services
 claude_service = ClaudeService()
@@ -36,6 +47,40 @@ session_manager = SessionManager()
 knowledge_base = KnowledgeBase()
 task_planner = TaskPlanner()
 
+# WebSocket message types we label metrics with; anything else is "other"
+WS_MESSAGE_TYPES = {"screen_share", "voice", "chat", "partial_input", "task_action", "kb_feedback", "ping"}
+
+# Turns that get a trace (subject to TRACE_SAMPLE_RATE)
+TRACED_MESSAGE_TYPES = {"screen_share", "voice", "chat"}
+
+WS_MESSAGE_SECONDS = metrics.histogram(
+    "akai_ws_message_seconds", "WebSocket message handling time", ["type"]
+)
+metrics.gauge("akai_active_sessions", "Sessions held in memory").set_function(
+    lambda: len(session_manager.sessions)
+)
+
+
+def speculate(session_id: str, text: str):
+    """Compute KB matches and template detection for input not sent yet"""
+    text = normalize_input(text)
+    if not prefetch_cache.wants(session_id, text):
+        return
+    prefetch_cache.put(session_id, Speculation(
+        text,
+        knowledge_base.get_context_for_query(text),
+        task_planner.detect_template(text)
+    ))
+
+
+def take_speculation(session_id: str, message: str) -> Optional[Speculation]:
+    """Speculative context for the final message, if it matches and is still current"""
+    return prefetch_cache.take(
+        session_id,
+        normalize_input(message),
+        lambda speculation: knowledge_base.is_current(speculation.kb_context)
+    )
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -44,7 +89,17 @@ async def lifespan(app: FastAPI):
     print(f"📍 Server running at http://localhost:{os.getenv('PORT', 8000)}")
     print("🧠 AI ready")
     print("👁️ Screen vision enabled")
+    asyncio.create_task(speech_service.warm_up())
+    expiry_task = asyncio.create_task(session_manager.run_expiry())
+    batch_task = asyncio.create_task(batch_jobs.run()) if batch_jobs.enabled else None
+    usage_task = asyncio.create_task(usage_tracker.run()) if usage_tracker.enabled else None
     yield
+    expiry_task.cancel()
+    if batch_task:
+        batch_task.cancel()
+    if usage_task:
+        usage_task.cancel()
+        usage_tracker.flush()
     print("👋 Akai shutting down...")
 
 
@@ -53,7 +108,8 @@ app = FastAPI(
     title="Akai",
     description="AI Screen Assistant - Your friendly AI buddy that can see your screen",
     version="0.3.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS middleware
@@ -81,13 +137,20 @@ async def home(request: Request):
 
 
 @app.post("/api/session/create")
-async def create_session():
-    """Create a new support session"""
-    session = session_manager.create_session()
+async def create_session(x_tenant_key: Optional[str] = Header(None)):
+    """Create a new support session, billed to the tenant its X-Tenant-Key was issued to (USAGE_DEFAULT_TENANT if omitted)"""
+    tenant_id = usage_tracker.resolve_tenant(x_tenant_key)
+    if tenant_id is None:
+        raise HTTPException(status_code=401, detail="Invalid tenant key")
+    try:
+        session = session_manager.create_session()
+    except CodeSpaceExhausted as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    usage_tracker.assign(session.id, tenant_id)
     return {
-        "session_id": session["id"],
-        "code": session["code"],
-        "created_at": session["created_at"],
+        "session_id": session.id,
+        "code": session.code,
+        "created_at": to_iso(session.created_at),
         "message": "Session created successfully"
     }
 
@@ -98,7 +161,17 @@ async def get_session(session_id: str):
     session = session_manager.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    return session
+    # Returning a response skips FastAPI's jsonable_encoder pass over the history
+    return FastJSONResponse(session.to_dict())
+
+
+@app.get("/api/session/{session_id}/usage")
+async def get_session_usage(session_id: str):
+    """Tokens, images, audio and estimated cost used by a session, with its budget state"""
+    usage = usage_tracker.get_session_usage(session_id)
+    if not usage:
+        raise HTTPException(status_code=404, detail="No usage recorded for this session")
+    return usage
 
 
 @app.post("/api/session/join")
@@ -108,24 +181,33 @@ async def join_session(code: str = Form(...)):
     if not session:
         raise HTTPException(status_code=404, detail="Invalid session code")
     return {
-        "session_id": session["id"],
+        "session_id": session.id,
         "message": "Joined session successfully"
     }
 
 
 @app.post("/api/voice/transcribe")
-async def transcribe_audio(audio: UploadFile = File(...), session_id: str = Form(...)):
-    """Transcribe audio using Whisper API"""
+async def transcribe_audio(
+    background_tasks: BackgroundTasks,
+    audio: UploadFile = File(...),
+    session_id: str = Form(...),
+    provider: Optional[str] = Form(None)
+):
+    """Transcribe audio using Whisper (OpenAI or local)"""
     try:
         # Read audio data
         audio_data = await audio.read()
 
         # Transcribe using Whisper
-        transcript = await speech_service.transcribe(audio_data, audio.filename)
+        transcript = await speech_service.transcribe(audio_data, audio.filename, provider=provider)
+        usage_tracker.record_audio(session_id, len(audio_data))
 
         # Add to session history
         session_manager.add_message(session_id, "user", transcript)
 
+        # The client sends the transcript as a chat message next
+        background_tasks.add_task(speculate, session_id, transcript)
+
         return {
             "transcript": transcript,
             "session_id": session_id
@@ -135,13 +217,13 @@ async def transcribe_audio(audio: UploadFile = File(...), session_id: str = Form
 
 
 @app.post("/api/voice/synthesize")
-async def synthesize_speech(text: str = Form(...)):
+async def synthesize_speech(text: str = Form(...), provider: Optional[str] = Form(None)):
     """Convert text to speech using TTS"""
     try:
-        audio_base64 = await speech_service.synthesize(text)
+        result = await speech_service.synthesize_audio(text, provider=provider)
         return {
-            "audio": audio_base64,
-            "format": "mp3"
+            "audio": result["audio"],
+            "format": result["format"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -161,13 +243,14 @@ async def analyze_screen(
 
         # Get session context
         session = session_manager.get_session(session_id)
-        conversation_history = session.get("messages", []) if session else []
+        conversation_history = session.conversation_history() if session else []
 
         # Analyze with Claude Vision
         analysis = await claude_service.analyze_screen(
             image_base64=image_base64,
             user_message=user_message,
-            conversation_history=conversation_history
+            conversation_history=conversation_history,
+            session_id=session_id
         )
 
         # Add AI response to session
@@ -185,19 +268,47 @@ async def analyze_screen(
 async def chat(
     message: str = Form(...),
     session_id: str = Form(...),
-    screenshot: Optional[UploadFile] = File(None)
+    screenshot: Optional[UploadFile] = File(None),
+    ask_ai: bool = Form(False)
 ):
-    """Chat with AI assistant, optionally with screenshot"""
+    """
+    Chat with AI assistant, optionally with screenshot
+
+    Text questions that match a proven KB solution get a templated answer
+    straight away (fast_path in the response). Resending with ask_ai=true
+    skips the KB answer and asks Claude instead.
+    """
     try:
         # Get session context
         session = session_manager.get_session(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
 
-        conversation_history = session.get("messages", [])
+        # Add user message to history (already there when asking the AI after a KB answer)
+        if not ask_ai:
+            session_manager.add_message(session_id, "user", message)
+        conversation_history = session.conversation_history()
 
-        # Add user message to history
-        session_manager.add_message(session_id, "user", message)
+        if not screenshot and not ask_ai and knowledge_base.fast_path:
+            speculation = take_speculation(session_id, message)
+            if speculation:
+                kb_context = speculation.kb_context
+            else:
+                kb_context = knowledge_base.get_context_for_query(message)
+            task_context = task_planner.get_context_for_session(session_id)
+            fast_answer = get_fast_answer(kb_context, task_context)
+            if fast_answer:
+                session_manager.add_message(session_id, "assistant", fast_answer["response"])
+                if KB_FAST_PATH_POLISH:
+                    start_polish(session_id, message, conversation_history,
+                                 kb_context, task_context, fast_answer["answer_id"])
+                return FastJSONResponse({
+                    "response": fast_answer["response"],
+                    "session_id": session_id,
+                    "fast_path": True,
+                    "answer_id": fast_answer["answer_id"],
+                    "solution_id": fast_answer["solution_id"]
+                })
 
         # Process with or without screenshot
         if screenshot:
@@ -207,21 +318,23 @@ async def chat(
             response = await claude_service.analyze_screen(
                 image_base64=image_base64,
                 user_message=message,
-                conversation_history=conversation_history
+                conversation_history=conversation_history,
+                session_id=session_id
             )
         else:
             response = await claude_service.chat(
                 message=message,
-                conversation_history=conversation_history
+                conversation_history=conversation_history,
+                session_id=session_id
             )
 
         # Add AI response to session
         session_manager.add_message(session_id, "assistant", response["response"])
 
-        return {
+        return FastJSONResponse({
             "response": response["response"],
             "session_id": session_id
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -240,13 +353,7 @@ async def get_kb_categories():
 @app.get("/api/knowledge/search")
 async def search_kb(query: str, category: Optional[str] = None):
     """Search the Knowledge Base for problems and solutions"""
-    results = knowledge_base.search(query, category)
-    return {
-        "query": query,
-        "category": category,
-        "count": len(results),
-        "results": results
-    }
+    return FastJSONResponse(knowledge_base.search_json(query, category))
 
 
 @app.get("/api/knowledge/problems/{problem_id}")
@@ -312,10 +419,9 @@ async def create_task_plan(
     steps: str = Form(...)  # JSON string of steps array
 ):
     """Create a new task plan"""
-    import json
     try:
-        steps_list = json.loads(steps)
-    except json.JSONDecodeError:
+        steps_list = loads(steps)
+    except JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid steps JSON")
 
     plan = task_planner.create_plan(
@@ -435,14 +541,64 @@ class ConnectionManager:
 
     async def send_message(self, session_id: str, message: dict):
         if session_id in self.active_connections:
-            await self.active_connections[session_id].send_json(message)
+            await self.active_connections[session_id].send_text(dumps_str(message))
+
+    async def send_raw(self, session_id: str, payload: bytes):
+        """Send an already-encoded JSON message"""
+        if session_id in self.active_connections:
+            await self.active_connections[session_id].send_text(payload.decode("utf-8"))
 
     async def broadcast(self, message: dict):
         for connection in self.active_connections.values():
-            await connection.send_json(message)
+            await connection.send_text(dumps_str(message))
 
 
 manager = ConnectionManager()
+metrics.gauge("akai_websocket_connections", "Open WebSocket connections").set_function(
+    lambda: len(manager.active_connections)
+)
+
+# Rewrite templated KB answers with Claude in the background
+KB_FAST_PATH_POLISH = os.getenv("KB_FAST_PATH_POLISH", "false").lower() == "true"
+background_tasks = set()
+
+
+def get_fast_answer(kb_context, task_context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Templated KB answer for this turn, unless a task plan is guiding the user"""
+    if task_context.get("has_active_plan"):
+        return None
+    answer = knowledge_base.get_fast_answer(kb_context)
+    if answer:
+        answer["answer_id"] = uuid.uuid4().hex
+    return answer
+
+
+async def polish_fast_answer(session_id: str, message: str, conversation_history: list,
+                             kb_context, task_context: Dict[str, Any], answer_id: str):
+    """Ask Claude for a reworded answer and push it to replace the templated one"""
+    # Optional spend: skip it once the session or tenant is near its budget
+    if usage_tracker.check(session_id)[0] != "ok":
+        return
+    response = await claude_service.chat_with_context(
+        message=message,
+        conversation_history=conversation_history,
+        kb_context=kb_context,
+        task_context=task_context,
+        session_id=session_id
+    )
+    if "error" in response:
+        return
+    await manager.send_message(session_id, {
+        "type": "ai_response_polished",
+        "answer_id": answer_id,
+        "response": response["response"]
+    })
+
+
+def start_polish(*args):
+    task = asyncio.create_task(polish_fast_answer(*args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
 
 @app.websocket("/ws/{session_id}")
@@ -452,193 +608,433 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
 
     try:
         while True:
-            data = await websocket.receive_json()
+            data = loads(await websocket.receive_text())
+            started = time.perf_counter()
 
             # Handle different message types
             msg_type = data.get("type")
 
-            if msg_type == "screen_share":
-                # Received screen frame
-                frame_data = data.get("frame")
-                user_message = data.get("message")
+            with tracer.trace(
+                f"ws.{msg_type}",
+                enabled=msg_type in TRACED_MESSAGE_TYPES,
+                session=session_ref(session_id)
+            ) as trace, slow_turns.watch(f"ws.{msg_type}", session_id, trace):
+                if msg_type == "screen_share":
+                    # Received screen frame
+                    frame_data = data.get("frame")
+                    user_message = data.get("message")
+
+                    if frame_data and user_message:
+                        # Get context
+                        speculation = take_speculation(session_id, user_message)
+                        if speculation:
+                            kb_context = speculation.kb_context
+                        else:
+                            with tracer.span("get_context_for_query"):
+                                kb_context = knowledge_base.get_context_for_query(user_message)
+                        with tracer.span("get_context_for_session"):
+                            task_context = task_planner.get_context_for_session(session_id)
+
+                        # Send KB match event if solutions found
+                        if kb_context.has_matches:
+                            with tracer.span("send_message", event="kb_match"):
+                                await manager.send_raw(session_id, kb_context.kb_match_json())
+
+                        with tracer.span("get_session"):
+                            session = session_manager.get_session(session_id)
+
+                        # Analyze screen with Claude and context
+                        response = await claude_service.analyze_screen_with_context(
+                            image_base64=frame_data,
+                            user_message=user_message,
+                            conversation_history=session.conversation_history(),
+                            kb_context=kb_context,
+                            task_context=task_context,
+                            session_id=session_id
+                        )
+
+                        with tracer.span("add_message", role="assistant"):
+                            session_manager.add_message(session_id, "assistant", response["response"])
+
+                        with tracer.span("send_message", event="ai_response"):
+                            await manager.send_message(session_id, {
+                                "type": "ai_response",
+                                "response": response["response"],
+                                "had_kb_context": response.get("had_kb_context", False),
+                                "had_task_context": response.get("had_task_context", False),
+                                "trace_id": trace.trace_id if trace else None
+                            })
+
+                elif msg_type == "voice":
+                    # Received voice data (base64 encoded)
+                    audio_data = base64.b64decode(data.get("audio", ""))
+
+                    # Transcribe
+                    with tracer.span("transcribe", audio_bytes=len(audio_data)):
+                        transcript = await speech_service.transcribe(audio_data, provider=data.get("provider"))
+                    usage_tracker.record_audio(session_id, len(audio_data))
+
+                    with tracer.span("add_message", role="user"):
+                        session_manager.add_message(session_id, "user", transcript)
+
+                    with tracer.span("send_message", event="transcript"):
+                        await manager.send_message(session_id, {
+                            "type": "transcript",
+                            "text": transcript,
+                            "trace_id": trace.trace_id if trace else None
+                        })
 
-                if frame_data and user_message:
-                    # Get context
-                    kb_context = knowledge_base.get_context_for_query(user_message)
-                    task_context = task_planner.get_context_for_session(session_id)
+                    with tracer.span("speculate"):
+                        await asyncio.to_thread(speculate, session_id, transcript)
+
+                elif msg_type == "partial_input":
+                    # Text typed so far: prepare the turn's context before it is sent
+                    partial = data.get("message") or ""
+                    await asyncio.to_thread(speculate, session_id, partial)
+
+                elif msg_type == "chat":
+                    # Text chat message with KB and task context
+                    message = data.get("message")
+                    # "Ask the AI instead" resends a message that got a KB answer
+                    ask_ai = bool(data.get("ask_ai"))
+                    with tracer.span("get_session"):
+                        session = session_manager.get_session(session_id)
+
+                    if not ask_ai:
+                        with tracer.span("add_message", role="user"):
+                            session_manager.add_message(session_id, "user", message)
+
+                    speculation = take_speculation(session_id, message)
+                    if speculation:
+                        # Computed from partial_input while the user was typing
+                        kb_context = speculation.kb_context
+                        template_match = speculation.template_match
+                    else:
+                        # Search Knowledge Base for matching solutions
+                        with tracer.span("get_context_for_query"):
+                            kb_context = knowledge_base.get_context_for_query(message)
+
+                        # Check for matching task template
+                        with tracer.span("detect_template"):
+                            template_match = task_planner.detect_template(message)
+
+                    # Get active task plan
+                    with tracer.span("get_context_for_session"):
+                        task_context = task_planner.get_context_for_session(session_id)
 
                     # Send KB match event if solutions found
-                    if kb_context.get("has_matches"):
+                    if kb_context.has_matches:
+                        with tracer.span("send_message", event="kb_match"):
+                            await manager.send_raw(session_id, kb_context.kb_match_json())
+
+                    # Send template detected event if match found
+                    if template_match and not task_context.get("has_active_plan"):
+                        with tracer.span("send_message", event="template_detected"):
+                            await manager.send_message(session_id, {
+                                "type": "template_detected",
+                                "template": template_match
+                            })
+
+                    # Proven KB solution: answer now without calling Claude
+                    fast_answer = None if ask_ai else get_fast_answer(kb_context, task_context)
+                    if fast_answer:
+                        conversation_history = session.conversation_history()
+                        with tracer.span("add_message", role="assistant"):
+                            session_manager.add_message(session_id, "assistant", fast_answer["response"])
+
+                        with tracer.span("send_message", event="ai_response"):
+                            await manager.send_message(session_id, {
+                                "type": "ai_response",
+                                "response": fast_answer["response"],
+                                "fast_path": True,
+                                "answer_id": fast_answer["answer_id"],
+                                "solution_id": fast_answer["solution_id"],
+                                "had_kb_context": True,
+                                "had_task_context": False,
+                                "trace_id": trace.trace_id if trace else None
+                            })
+
+                        if KB_FAST_PATH_POLISH:
+                            start_polish(session_id, message, conversation_history,
+                                         kb_context, task_context, fast_answer["answer_id"])
+                    else:
+                        # Call Claude with context
+                        response = await claude_service.chat_with_context(
+                            message=message,
+                            conversation_history=session.conversation_history(),
+                            kb_context=kb_context,
+                            task_context=task_context,
+                            session_id=session_id
+                        )
+
+                        with tracer.span("add_message", role="assistant"):
+                            session_manager.add_message(session_id, "assistant", response["response"])
+
+                        with tracer.span("send_message", event="ai_response"):
+                            await manager.send_message(session_id, {
+                                "type": "ai_response",
+                                "response": response["response"],
+                                "had_kb_context": response.get("had_kb_context", False),
+                                "had_task_context": response.get("had_task_context", False),
+                                "trace_id": trace.trace_id if trace else None
+                            })
+
+                elif msg_type == "task_action":
+                    # Handle task-related actions
+                    action = data.get("action")
+                    plan_id = data.get("plan_id")
+                    step_id = data.get("step_id")
+                    template_id = data.get("template_id")
+
+                    if action == "create_from_template" and template_id:
+                        plan = task_planner.create_from_template(session_id, template_id)
+                        if plan:
+                            await manager.send_message(session_id, {
+                                "type": "task_created",
+                                "plan": plan.to_dict()
+                            })
+
+                    elif action == "start_plan" and plan_id:
+                        result = task_planner.start_plan(plan_id)
+                        if result:
+                            await manager.send_message(session_id, {
+                                "type": "task_started",
+                                "plan": result,
+                                "current_step": result.get("current_step")
+                            })
+
+                    elif action == "complete_step" and plan_id and step_id:
+                        result = task_planner.complete_step(plan_id, step_id)
+                        if result:
+                            await manager.send_message(session_id, {
+                                "type": "step_completed",
+                                "plan": result["plan"],
+                                "completed_step": result["completed_step"],
+                                "next_step": result.get("next_step"),
+                                "is_complete": result.get("is_complete", False)
+                            })
+
+                    elif action == "fail_step" and plan_id and step_id:
+                        error_msg = data.get("error_message", "Step failed")
+                        result = task_planner.fail_step(plan_id, step_id, error_msg)
+                        if result:
+                            await manager.send_message(session_id, {
+                                "type": "step_failed",
+                                "plan": result["plan"],
+                                "failed_step": result["failed_step"],
+                                "error_message": error_msg
+                            })
+
+                    elif action == "skip_step" and plan_id and step_id:
+                        result = task_planner.skip_step(plan_id, step_id)
+                        if result:
+                            await manager.send_message(session_id, {
+                                "type": "step_completed",
+                                "plan": result["plan"],
+                                "skipped_step": result["skipped_step"],
+                                "next_step": result.get("next_step"),
+                                "is_complete": result.get("is_complete", False)
+                            })
+
+                elif msg_type == "kb_feedback":
+                    # Record solution feedback
+                    solution_id = data.get("solution_id")
+                    success = data.get("success", False)
+
+                    if solution_id:
+                        knowledge_base.record_feedback(solution_id, success)
                         await manager.send_message(session_id, {
-                            "type": "kb_match",
-                            "problems": kb_context.get("problems", []),
-                            "top_solutions": kb_context.get("top_solutions", [])
+                            "type": "feedback_recorded",
+                            "solution_id": solution_id,
+                            "success": success
                         })
 
-                    # Analyze screen with Claude and context
-                    response = await claude_service.analyze_screen_with_context(
-                        image_base64=frame_data,
-                        user_message=user_message,
-                        conversation_history=session_manager.get_session(session_id).get("messages", []),
-                        kb_context=kb_context,
-                        task_context=task_context
-                    )
+                elif msg_type == "ping":
+                    await manager.send_message(session_id, {"type": "pong"})
 
-                    session_manager.add_message(session_id, "assistant", response["response"])
+            WS_MESSAGE_SECONDS.labels(
+                msg_type if msg_type in WS_MESSAGE_TYPES else "other"
+            ).observe(time.perf_counter() - started)
 
-                    await manager.send_message(session_id, {
-                        "type": "ai_response",
-                        "response": response["response"],
-                        "had_kb_context": response.get("had_kb_context", False),
-                        "had_task_context": response.get("had_task_context", False)
-                    })
+    except WebSocketDisconnect:
+        manager.disconnect(session_id)
+        prefetch_cache.discard(session_id)
+    except Exception as e:
+        print(f"WebSocket error: {e}")
+        manager.disconnect(session_id)
+        prefetch_cache.discard(session_id)
 
-            elif msg_type == "voice":
-                # Received voice data (base64 encoded)
-                audio_data = base64.b64decode(data.get("audio", ""))
 
-                # Transcribe
-                transcript = await speech_service.transcribe(audio_data)
+# ============================================================================
+# Admin: Profiling
+# ============================================================================
 
-                session_manager.add_message(session_id, "user", transcript)
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow the request only with a matching X-Admin-Token header"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints disabled (ADMIN_TOKEN not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(duration: float = 30, interval_ms: float = 10):
+    """Start a time-boxed sampling profile of the running process"""
+    profile = profiler.start(duration, interval_ms)
+    if not profile:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return profile.to_dict()
+
+
+@app.get("/admin/profile/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Get the status of a profile"""
+    profile = profiler.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile.to_dict()
+
+
+@app.get("/admin/profile/{profile_id}/flamegraph", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    """Download collapsed stacks (input for flamegraph.pl or speedscope)"""
+    profile = profiler.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if profile.running:
+        raise HTTPException(status_code=409, detail="Profile still running")
+    return PlainTextResponse(
+        profile.folded(),
+        headers={"Content-Disposition": f'attachment; filename="akai-{profile.id}.folded"'}
+    )
 
-                await manager.send_message(session_id, {
-                    "type": "transcript",
-                    "text": transcript
-                })
 
-            elif msg_type == "chat":
-                # Text chat message with KB and task context
-                message = data.get("message")
-                session = session_manager.get_session(session_id)
+@app.get("/admin/slow-turns", dependencies=[Depends(require_admin)])
+async def get_slow_turns(limit: int = 20):
+    """Recent turns slower than SLOW_TURN_MS, with whole-process stack samples and span breakdown"""
+    captures = slow_turns.recent(limit)
+    return {
+        "threshold_ms": slow_turns.threshold * 1000,
+        "count": len(captures),
+        "turns": captures
+    }
 
-                session_manager.add_message(session_id, "user", message)
 
-                # Search Knowledge Base for matching solutions
-                kb_context = knowledge_base.get_context_for_query(message)
+@app.post("/admin/kb/reload", dependencies=[Depends(require_admin)])
+async def reload_knowledge_base():
+    """Recompile the KB snapshot from KB_SOURCE and swap it in"""
+    if not knowledge_base.source_spec:
+        raise HTTPException(status_code=400, detail="KB_SOURCE is not configured")
+    try:
+        await asyncio.to_thread(knowledge_base.reload, True)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"KB reload failed: {e}")
+    return knowledge_base.get_store_stats()
 
-                # Check for matching task template
-                template_match = task_planner.detect_template(message)
-
-                # Get active task plan
-                task_context = task_planner.get_context_for_session(session_id)
-
-                # Send KB match event if solutions found
-                if kb_context.get("has_matches"):
-                    await manager.send_message(session_id, {
-                        "type": "kb_match",
-                        "problems": kb_context.get("problems", []),
-                        "top_solutions": kb_context.get("top_solutions", [])
-                    })
-
-                # Send template detected event if match found
-                if template_match and not task_context.get("has_active_plan"):
-                    await manager.send_message(session_id, {
-                        "type": "template_detected",
-                        "template": template_match
-                    })
-
-                # Call Claude with context
-                response = await claude_service.chat_with_context(
-                    message=message,
-                    conversation_history=session.get("messages", []),
-                    kb_context=kb_context,
-                    task_context=task_context
-                )
-
-                session_manager.add_message(session_id, "assistant", response["response"])
-
-                await manager.send_message(session_id, {
-                    "type": "ai_response",
-                    "response": response["response"],
-                    "had_kb_context": response.get("had_kb_context", False),
-                    "had_task_context": response.get("had_task_context", False)
-                })
 
-            elif msg_type == "task_action":
-                # Handle task-related actions
-                action = data.get("action")
-                plan_id = data.get("plan_id")
-                step_id = data.get("step_id")
-                template_id = data.get("template_id")
+# ============================================================================
+# Admin: Batch Jobs
+# ============================================================================
 
-                if action == "create_from_template" and template_id:
-                    plan = task_planner.create_from_template(session_id, template_id)
-                    if plan:
-                        await manager.send_message(session_id, {
-                            "type": "task_created",
-                            "plan": plan.to_dict()
-                        })
+@app.post("/admin/batch/screens", dependencies=[Depends(require_admin)])
+async def enqueue_screen_analysis(
+    screenshot: UploadFile = File(...),
+    session_id: Optional[str] = Form(None),
+    prompt: Optional[str] = Form(None)
+):
+    """Queue an archived screenshot for analysis in the next batch"""
+    image_data = await screenshot.read()
+    job = batch_jobs.enqueue("screen_analysis", session_id, {
+        "image": base64.b64encode(image_data).decode('utf-8'),
+        "media_type": screenshot.content_type or "image/jpeg",
+        "prompt": prompt
+    })
+    return {"job_id": job["id"], "status": "queued"}
+
+
+@app.post("/admin/batch/enqueue", dependencies=[Depends(require_admin)])
+async def enqueue_pending_jobs(kind: str = Form(...), limit: int = Form(100)):
+    """Queue jobs for closed sessions without a summary or KB articles without keywords"""
+    try:
+        queued = await asyncio.to_thread(batch_jobs.enqueue_pending, kind, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"kind": kind, "queued": queued}
 
-                elif action == "start_plan" and plan_id:
-                    result = task_planner.start_plan(plan_id)
-                    if result:
-                        await manager.send_message(session_id, {
-                            "type": "task_started",
-                            "plan": result,
-                            "current_step": result.get("current_step")
-                        })
 
-                elif action == "complete_step" and plan_id and step_id:
-                    result = task_planner.complete_step(plan_id, step_id)
-                    if result:
-                        await manager.send_message(session_id, {
-                            "type": "step_completed",
-                            "plan": result["plan"],
-                            "completed_step": result["completed_step"],
-                            "next_step": result.get("next_step"),
-                            "is_complete": result.get("is_complete", False)
-                        })
+@app.get("/admin/batch/jobs", dependencies=[Depends(require_admin)])
+async def list_batch_jobs(status: Optional[str] = None, limit: int = 100):
+    """Batch jobs, oldest first"""
+    jobs = batch_jobs.list_jobs(status, limit)
+    return {"count": len(jobs), "jobs": jobs}
 
-                elif action == "fail_step" and plan_id and step_id:
-                    error_msg = data.get("error_message", "Step failed")
-                    result = task_planner.fail_step(plan_id, step_id, error_msg)
-                    if result:
-                        await manager.send_message(session_id, {
-                            "type": "step_failed",
-                            "plan": result["plan"],
-                            "failed_step": result["failed_step"],
-                            "error_message": error_msg
-                        })
 
-                elif action == "skip_step" and plan_id and step_id:
-                    result = task_planner.skip_step(plan_id, step_id)
-                    if result:
-                        await manager.send_message(session_id, {
-                            "type": "step_completed",
-                            "plan": result["plan"],
-                            "skipped_step": result["skipped_step"],
-                            "next_step": result.get("next_step"),
-                            "is_complete": result.get("is_complete", False)
-                        })
+@app.get("/admin/batch/jobs/{job_id}", dependencies=[Depends(require_admin)])
+async def get_batch_job(job_id: str):
+    """A batch job and its result"""
+    job = batch_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-            elif msg_type == "kb_feedback":
-                # Record solution feedback
-                solution_id = data.get("solution_id")
-                success = data.get("success", False)
 
-                if solution_id:
-                    knowledge_base.record_feedback(solution_id, success)
-                    await manager.send_message(session_id, {
-                        "type": "feedback_recorded",
-                        "solution_id": solution_id,
-                        "success": success
-                    })
+@app.post("/admin/batch/run", dependencies=[Depends(require_admin)])
+async def run_batch_jobs():
+    """Collect finished batches and submit queued jobs now"""
+    return await asyncio.to_thread(batch_jobs.run_once)
 
-            elif msg_type == "ping":
-                await manager.send_message(session_id, {"type": "pong"})
 
-    except WebSocketDisconnect:
-        manager.disconnect(session_id)
-    except Exception as e:
-        print(f"WebSocket error: {e}")
-        manager.disconnect(session_id)
+# ============================================================================
+# Admin: Usage
+# ============================================================================
+
+@app.get("/admin/usage/tenants", dependencies=[Depends(require_admin)])
+async def list_tenant_usage(days: int = 1):
+    """Usage and estimated cost per tenant over the last days, most expensive first"""
+    tenants = await asyncio.to_thread(usage_tracker.list_tenants, days)
+    return {"days": days, "count": len(tenants), "tenants": tenants}
+
+
+@app.get("/admin/usage/tenants/{tenant_id}", dependencies=[Depends(require_admin)])
+async def get_tenant_usage(tenant_id: str, days: int = 30, top_sessions: int = 20):
+    """A tenant's usage per day and its most expensive sessions"""
+    return await asyncio.to_thread(usage_tracker.get_tenant_usage, tenant_id, days, top_sessions)
 
 
 # ============================================================================
-# Health Check
+# Health Check & Metrics
 # ============================================================================
 
+@app.get("/debug/traces", dependencies=[Depends(require_admin)])
+async def get_traces(limit: int = 50):
+    """Most recent turn traces, newest first"""
+    traces = tracer.recent(limit)
+    return {
+        "sample_rate": tracer.sample_rate,
+        "count": len(traces),
+        "traces": traces
+    }
+
+
+@app.get("/debug/traces/{trace_id}", dependencies=[Depends(require_admin)])
+async def get_trace(trace_id: str):
+    """A single trace from the ring buffer"""
+    trace = tracer.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(
+        metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -656,13 +1052,23 @@ async def health_check():
         "services": {
             "claude": {
                 "model": "claude-sonnet-4-20250514",
-                "max_tokens": 512
+                "max_tokens": 512,
+                "pipeline": claude_service.pipeline.get_stats()
             },
             "knowledge_base": {
                 "categories": len(knowledge_base.get_categories()),
                 "problems": len(knowledge_base.problems),
-                "solutions": len(knowledge_base.solutions)
+                "solutions": len(knowledge_base.solutions),
+                "store": knowledge_base.get_store_stats(),
+                "query_cache": knowledge_base.get_query_cache_stats()
             },
+            "json_backend": backend_name(),
+            "prefetch": prefetch_cache.get_stats(),
+            "batch_jobs": batch_jobs.get_stats(),
+            "usage": usage_tracker.get_stats(),
+            "sessions": session_manager.get_expiry_stats(),
+            "session_cache": session_manager.get_cache_stats(),
+            "speech": speech_service.get_status(),
             "task_planner": {
                 "templates": len(task_planner.templates),
                 "active_plans": len([p for p in task_planner.plans.values() if p.status.value == "in_progress"])
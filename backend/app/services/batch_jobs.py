@@ -0,0 +1,399 @@
+"""
+Batch Jobs - Offline Claude work through the Message Batches API
+
+Non-interactive jobs (re-analyzing archived screenshots, generating
+keywords for KB articles, summarizing closed sessions) are queued in
+SQLite, sent to Claude in batches, polled, and written back. They use
+their own API key (BATCH_ANTHROPIC_API_KEY, falling back to the main one),
+a daily token budget, and the Batches API's separate rate limits, and they
+never go through the interactive request pipeline.
+"""
+
+import os
+import uuid
+import asyncio
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+import anthropic
+from dotenv import load_dotenv
+
+from .metrics import metrics
+from .claude_pipeline import DEFAULT_SCREEN_PROMPT
+
+load_dotenv()
+
+BATCH_JOBS = metrics.counter(
+    "akai_batch_jobs_total", "Batch jobs by kind and final status", ["kind", "status"]
+)
+BATCH_TOKENS = metrics.counter(
+    "akai_batch_tokens_total", "Tokens used by batch jobs", ["direction"]
+)
+
+# Image tokens assumed when budgeting a screenshot (about 1.15 megapixels)
+IMAGE_TOKEN_ESTIMATE = 1600
+# Transcript characters sent for a session summary (most recent kept)
+SUMMARY_TRANSCRIPT_CHARS = 20000
+# Keywords kept from a generated list
+MAX_KEYWORDS = 20
+MAX_KEYWORD_CHARS = 60
+
+# Import database (lazy to avoid circular imports)
+_db = None
+def get_db():
+    global _db
+    if _db is None:
+        from .database import db
+        _db = db
+    return _db
+
+
+def _screen_analysis_params(job: Dict[str, Any], service: "BatchJobService") -> Dict[str, Any]:
+    payload = job["payload"]
+    return {
+        "model": service.vision_model,
+        "max_tokens": 1024,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": payload.get("media_type", "image/jpeg"),
+                        "data": payload["image"]
+                    }
+                },
+                {"type": "text", "text": payload.get("prompt") or DEFAULT_SCREEN_PROMPT}
+            ]
+        }]
+    }
+
+
+def _kb_keywords_params(job: Dict[str, Any], service: "BatchJobService") -> Dict[str, Any]:
+    article = job["payload"]
+    solutions = "; ".join(s.get("title", "") for s in article.get("solutions", []))
+    return {
+        "model": service.model,
+        "max_tokens": 200,
+        "messages": [{
+            "role": "user",
+            "content": (
+                "List 8 to 15 short search keywords or phrases a user might type when they have "
+                "this IT problem. Reply with a comma-separated list only.\n\n"
+                f"Title: {article.get('title', '')}\n"
+                f"Category: {article.get('category', '')}\n"
+                f"Description: {article.get('description', '')}\n"
+                f"Solutions: {solutions}"
+            )
+        }]
+    }
+
+
+def _session_summary_params(job: Dict[str, Any], service: "BatchJobService") -> Optional[Dict[str, Any]]:
+    session = get_db().get_session(job["target_id"])
+    if not session or not session["messages"]:
+        return None
+    transcript = "\n".join(
+        f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}"
+        for m in session["messages"]
+    )[-SUMMARY_TRANSCRIPT_CHARS:]
+    return {
+        "model": service.model,
+        "max_tokens": 300,
+        "messages": [{
+            "role": "user",
+            "content": (
+                "Summarize this IT support session in 2 to 4 plain sentences: the problem, "
+                "what was tried, and how it ended.\n\n" + transcript
+            )
+        }]
+    }
+
+
+def _parse_keywords(text: str) -> List[str]:
+    keywords = []
+    for part in text.replace("\n", ",").split(","):
+        keyword = part.strip().strip("-*.\"'").strip().lower()
+        if keyword and len(keyword) <= MAX_KEYWORD_CHARS and keyword not in keywords:
+            keywords.append(keyword)
+    return keywords[:MAX_KEYWORDS]
+
+
+def _write_kb_keywords(job: Dict[str, Any], text: str):
+    keywords = _parse_keywords(text)
+    if not keywords:
+        # Fails the job, so automatic queueing does not resend the article every poll
+        raise ValueError("No keywords in reply")
+    get_db().update_kb_article_keywords(job["target_id"], keywords)
+
+
+def _write_session_summary(job: Dict[str, Any], text: str):
+    get_db().save_session_summary(job["target_id"], text.strip(), job["id"])
+
+
+# kind -> (build request params, write the result back or None to keep it on the job only)
+JOB_KINDS = {
+    "screen_analysis": (_screen_analysis_params, None),
+    "kb_keywords": (_kb_keywords_params, _write_kb_keywords),
+    "session_summary": (_session_summary_params, _write_session_summary),
+}
+# Kinds enqueue_pending can find work for (screenshots are queued one at a time)
+AUTO_ENQUEUE_KINDS = ("session_summary", "kb_keywords")
+
+
+class BatchJobService:
+    """Queues batch jobs, submits and polls batches, writes results back"""
+
+    def __init__(self):
+        self.enabled = os.getenv("BATCH_JOBS", "true").lower() == "true"
+        self.model = os.getenv("BATCH_MODEL", "claude-3-5-haiku-20241022")
+        self.vision_model = os.getenv("BATCH_VISION_MODEL", "claude-sonnet-4-20250514")
+        self.max_requests = int(os.getenv("BATCH_MAX_REQUESTS", 1000))
+        self.poll_interval = float(os.getenv("BATCH_POLL_INTERVAL", 60))
+        # Estimated tokens per day across all batch jobs (0 = no limit)
+        self.daily_token_budget = int(os.getenv("BATCH_DAILY_TOKEN_BUDGET", 0))
+        self.auto_enqueue = []
+        for kind in os.getenv("BATCH_AUTO_ENQUEUE", "").split(","):
+            kind = kind.strip()
+            if not kind:
+                continue
+            if kind in AUTO_ENQUEUE_KINDS:
+                self.auto_enqueue.append(kind)
+            else:
+                print(f"⚠️ BATCH_AUTO_ENQUEUE: ignoring {kind} (expected one of {', '.join(AUTO_ENQUEUE_KINDS)})")
+        self._client = None
+        self._lock = threading.Lock()
+        self.last_error: Optional[str] = None
+
+    @property
+    def client(self) -> anthropic.Anthropic:
+        if self._client is None:
+            self._client = anthropic.Anthropic(
+                api_key=os.getenv("BATCH_ANTHROPIC_API_KEY") or os.getenv("ANTHROPIC_API_KEY")
+            )
+        return self._client
+
+    # ========================================================================
+    # Queueing
+    # ========================================================================
+
+    def enqueue(self, kind: str, target_id: Optional[str] = None,
+                payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Queue a job for the next batch
+
+        Args:
+            kind: screen_analysis, kb_keywords or session_summary
+            target_id: Session or KB article the result belongs to
+            payload: Kind-specific input (image and prompt, article fields)
+
+        Returns:
+            The queued job
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown batch job kind: {kind}")
+        job = {"id": uuid.uuid4().hex, "kind": kind, "target_id": target_id, "payload": payload or {}}
+        get_db().create_batch_job(job)
+        return job
+
+    def enqueue_pending(self, kind: str, limit: int = 100) -> int:
+        """Queue jobs for everything that needs one (closed sessions without a summary, articles without keywords)"""
+        db = get_db()
+        if kind == "session_summary":
+            session_ids = db.get_sessions_to_summarize(limit)
+            for session_id in session_ids:
+                self.enqueue(kind, session_id)
+            return len(session_ids)
+        if kind == "kb_keywords":
+            articles = db.get_kb_articles_without_keywords(limit)
+            for article in articles:
+                self.enqueue(kind, article["id"], article)
+            return len(articles)
+        raise ValueError(f"{kind} jobs are queued one at a time")
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job without its screenshot data"""
+        job = get_db().get_batch_job(job_id)
+        if job:
+            job["payload"].pop("image", None)
+        return job
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        jobs = get_db().get_batch_jobs(status, limit)
+        for job in jobs:
+            job["payload"].pop("image", None)
+        return jobs
+
+    # ========================================================================
+    # Submitting and polling
+    # ========================================================================
+
+    def _tokens_used_today(self) -> int:
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+        return get_db().get_batch_tokens_since(midnight)
+
+    @staticmethod
+    def _estimate_tokens(params: Dict[str, Any]) -> int:
+        """Rough input + max output tokens, counting a screenshot as IMAGE_TOKEN_ESTIMATE"""
+        images = 0
+        text_chars = 0
+        for message in params["messages"]:
+            content = message["content"]
+            if isinstance(content, str):
+                text_chars += len(content)
+                continue
+            for block in content:
+                if block["type"] == "image":
+                    images += 1
+                else:
+                    text_chars += len(block.get("text", ""))
+        return text_chars // 4 + images * IMAGE_TOKEN_ESTIMATE + params["max_tokens"]
+
+    def submit(self) -> Optional[str]:
+        """
+        Send queued jobs as one batch, within the daily token budget
+
+        Returns:
+            The new batch ID, or None if nothing was sent
+        """
+        db = get_db()
+        jobs = db.get_batch_jobs("queued", limit=self.max_requests)
+        if not jobs:
+            return None
+
+        remaining = None
+        if self.daily_token_budget > 0:
+            remaining = self.daily_token_budget - self._tokens_used_today()
+
+        requests, submitted = [], []
+        for job in jobs:
+            build, _ = JOB_KINDS[job["kind"]]
+            try:
+                params = build(job, self)
+            except (KeyError, TypeError) as e:
+                params = None
+                print(f"⚠️ Batch job {job['id']} has a bad payload: {e}")
+            if params is None:
+                db.finish_batch_job(job["id"], "failed", error="Nothing to send")
+                BATCH_JOBS.labels(job["kind"], "failed").inc()
+                continue
+
+            cost = self._estimate_tokens(params)
+            if remaining is not None:
+                if cost > remaining:
+                    break
+                remaining -= cost
+            requests.append({"custom_id": job["id"], "params": params})
+            submitted.append((job["id"], cost))
+
+        if not requests:
+            return None
+
+        batch = self.client.messages.batches.create(requests=requests)
+        # The estimates count against the daily budget until results come back
+        db.mark_batch_jobs_submitted(submitted, batch.id)
+        print(f"📦 Submitted batch {batch.id} with {len(requests)} jobs")
+        return batch.id
+
+    def _apply_result(self, job: Dict[str, Any], entry) -> str:
+        """Store one batch result; returns the job's new status"""
+        db = get_db()
+        result = entry.result
+
+        if result.type == "succeeded":
+            message = result.message
+            text = "".join(block.text for block in message.content if block.type == "text")
+            usage = message.usage
+            BATCH_TOKENS.labels("input").inc(usage.input_tokens)
+            BATCH_TOKENS.labels("output").inc(usage.output_tokens)
+            _, write = JOB_KINDS[job["kind"]]
+            try:
+                if write:
+                    write(job, text)
+            except Exception as e:
+                db.finish_batch_job(job["id"], "failed", result=text, error=f"Write-back failed: {e}",
+                                    input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+                return "failed"
+            db.finish_batch_job(job["id"], "succeeded", result=text,
+                                input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+            return "succeeded"
+
+        if result.type == "errored":
+            db.finish_batch_job(job["id"], "failed", error=result.error.error.message)
+            return "failed"
+
+        # canceled or expired: try again in a later batch
+        db.finish_batch_job(job["id"], "queued", error=f"Batch request {result.type}")
+        return "requeued"
+
+    def poll(self) -> int:
+        """
+        Collect results of finished batches
+
+        Returns:
+            Number of jobs updated
+        """
+        db = get_db()
+        updated = 0
+        for batch_id in db.get_open_batch_ids():
+            batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status != "ended":
+                continue
+
+            jobs = {job["id"]: job for job in db.get_batch_jobs("submitted", limit=self.max_requests, batch_id=batch_id)}
+            for entry in self.client.messages.batches.results(batch_id):
+                job = jobs.pop(entry.custom_id, None)
+                if job is None:
+                    continue
+                status = self._apply_result(job, entry)
+                BATCH_JOBS.labels(job["kind"], status).inc()
+                updated += 1
+
+            # Requests the batch has no result for
+            for job in jobs.values():
+                db.finish_batch_job(job["id"], "queued", error="Missing from batch results")
+                BATCH_JOBS.labels(job["kind"], "requeued").inc()
+                updated += 1
+            print(f"📦 Batch {batch_id} finished")
+        return updated
+
+    def run_once(self) -> Dict[str, Any]:
+        """Queue automatic jobs, collect finished batches, submit new work"""
+        if not self._lock.acquire(blocking=False):
+            return {"skipped": True}
+        try:
+            for kind in self.auto_enqueue:
+                self.enqueue_pending(kind)
+            updated = self.poll()
+            batch_id = self.submit()
+            self.last_error = None
+            return {"updated": updated, "submitted_batch": batch_id}
+        except Exception as e:
+            # Log and let the next poll try again; the background task must not die
+            self.last_error = str(e)
+            print(f"⚠️ Batch jobs error: {e}")
+            return {"error": str(e)}
+        finally:
+            self._lock.release()
+
+    async def run(self):
+        """Background task: process batch jobs every poll_interval seconds"""
+        while True:
+            await asyncio.to_thread(self.run_once)
+            await asyncio.sleep(self.poll_interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "jobs": get_db().get_batch_job_counts(),
+            "model": self.model,
+            "vision_model": self.vision_model,
+            "daily_token_budget": self.daily_token_budget,
+            "tokens_used_today": self._tokens_used_today(),
+            "last_error": self.last_error
+        }
+
+
+batch_jobs = BatchJobService()
@@ -0,0 +1,370 @@
+"""
+Claude Pipeline - Staged request handling for ClaudeService
+
+Every Claude call goes through the same chain of stages:
+
+    context -> history -> image -> cache -> admission -> transport -> postprocess
+
+Each stage receives the request and a call_next coroutine, so it can fill
+in fields before the call (context, messages), short-circuit it (cache),
+wrap it (admission control) or reshape the result (postprocess). Features
+like routing or accounting are added as new stages instead of being
+copied into every ClaudeService method.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Union
+
+from .metrics import metrics
+from .tracing import tracer
+from .serializer import dumps
+
+LLM_ADMISSION_WAIT_SECONDS = metrics.histogram(
+    "akai_llm_admission_wait_seconds", "Time Claude requests waited for a concurrency slot", ["method"]
+)
+LLM_REJECTED = metrics.counter(
+    "akai_llm_rejected_total", "Claude requests turned away by admission control", ["method"]
+)
+LLM_RESPONSE_CACHE = metrics.counter(
+    "akai_llm_response_cache_requests_total", "Claude response cache lookups by result", ["result"]
+)
+
+DEFAULT_SCREEN_PROMPT = "What do you see on this screen? Describe what's happening and share any relevant observations or insights."
+
+
+@dataclass
+class LLMRequest:
+    """One Claude call as it moves through the pipeline"""
+    method: str
+    message: Optional[str] = None
+    conversation_history: Optional[List[Dict]] = None
+    image_base64: Optional[str] = None
+    kb_context: Any = None
+    task_context: Optional[Dict[str, Any]] = None
+    with_context: bool = False  # Report had_kb_context/had_task_context
+    model: str = ""
+    max_tokens: int = 512
+    session_id: Optional[str] = None  # Session the usage is billed to
+
+    # Filled in by the stages
+    system: Union[str, List[Dict[str, Any]], None] = None
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    content: Any = None  # Current user turn
+    had_kb_context: bool = False
+    had_task_context: bool = False
+    api_response: Any = None
+    cache_hit: bool = False
+    history_window: Optional[int] = None  # Overrides HistoryStage.window
+    downgrade: bool = False  # Use the fast model and never escalate
+
+    @property
+    def has_image(self) -> bool:
+        return self.image_base64 is not None
+
+
+Result = Dict[str, Any]
+CallNext = Callable[[LLMRequest], Awaitable[Result]]
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request could not get a concurrency slot in time"""
+    pass
+
+
+class PipelineStage:
+    """Base class for a pipeline stage"""
+
+    name = "base"
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        return await call_next(request)
+
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        """Stage state for /health, or None"""
+        return None
+
+
+class ContextStage(PipelineStage):
+    """System prompt with KB and task sections"""
+
+    name = "context"
+
+    def __init__(self, build_system: Callable):
+        self.build_system = build_system
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        if request.with_context:
+            with tracer.span("format_prompt"):
+                request.system, request.had_kb_context, request.had_task_context = self.build_system(
+                    request.kb_context, request.task_context
+                )
+        else:
+            request.system = self.build_system()[0]
+        return await call_next(request)
+
+
+class HistoryStage(PipelineStage):
+    """Most recent conversation turns (text only, images are never resent)"""
+
+    name = "history"
+
+    def __init__(self, window: int = 10):
+        self.window = window
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        window = self.window if request.history_window is None else request.history_window
+        if request.conversation_history and window > 0:
+            request.messages = [
+                {"role": msg["role"], "content": msg["content"]}
+                for msg in request.conversation_history[-window:]
+            ]
+        return await call_next(request)
+
+
+class ImageStage(PipelineStage):
+    """Current user turn, with the screenshot attached when there is one"""
+
+    name = "image"
+
+    def __init__(self, media_type: str = "image/jpeg"):
+        self.media_type = media_type
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        if request.has_image:
+            request.content = [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": self.media_type,
+                        "data": request.image_base64
+                    }
+                },
+                {"type": "text", "text": request.message or DEFAULT_SCREEN_PROMPT}
+            ]
+        else:
+            request.content = request.message
+        request.messages.append({"role": "user", "content": request.content})
+        return await call_next(request)
+
+
+class ResponseCacheStage(PipelineStage):
+    """
+    Replays the answer to an identical request (same model, prompt and turns)
+
+    Catches resubmits and retries. Off unless LLM_RESPONSE_CACHE_SIZE > 0.
+    """
+
+    name = "cache"
+
+    def __init__(self, max_entries: int = 0, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def _key(self, request: LLMRequest) -> bytes:
+        payload = dumps([request.model, request.max_tokens, request.system, request.messages])
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        if not self.enabled:
+            return await call_next(request)
+
+        key = self._key(request)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        if entry is not None:
+            LLM_RESPONSE_CACHE.labels("hit").inc()
+            request.cache_hit = True
+            return dict(entry[1])
+        LLM_RESPONSE_CACHE.labels("miss").inc()
+
+        result = await call_next(request)
+        if "error" not in result:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, dict(result))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+class AdmissionStage(PipelineStage):
+    """
+    Caps concurrent Claude calls
+
+    Requests wait for a slot up to timeout seconds and are then turned away
+    with an error instead of piling up behind a slow or rate-limited API.
+    """
+
+    name = "admission"
+
+    def __init__(self, max_concurrent: int = 16, timeout: float = 30.0):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        if self.max_concurrent <= 0:
+            return await call_next(request)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            LLM_REJECTED.labels(request.method).inc()
+            raise AdmissionRejected(f"No Claude slot free after {self.timeout:g}s")
+        finally:
+            self.waiting -= 1
+            LLM_ADMISSION_WAIT_SECONDS.labels(request.method).observe(time.perf_counter() - start)
+
+        self.in_flight += 1
+        try:
+            return await call_next(request)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected
+        }
+
+
+class TransportStage(PipelineStage):
+    """Messages API call on a worker thread so the event loop keeps serving"""
+
+    name = "transport"
+
+    def __init__(self, create_message: Callable):
+        self.create_message = create_message
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        request.api_response = await asyncio.to_thread(
+            self.create_message,
+            request.method,
+            model=request.model,
+            max_tokens=request.max_tokens,
+            system=request.system,
+            messages=request.messages
+        )
+        return await call_next(request)
+
+
+class PostprocessStage(PipelineStage):
+    """API response to the dict the endpoints send back (last stage)"""
+
+    name = "postprocess"
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        response = request.api_response
+        result = {
+            "response": response.content[0].text,
+            "usage": {
+                "input_tokens": response.usage.input_tokens,
+                "output_tokens": response.usage.output_tokens
+            }
+        }
+        if request.with_context:
+            result["had_kb_context"] = request.had_kb_context
+            result["had_task_context"] = request.had_task_context
+        return result
+
+
+class RequestPipeline:
+    """Ordered stages; the last one produces the result"""
+
+    def __init__(self, stages: List[PipelineStage]):
+        self.stages = list(stages)
+
+    def stage(self, name: str) -> Optional[PipelineStage]:
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def insert(self, stage: PipelineStage, before: str):
+        """Add a stage ahead of the named one (e.g. before="transport")"""
+        for i, existing in enumerate(self.stages):
+            if existing.name == before:
+                self.stages.insert(i, stage)
+                return
+        raise ValueError(f"Unknown pipeline stage: {before}")
+
+    async def run(self, request: LLMRequest) -> Result:
+        stages = self.stages
+
+        async def call(index: int, req: LLMRequest) -> Result:
+            if index == len(stages):
+                raise RuntimeError("Claude pipeline ended without a result")
+            return await stages[index].process(req, lambda r: call(index + 1, r))
+
+        return await call(0, request)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {"stages": [stage.name for stage in self.stages]}
+        for stage in self.stages:
+            stage_stats = stage.get_stats()
+            if stage_stats is not None:
+                stats[stage.name] = stage_stats
+        return stats
+
+
+def default_stages(build_system: Callable, create_message: Callable) -> List[PipelineStage]:
+    """The standard stage chain, configured from the environment"""
+    return [
+        ContextStage(build_system),
+        HistoryStage(int(os.getenv("LLM_HISTORY_WINDOW", "10"))),
+        ImageStage(),
+        ResponseCacheStage(
+            int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "0")),
+            float(os.getenv("LLM_RESPONSE_CACHE_TTL", "60"))
+        ),
+        AdmissionStage(
+            int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+            float(os.getenv("LLM_ADMISSION_TIMEOUT", "30"))
+        ),
+        TransportStage(create_message),
+        PostprocessStage()
+    ]
@@ -3,12 +3,37 @@ Claude Service - Handles AI Vision and Chat using Anthropic Claude
 """
 
 import os
+import time
 import anthropic
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Union
 from dotenv import load_dotenv
 
+from .metrics import metrics
+from .tracing import tracer
+from .knowledge_base import KBContext
+from .claude_pipeline import LLMRequest, RequestPipeline, AdmissionRejected, default_stages
+from .model_router import ModelRouter, RoutingStage
+from .usage import usage_tracker, BudgetStage, UsageStage, BudgetExceeded
+
 load_dotenv()
 
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "akai_llm_request_seconds", "Claude API call latency", ["method"]
+)
+LLM_TOKENS = metrics.counter(
+    "akai_llm_tokens_total", "Tokens used by Claude calls", ["method", "direction"]
+)
+LLM_ERRORS = metrics.counter(
+    "akai_llm_errors_total", "Failed Claude API calls", ["method"]
+)
+PROMPT_FRAGMENTS = metrics.counter(
+    "akai_prompt_fragments_total", "Prompt context fragments by cache result", ["result"]
+)
+
+# Rendered KB problem and task plan sections kept for reuse
+PROMPT_FRAGMENT_CACHE_SIZE = 4096
+
 
 class ClaudeService:
     """Service for interacting with Claude API"""
@@ -69,11 +94,68 @@ Pick your network.
 
 You'll be back online in a sec."""
 
+        # The base prompt goes first as its own block so every request
+        # starts with the same bytes. With PROMPT_CACHE the cache breakpoint
+        # goes at the end of the stable prefix (see _build_system); the API
+        # only caches prefixes above a minimum length (1024 tokens for
+        # Sonnet, 2048 for Haiku) and ignores the breakpoint below that.
+        self.prompt_cache = os.getenv("PROMPT_CACHE", "true").lower() == "true"
+        self._base_block = {"type": "text", "text": self.system_prompt}
+        self._base_system = [self._cache_breakpoint(self._base_block)]
+        self._prompt_fragments: "OrderedDict[tuple, str]" = OrderedDict()
+
+        # Every public method runs through the same stages
+        self.pipeline = RequestPipeline(default_stages(self._build_system, self._create_message))
+
+        # Fast model for simple turns, full model for the rest
+        self.router = ModelRouter(self.model, self.vision_model)
+        self.pipeline.insert(RoutingStage(self.router), before="cache")
+
+        # Budgets are checked before anything is built; usage is counted per API call
+        self.pipeline.insert(BudgetStage(usage_tracker), before="context")
+        self.pipeline.insert(UsageStage(usage_tracker), before="transport")
+
+    def _create_message(self, method: str, **kwargs):
+        """Call the Messages API and record latency and token usage"""
+        start = time.perf_counter()
+        try:
+            with tracer.span("claude_api", method=method, model=kwargs.get("model")):
+                response = self.client.messages.create(**kwargs)
+        except anthropic.APIError:
+            LLM_ERRORS.labels(method).inc()
+            raise
+        finally:
+            LLM_REQUEST_SECONDS.labels(method).observe(time.perf_counter() - start)
+
+        LLM_TOKENS.labels(method, "input").inc(response.usage.input_tokens)
+        LLM_TOKENS.labels(method, "output").inc(response.usage.output_tokens)
+        return response
+
+    async def _run(self, request: LLMRequest) -> Dict[str, Any]:
+        """Run a request through the pipeline, turning API failures into a friendly reply"""
+        try:
+            return await self.pipeline.run(request)
+        except BudgetExceeded as e:
+            print(f"⛔ {e} (session {request.session_id})")
+            return {
+                "response": "This conversation has reached its usage limit. Please contact support to continue.",
+                "error": str(e),
+                "budget": "hard"
+            }
+        except (anthropic.APIError, AdmissionRejected) as e:
+            print(f"Claude API error: {e}")
+            if request.has_image:
+                message = "I'm having trouble analyzing the screen right now. Please try again in a moment."
+            else:
+                message = "I'm having trouble responding right now. Please try again in a moment."
+            return {"response": message, "error": str(e)}
+
     async def analyze_screen(
         self,
         image_base64: str,
         user_message: Optional[str] = None,
-        conversation_history: List[Dict] = None
+        conversation_history: List[Dict] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Analyze a screenshot using Claude Vision
@@ -82,79 +164,25 @@ You'll be back online in a sec."""
             image_base64: Base64 encoded screenshot image
             user_message: User's question or description of the problem
             conversation_history: Previous messages in the conversation
+            session_id: Session the usage is billed to
 
         Returns:
             Dict with 'response' key containing AI's analysis
         """
-        try:
-            # Build messages array
-            messages = []
-
-            # Add conversation history (excluding images for token efficiency)
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Last 10 messages for context
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-            # Build current message with image
-            content = []
-
-            # Add the screenshot
-            content.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": image_base64
-                }
-            })
-
-            # Add user's message or default prompt
-            if user_message:
-                content.append({
-                    "type": "text",
-                    "text": user_message
-                })
-            else:
-                content.append({
-                    "type": "text",
-                    "text": "What do you see on this screen? Describe what's happening and share any relevant observations or insights."
-                })
-
-            messages.append({
-                "role": "user",
-                "content": content
-            })
-
-            # Call Claude API
-            response = self.client.messages.create(
-                model=self.vision_model,
-                max_tokens=512,
-                system=self.system_prompt,
-                messages=messages
-            )
-
-            return {
-                "response": response.content[0].text,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                }
-            }
-
-        except anthropic.APIError as e:
-            print(f"Claude API error: {e}")
-            return {
-                "response": "I'm having trouble analyzing the screen right now. Please try again in a moment.",
-                "error": str(e)
-            }
+        return await self._run(LLMRequest(
+            method="analyze_screen",
+            message=user_message,
+            conversation_history=conversation_history,
+            image_base64=image_base64,
+            model=self.vision_model,
+            session_id=session_id
+        ))
 
     async def chat(
         self,
         message: str,
-        conversation_history: List[Dict] = None
+        conversation_history: List[Dict] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Chat with Claude without an image
@@ -162,56 +190,25 @@ You'll be back online in a sec."""
         Args:
             message: User's message
             conversation_history: Previous messages in the conversation
+            session_id: Session the usage is billed to
 
         Returns:
             Dict with 'response' key containing AI's response
         """
-        try:
-            # Build messages array
-            messages = []
-
-            # Add conversation history
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Last 10 messages
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-            # Add current message
-            messages.append({
-                "role": "user",
-                "content": message
-            })
-
-            # Call Claude API
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=512,
-                system=self.system_prompt,
-                messages=messages
-            )
-
-            return {
-                "response": response.content[0].text,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                }
-            }
-
-        except anthropic.APIError as e:
-            print(f"Claude API error: {e}")
-            return {
-                "response": "I'm having trouble responding right now. Please try again in a moment.",
-                "error": str(e)
-            }
+        return await self._run(LLMRequest(
+            method="chat",
+            message=message,
+            conversation_history=conversation_history,
+            model=self.model,
+            session_id=session_id
+        ))
 
     async def plan_task(
         self,
         goal: str,
         current_screen: str,
-        conversation_history: List[Dict] = None
+        conversation_history: List[Dict] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Plan a series of steps to accomplish a goal
@@ -220,6 +217,7 @@ You'll be back online in a sec."""
             goal: What the user wants to achieve
             current_screen: Base64 encoded screenshot of current state
             conversation_history: Previous messages
+            session_id: Session the usage is billed to
 
         Returns:
             Dict with planned steps
@@ -239,45 +237,91 @@ Format your response as a numbered list of clear, specific steps."""
         return await self.analyze_screen(
             image_base64=current_screen,
             user_message=planning_prompt,
-            conversation_history=conversation_history
+            conversation_history=conversation_history,
+            session_id=session_id
         )
 
-    def _format_kb_context(self, kb_context: Dict[str, Any]) -> str:
+    def _cached_fragment(self, key: tuple, render) -> str:
+        """Rendered prompt text for key, rendering it on a miss"""
+        fragment = self._prompt_fragments.get(key)
+        if fragment is not None:
+            self._prompt_fragments.move_to_end(key)
+            PROMPT_FRAGMENTS.labels("hit").inc()
+            return fragment
+
+        fragment = self._prompt_fragments[key] = render()
+        if len(self._prompt_fragments) > PROMPT_FRAGMENT_CACHE_SIZE:
+            self._prompt_fragments.popitem(last=False)
+        PROMPT_FRAGMENTS.labels("miss").inc()
+        return fragment
+
+    @staticmethod
+    def _render_kb_problem(position: int, problem) -> str:
+        lines = [f"\nProblem {position}: {problem.title} (Category: {problem.category})"]
+        lines.append(f"Description: {problem.description}")
+
+        for j, solution in enumerate(problem.solutions[:2], 1):
+            lines.append(f"  Solution {j}: {solution.title} (Success rate: {solution.success_rate:.0%})")
+            lines.append(f"    ID: {solution.id}")
+            lines.append("    Steps:")
+            for step in solution.steps:
+                lines.append(f"      - {step}")
+        return "\n".join(lines)
+
+    def _format_kb_context(self, kb_context: Optional[KBContext]) -> str:
         """
         Format Knowledge Base context for the system prompt
 
+        Each problem block is rendered once per KB version, position and
+        feedback counts of the solutions shown, then reused.
+
         Args:
-            kb_context: KB search results with problems and solutions
+            kb_context: KB matches for the user's message
 
         Returns:
             Formatted string for system prompt
         """
-        if not kb_context or not kb_context.get("has_matches"):
+        if not kb_context or not kb_context.has_matches:
             return ""
 
-        lines = ["\n--- KNOWLEDGE BASE MATCHES ---"]
+        blocks = ["\n--- KNOWLEDGE BASE MATCHES ---"]
+        for i, problem in enumerate(kb_context.problems[:3], 1):
+            stats = tuple((s.success_count, s.failure_count) for s in problem.solutions[:2])
+            blocks.append(self._cached_fragment(
+                ("kb", kb_context.version, problem.id, i, stats),
+                lambda: self._render_kb_problem(i, problem)
+            ))
+        blocks.append("\n--- END KB MATCHES ---")
+        return "\n".join(blocks)
+
+    @staticmethod
+    def _render_task_context(task_context: Dict[str, Any]) -> str:
+        plan = task_context.get("plan", {})
+        current_step = task_context.get("current_step")
+        progress = task_context.get("progress", {})
 
-        problems = kb_context.get("problems", [])
-        for i, problem in enumerate(problems[:3], 1):
-            lines.append(f"\nProblem {i}: {problem['title']} (Category: {problem['category']})")
-            lines.append(f"Description: {problem['description']}")
+        lines = ["\n--- ACTIVE TASK PLAN ---"]
+        lines.append(f"Plan: {plan.get('title', 'Unknown')}")
+        lines.append(f"Progress: {progress.get('completed', 0)}/{progress.get('total', 0)} steps completed ({progress.get('percent', 0)}%)")
 
-            solutions = problem.get("solutions", [])
-            for j, solution in enumerate(solutions[:2], 1):
-                success_rate = solution.get("success_rate", 0)
-                lines.append(f"  Solution {j}: {solution['title']} (Success rate: {success_rate:.0%})")
-                lines.append(f"    ID: {solution['id']}")
-                lines.append("    Steps:")
-                for step in solution.get("steps", []):
-                    lines.append(f"      - {step}")
+        if current_step:
+            lines.append(f"\nCURRENT STEP ({current_step.get('order', '?')}/{progress.get('total', '?')}):")
+            lines.append(f"  Title: {current_step.get('title', 'Unknown')}")
+            lines.append(f"  Description: {current_step.get('description', 'No description')}")
+            lines.append(f"  Step ID: {current_step.get('id', '')}")
+            lines.append("\nGuide the user through this step. When they complete it, they can mark it done.")
+        else:
+            lines.append("\nAll steps have been addressed.")
 
-        lines.append("\n--- END KB MATCHES ---")
+        lines.append("\n--- END TASK PLAN ---")
         return "\n".join(lines)
 
     def _format_task_context(self, task_context: Dict[str, Any]) -> str:
         """
         Format Task Plan context for the system prompt
 
+        Rendered once per plan version (any step or status change).
+
         Args:
             task_context: Active task plan data
 
@@ -287,32 +331,60 @@ Format your response as a numbered list of clear, specific steps."""
         if not task_context or not task_context.get("has_active_plan"):
             return ""
 
-        plan = task_context.get("plan", {})
-        current_step = task_context.get("current_step")
-        progress = task_context.get("progress", {})
+        plan = task_context.get("plan") or {}
+        if plan.get("version") is None:
+            return self._render_task_context(task_context)
 
-        lines = ["\n--- ACTIVE TASK PLAN ---"]
-        lines.append(f"Plan: {plan.get('title', 'Unknown')}")
-        lines.append(f"Progress: {progress.get('completed', 0)}/{progress.get('total', 0)} steps completed ({progress.get('percent', 0)}%)")
+        progress = task_context.get("progress") or {}
+        current_step = task_context.get("current_step") or {}
+        key = (
+            "task", plan.get("id"), plan["version"],
+            progress.get("completed"), progress.get("total"), current_step.get("id")
+        )
+        return self._cached_fragment(key, lambda: self._render_task_context(task_context))
 
-        if current_step:
-            lines.append(f"\nCURRENT STEP ({current_step.get('order', '?')}/{progress.get('total', '?')}):")
-            lines.append(f"  Title: {current_step.get('title', 'Unknown')}")
-            lines.append(f"  Description: {current_step.get('description', 'No description')}")
-            lines.append(f"  Step ID: {current_step.get('id', '')}")
-            lines.append("\nGuide the user through this step. When they complete it, they can mark it done.")
-        else:
-            lines.append("\nAll steps have been addressed.")
+    @staticmethod
+    def _cache_breakpoint(block: Dict[str, Any]) -> Dict[str, Any]:
+        return {**block, "cache_control": {"type": "ephemeral"}}
 
-        lines.append("\n--- END TASK PLAN ---")
-        return "\n".join(lines)
+    def _build_system(
+        self,
+        kb_context: Optional[KBContext] = None,
+        task_context: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Union[str, List[Dict[str, Any]]], bool, bool]:
+        """
+        System prompt for a request, most stable content first
+
+        The base prompt is always the first block, followed by the task
+        section (stable for a whole step) and then the KB section (changes
+        with each query), each in its own block. The cache breakpoint marks
+        the end of the stable part: the task block when there is one,
+        otherwise the base prompt.
+
+        Returns:
+            (system, had_kb_context, had_task_context)
+        """
+        task_section = self._format_task_context(task_context)
+        kb_section = self._format_kb_context(kb_context)
+
+        if not self.prompt_cache:
+            return self.system_prompt + task_section + kb_section, bool(kb_section), bool(task_section)
+
+        if task_section:
+            system = [self._base_block, self._cache_breakpoint({"type": "text", "text": task_section})]
+        else:
+            system = list(self._base_system)
+        if kb_section:
+            system.append({"type": "text", "text": kb_section})
+        return system, bool(kb_section), bool(task_section)
 
     async def chat_with_context(
         self,
         message: str,
         conversation_history: List[Dict] = None,
-        kb_context: Dict[str, Any] = None,
-        task_context: Dict[str, Any] = None
+        kb_context: Optional[KBContext] = None,
+        task_context: Dict[str, Any] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Chat with Claude including KB and task context
@@ -322,73 +394,30 @@ Format your response as a numbered list of clear, specific steps."""
             conversation_history: Previous messages
             kb_context: Knowledge Base search results
             task_context: Active task plan data
+            session_id: Session the usage is billed to
 
         Returns:
             Dict with 'response' key containing AI's response
         """
-        try:
-            # Build enhanced system prompt
-            enhanced_prompt = self.system_prompt
-
-            # Add KB context
-            kb_section = self._format_kb_context(kb_context)
-            if kb_section:
-                enhanced_prompt += kb_section
-
-            # Add task context
-            task_section = self._format_task_context(task_context)
-            if task_section:
-                enhanced_prompt += task_section
-
-            # Build messages array
-            messages = []
-
-            # Add conversation history
-            if conversation_history:
-                for msg in conversation_history[-10:]:
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-            # Add current message
-            messages.append({
-                "role": "user",
-                "content": message
-            })
-
-            # Call Claude API
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=512,
-                system=enhanced_prompt,
-                messages=messages
-            )
-
-            return {
-                "response": response.content[0].text,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                },
-                "had_kb_context": bool(kb_section),
-                "had_task_context": bool(task_section)
-            }
-
-        except anthropic.APIError as e:
-            print(f"Claude API error: {e}")
-            return {
-                "response": "I'm having trouble responding right now. Please try again in a moment.",
-                "error": str(e)
-            }
+        return await self._run(LLMRequest(
+            method="chat_with_context",
+            message=message,
+            conversation_history=conversation_history,
+            kb_context=kb_context,
+            task_context=task_context,
+            with_context=True,
+            model=self.model,
+            session_id=session_id
+        ))
 
     async def analyze_screen_with_context(
         self,
         image_base64: str,
         user_message: Optional[str] = None,
         conversation_history: List[Dict] = None,
-        kb_context: Dict[str, Any] = None,
-        task_context: Dict[str, Any] = None
+        kb_context: Optional[KBContext] = None,
+        task_context: Dict[str, Any] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Analyze a screenshot with KB and task context
@@ -399,83 +428,19 @@ Format your response as a numbered list of clear, specific steps."""
             conversation_history: Previous messages
             kb_context: Knowledge Base search results
             task_context: Active task plan data
+            session_id: Session the usage is billed to
 
         Returns:
             Dict with 'response' key containing AI's analysis
         """
-        try:
-            # Build enhanced system prompt
-            enhanced_prompt = self.system_prompt
-
-            # Add KB context
-            kb_section = self._format_kb_context(kb_context)
-            if kb_section:
-                enhanced_prompt += kb_section
-
-            # Add task context
-            task_section = self._format_task_context(task_context)
-            if task_section:
-                enhanced_prompt += task_section
-
-            # Build messages array
-            messages = []
-
-            # Add conversation history
-            if conversation_history:
-                for msg in conversation_history[-10:]:
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-            # Build current message with image
-            content = []
-            content.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": image_base64
-                }
-            })
-
-            if user_message:
-                content.append({
-                    "type": "text",
-                    "text": user_message
-                })
-            else:
-                content.append({
-                    "type": "text",
-                    "text": "What do you see on this screen? Describe what's happening and share any relevant observations or insights."
-                })
-
-            messages.append({
-                "role": "user",
-                "content": content
-            })
-
-            # Call Claude API
-            response = self.client.messages.create(
-                model=self.vision_model,
-                max_tokens=512,
-                system=enhanced_prompt,
-                messages=messages
-            )
-
-            return {
-                "response": response.content[0].text,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                },
-                "had_kb_context": bool(kb_section),
-                "had_task_context": bool(task_section)
-            }
-
-        except anthropic.APIError as e:
-            print(f"Claude API error: {e}")
-            return {
-                "response": "I'm having trouble analyzing the screen right now. Please try again in a moment.",
-                "error": str(e)
-            }
+        return await self._run(LLMRequest(
+            method="analyze_screen_with_context",
+            message=user_message,
+            conversation_history=conversation_history,
+            image_base64=image_base64,
+            kb_context=kb_context,
+            task_context=task_context,
+            with_context=True,
+            model=self.vision_model,
+            session_id=session_id
+        ))
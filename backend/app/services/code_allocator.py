@@ -0,0 +1,149 @@
+"""
+Code Allocator - Collision-free short join codes for sessions
+"""
+
+import math
+import random
+import threading
+from collections import deque
+from typing import Callable, Iterable, Optional, Set
+
+
+class CodeSpaceExhausted(Exception):
+    """Raised when every code in the configured space is in use"""
+
+
+class CodeAllocator:
+    """
+    Hands out unique fixed-length codes over an alphabet in O(1)
+
+    Fresh codes come from an affine permutation i -> (a*i + c) mod N of the
+    whole space, so every code is visited exactly once and consecutive
+    sessions don't get adjacent codes. Released codes go on a FIFO free list
+    and are reused before fresh ones, oldest first.
+
+    The allocator only knows about codes this process has seen. Other workers
+    sharing the database are caught when the database claim fails; the caller
+    then marks the code taken and allocates again.
+    """
+
+    def __init__(
+        self,
+        alphabet: str = "0123456789",
+        length: int = 4,
+        load_in_use: Optional[Callable[[], Iterable[str]]] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            alphabet: Characters codes are made of
+            length: Number of characters per code
+            load_in_use: Returns codes currently claimed in the database;
+                used to rescan the space when the permutation runs out
+            seed: Seed for the permutation (random if not given)
+        """
+        if len(set(alphabet)) != len(alphabet) or len(alphabet) < 2:
+            raise ValueError("Code alphabet needs at least 2 distinct characters")
+        if length < 1:
+            raise ValueError("Code length must be at least 1")
+
+        self.alphabet = alphabet
+        self.length = length
+        self.space = len(alphabet) ** length
+        self.load_in_use = load_in_use
+
+        rng = random.Random(seed)
+        self._multiplier = self._pick_multiplier(rng)
+        self._offset = rng.randrange(self.space)
+        self._cursor = 0
+
+        self._in_use: Set[str] = set()
+        self._free: deque = deque()
+        self._free_set: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _pick_multiplier(self, rng: random.Random) -> int:
+        """A multiplier coprime with the space size, so the map is a bijection"""
+        if self.space == 2:
+            return 1
+        while True:
+            candidate = rng.randrange(2, self.space)
+            if math.gcd(candidate, self.space) == 1:
+                return candidate
+
+    def _encode(self, index: int) -> str:
+        base = len(self.alphabet)
+        chars = []
+        for _ in range(self.length):
+            index, digit = divmod(index, base)
+            chars.append(self.alphabet[digit])
+        return "".join(reversed(chars))
+
+    def _next_fresh(self) -> Optional[str]:
+        while self._cursor < self.space:
+            code = self._encode((self._multiplier * self._cursor + self._offset) % self.space)
+            self._cursor += 1
+            if code not in self._in_use and code not in self._free_set:
+                return code
+        return None
+
+    def _rescan(self) -> bool:
+        """Restart the permutation against the database's view of used codes"""
+        if self.load_in_use is None:
+            return False
+        self._in_use = set(self.load_in_use())
+        self._free.clear()
+        self._free_set.clear()
+        self._cursor = 0
+        return len(self._in_use) < self.space
+
+    def allocate(self) -> str:
+        """
+        Reserve a code
+
+        Returns:
+            A code not in use by this process
+
+        Raises:
+            CodeSpaceExhausted: If every code is taken
+        """
+        with self._lock:
+            if self._free:
+                code = self._free.popleft()
+                self._free_set.discard(code)
+            else:
+                code = self._next_fresh()
+                if code is None and self._rescan():
+                    code = self._next_fresh()
+                if code is None:
+                    raise CodeSpaceExhausted(
+                        f"All {self.space} session codes are in use - "
+                        f"increase SESSION_CODE_LENGTH or SESSION_CODE_ALPHABET"
+                    )
+            self._in_use.add(code)
+            return code
+
+    def mark_in_use(self, codes: Iterable[str]):
+        """Record codes already claimed elsewhere (database or another worker)"""
+        with self._lock:
+            for code in codes:
+                if code in self._free_set:
+                    self._free_set.discard(code)
+                    self._free.remove(code)
+                self._in_use.add(code)
+
+    def release(self, code: str):
+        """Return a code to the free list"""
+        with self._lock:
+            if code in self._in_use:
+                self._in_use.discard(code)
+                self._free.append(code)
+                self._free_set.add(code)
+
+    def get_stats(self) -> dict:
+        return {
+            "space": self.space,
+            "in_use": len(self._in_use),
+            "free_list": len(self._free),
+            "unvisited": self.space - self._cursor
+        }
@@ -1,14 +1,21 @@
 """
-Database Service - SQLite persistence for sessions, KB feedback, and tasks
+Database Service - SQLite persistence for sessions, KB feedback, tasks, batch jobs, and usage
 """
 
 import sqlite3
-import json
 import os
+import time
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from contextlib import contextmanager
 
+from .metrics import metrics
+from .serializer import dumps_str, loads
+
+DB_OPERATION_SECONDS = metrics.histogram(
+    "akai_db_operation_seconds", "SQLite operation latency", ["operation"]
+)
+
 
 class Database:
     """SQLite database for persistent storage"""
@@ -22,8 +29,9 @@ class Database:
         self._init_db()
 
     @contextmanager
-    def _get_conn(self):
+    def _get_conn(self, operation: str = "other"):
         """Context manager for database connections"""
+        start = time.perf_counter()
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         try:
@@ -34,10 +42,11 @@ class Database:
             raise e
         finally:
             conn.close()
+            DB_OPERATION_SECONDS.labels(operation).observe(time.perf_counter() - start)
 
     def _init_db(self):
         """Initialize database tables"""
-        with self._get_conn() as conn:
+        with self._get_conn("init_db") as conn:
             cursor = conn.cursor()
 
             # Sessions table
@@ -47,10 +56,16 @@ class Database:
                     code TEXT UNIQUE,
                     created_at TEXT,
                     updated_at TEXT,
-                    messages TEXT DEFAULT '[]'
+                    messages TEXT DEFAULT '[]',
+                    status TEXT DEFAULT 'active'
                 )
             """)
 
+            # Older databases predate the status column
+            cursor.execute("PRAGMA table_info(sessions)")
+            if "status" not in {row["name"] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE sessions ADD COLUMN status TEXT DEFAULT 'active'")
+
             # KB feedback table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS kb_feedback (
@@ -61,6 +76,20 @@ class Database:
                 )
             """)
 
+            # KB articles table (used when KB_SOURCE=sqlite)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS kb_articles (
+                    id TEXT PRIMARY KEY,
+                    category TEXT,
+                    title TEXT,
+                    description TEXT,
+                    keywords TEXT DEFAULT '[]',
+                    solutions TEXT DEFAULT '[]',
+                    created_at TEXT,
+                    updated_at TEXT
+                )
+            """)
+
             # Task plans table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS task_plans (
@@ -78,9 +107,97 @@ class Database:
                 )
             """)
 
+            # Task steps table (one row per step so progress updates touch single rows)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_steps (
+                    id TEXT PRIMARY KEY,
+                    plan_id TEXT,
+                    step_order INTEGER,
+                    title TEXT,
+                    description TEXT,
+                    status TEXT DEFAULT 'pending',
+                    error_message TEXT,
+                    started_at TEXT,
+                    completed_at TEXT,
+                    FOREIGN KEY (plan_id) REFERENCES task_plans(id)
+                )
+            """)
+
+            # Offline Claude jobs sent through the Message Batches API
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS batch_jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT,
+                    target_id TEXT,
+                    payload TEXT DEFAULT '{}',
+                    status TEXT DEFAULT 'queued',
+                    batch_id TEXT,
+                    result TEXT,
+                    error TEXT,
+                    input_tokens INTEGER DEFAULT 0,
+                    output_tokens INTEGER DEFAULT 0,
+                    estimated_tokens INTEGER DEFAULT 0,
+                    created_at TEXT,
+                    updated_at TEXT
+                )
+            """)
+
+            # Older databases predate the submit-time estimate
+            cursor.execute("PRAGMA table_info(batch_jobs)")
+            if "estimated_tokens" not in {row["name"] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE batch_jobs ADD COLUMN estimated_tokens INTEGER DEFAULT 0")
+
+            # Summaries of closed sessions (written by batch jobs)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS session_summaries (
+                    session_id TEXT PRIMARY KEY,
+                    summary TEXT,
+                    job_id TEXT,
+                    created_at TEXT,
+                    FOREIGN KEY (session_id) REFERENCES sessions(id)
+                )
+            """)
+
+            # Claude and speech usage per session (lifetime) and per tenant (per day)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS session_usage (
+                    session_id TEXT PRIMARY KEY,
+                    tenant_id TEXT,
+                    requests INTEGER DEFAULT 0,
+                    input_tokens INTEGER DEFAULT 0,
+                    output_tokens INTEGER DEFAULT 0,
+                    cache_read_tokens INTEGER DEFAULT 0,
+                    cache_write_tokens INTEGER DEFAULT 0,
+                    images INTEGER DEFAULT 0,
+                    audio_seconds REAL DEFAULT 0,
+                    cost_usd REAL DEFAULT 0,
+                    updated_at TEXT
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS tenant_usage (
+                    tenant_id TEXT,
+                    day TEXT,
+                    requests INTEGER DEFAULT 0,
+                    input_tokens INTEGER DEFAULT 0,
+                    output_tokens INTEGER DEFAULT 0,
+                    cache_read_tokens INTEGER DEFAULT 0,
+                    cache_write_tokens INTEGER DEFAULT 0,
+                    images INTEGER DEFAULT 0,
+                    audio_seconds REAL DEFAULT 0,
+                    cost_usd REAL DEFAULT 0,
+                    updated_at TEXT,
+                    PRIMARY KEY (tenant_id, day)
+                )
+            """)
+
             # Create indexes
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_code ON sessions(code)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_plans_session ON task_plans(session_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_steps_plan ON task_steps(plan_id, step_order)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_batch_jobs_status ON batch_jobs(status, created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_batch_jobs_batch ON batch_jobs(batch_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_usage_tenant ON session_usage(tenant_id, cost_usd)")
 
     # ========================================================================
     # Sessions
@@ -89,9 +206,9 @@ class Database:
     def save_session(self, session_id: str, code: str, messages: List[Dict] = None):
         """Save or update a session"""
         now = datetime.now().isoformat()
-        messages_json = json.dumps(messages or [])
+        messages_json = dumps_str(messages or [])
 
-        with self._get_conn() as conn:
+        with self._get_conn("save_session") as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO sessions (id, code, created_at, updated_at, messages)
@@ -101,44 +218,148 @@ class Database:
                     messages = excluded.messages
             """, (session_id, code, now, now, messages_json))
 
-    def get_session(self, session_id: str) -> Optional[Dict]:
-        """Get a session by ID"""
-        with self._get_conn() as conn:
+    def claim_session_code(self, session_id: str, code: str, created_at: Optional[str] = None) -> bool:
+        """
+        Insert a new session holding a join code
+
+        Returns:
+            False if another session (possibly in another worker) holds the code
+        """
+        now = created_at or datetime.now().isoformat()
+
+        try:
+            with self._get_conn("claim_session_code") as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO sessions (id, code, created_at, updated_at, messages)
+                    VALUES (?, ?, ?, ?, '[]')
+                """, (session_id, code, now, now))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def release_session_code(self, session_id: str):
+        """Free a session's join code for reuse (the session itself is kept)"""
+        with self._get_conn("release_session_code") as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE sessions SET code = NULL WHERE id = ?", (session_id,))
+
+    def release_stale_session_codes(self, updated_before: str) -> int:
+        """
+        Free join codes of sessions not updated since the given ISO timestamp
+
+        Returns:
+            Number of codes released
+        """
+        with self._get_conn("release_stale_session_codes") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE sessions SET code = NULL
+                WHERE code IS NOT NULL AND updated_at < ?
+            """, (updated_before,))
+            return cursor.rowcount
+
+    def get_session_codes(self) -> List[str]:
+        """Get all join codes currently held by a session"""
+        with self._get_conn("get_session_codes") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT code FROM sessions WHERE code IS NOT NULL")
+            return [row["code"] for row in cursor.fetchall()]
+
+    def _session_from_row(self, cursor, row, message_limit: Optional[int]) -> Dict:
+        """Build a session dict, loading only the last message_limit messages if given"""
+        session = {
+            "id": row["id"],
+            "code": row["code"],
+            "created_at": row["created_at"],
+            "status": row["status"] or "active"
+        }
+
+        if message_limit is None:
+            session["messages"] = loads(row["messages"])
+            session["message_count"] = len(session["messages"])
+            return session
+
+        # Let SQLite slice the JSON array so older messages are never parsed in Python
+        cursor.execute("SELECT json_array_length(messages) FROM sessions WHERE id = ?", (row["id"],))
+        message_count = cursor.fetchone()[0] or 0
+        start = max(message_count - message_limit, 0)
+        cursor.execute("""
+            SELECT value FROM sessions, json_each(sessions.messages)
+            WHERE sessions.id = ? AND json_each.key >= ?
+            ORDER BY json_each.key
+        """, (row["id"], start))
+        session["messages"] = [loads(r["value"]) for r in cursor.fetchall()]
+        session["message_count"] = message_count
+        return session
+
+    def get_session(self, session_id: str, message_limit: Optional[int] = None) -> Optional[Dict]:
+        """Get a session by ID (with only its last message_limit messages if given)"""
+        columns = "id, code, created_at, status" + (", messages" if message_limit is None else "")
+        with self._get_conn("get_session") as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM sessions WHERE id = ?", (session_id,))
+            cursor.execute(f"SELECT {columns} FROM sessions WHERE id = ?", (session_id,))
             row = cursor.fetchone()
 
             if row:
-                return {
-                    "id": row["id"],
-                    "code": row["code"],
-                    "created_at": row["created_at"],
-                    "messages": json.loads(row["messages"])
-                }
+                return self._session_from_row(cursor, row, message_limit)
         return None
 
-    def get_session_by_code(self, code: str) -> Optional[Dict]:
-        """Get a session by short code"""
-        with self._get_conn() as conn:
+    def get_session_by_code(self, code: str, message_limit: Optional[int] = None) -> Optional[Dict]:
+        """Get a session by short code (with only its last message_limit messages if given)"""
+        columns = "id, code, created_at, status" + (", messages" if message_limit is None else "")
+        with self._get_conn("get_session_by_code") as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM sessions WHERE code = ?", (code,))
+            cursor.execute(f"SELECT {columns} FROM sessions WHERE code = ?", (code,))
             row = cursor.fetchone()
 
             if row:
-                return {
-                    "id": row["id"],
-                    "code": row["code"],
-                    "created_at": row["created_at"],
-                    "messages": json.loads(row["messages"])
-                }
+                return self._session_from_row(cursor, row, message_limit)
+        return None
+
+    def get_first_session_message(self, session_id: str, role: str) -> Optional[Dict]:
+        """Get the earliest message with the given role"""
+        with self._get_conn("get_first_session_message") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT value FROM sessions, json_each(sessions.messages)
+                WHERE sessions.id = ? AND json_extract(json_each.value, '$.role') = ?
+                ORDER BY json_each.key LIMIT 1
+            """, (session_id, role))
+            row = cursor.fetchone()
+
+            if row:
+                return loads(row["value"])
         return None
 
+    def append_session_message(self, session_id: str, message: Dict):
+        """Append one message without rewriting the history from Python"""
+        now = datetime.now().isoformat()
+
+        with self._get_conn("append_session_message") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE sessions SET messages = json_insert(messages, '$[#]', json(?)), updated_at = ?
+                WHERE id = ?
+            """, (dumps_str(message), now, session_id))
+
+    def update_session_status(self, session_id: str, status: str):
+        """Update session status"""
+        now = datetime.now().isoformat()
+
+        with self._get_conn("update_session_status") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE sessions SET status = ?, updated_at = ?
+                WHERE id = ?
+            """, (status, now, session_id))
+
     def update_session_messages(self, session_id: str, messages: List[Dict]):
         """Update session messages"""
         now = datetime.now().isoformat()
-        messages_json = json.dumps(messages)
+        messages_json = dumps_str(messages)
 
-        with self._get_conn() as conn:
+        with self._get_conn("update_session_messages") as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE sessions SET messages = ?, updated_at = ?
@@ -151,7 +372,7 @@ class Database:
 
     def get_solution_feedback(self, solution_id: str) -> Dict:
         """Get feedback stats for a solution"""
-        with self._get_conn() as conn:
+        with self._get_conn("get_solution_feedback") as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM kb_feedback WHERE solution_id = ?", (solution_id,))
             row = cursor.fetchone()
@@ -168,7 +389,7 @@ class Database:
         """Record feedback for a solution"""
         now = datetime.now().isoformat()
 
-        with self._get_conn() as conn:
+        with self._get_conn("record_solution_feedback") as conn:
             cursor = conn.cursor()
 
             # Get current counts
@@ -196,7 +417,7 @@ class Database:
 
     def get_all_feedback(self) -> List[Dict]:
         """Get all solution feedback for loading into KB"""
-        with self._get_conn() as conn:
+        with self._get_conn("get_all_feedback") as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM kb_feedback")
             rows = cursor.fetchall()
@@ -207,6 +428,96 @@ class Database:
                 "failure_count": row["failure_count"]
             } for row in rows]
 
+    def get_kb_articles(self) -> List[Dict]:
+        """Get all KB articles (problems with their solutions)"""
+        with self._get_conn("get_kb_articles") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM kb_articles ORDER BY category, title")
+            rows = cursor.fetchall()
+
+            return [{
+                "id": row["id"],
+                "category": row["category"],
+                "title": row["title"],
+                "description": row["description"] or "",
+                "keywords": loads(row["keywords"] or "[]"),
+                "solutions": loads(row["solutions"] or "[]"),
+                "created_at": row["created_at"]
+            } for row in rows]
+
+    def get_kb_articles_version(self) -> List:
+        """Row count and latest update of kb_articles (changes whenever an article does)"""
+        with self._get_conn("get_kb_articles_version") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*), MAX(updated_at) FROM kb_articles")
+            return list(cursor.fetchone())
+
+    def save_kb_article(self, article: Dict):
+        """Insert or replace a KB article"""
+        now = datetime.now().isoformat()
+
+        with self._get_conn("save_kb_article") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO kb_articles (id, category, title, description, keywords, solutions, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    category = excluded.category,
+                    title = excluded.title,
+                    description = excluded.description,
+                    keywords = excluded.keywords,
+                    solutions = excluded.solutions,
+                    updated_at = excluded.updated_at
+            """, (
+                article["id"], article["category"], article["title"],
+                article.get("description", ""),
+                dumps_str(article.get("keywords", [])),
+                dumps_str(article.get("solutions", [])),
+                article.get("created_at") or now, now
+            ))
+
+    def update_kb_article_keywords(self, article_id: str, keywords: List[str]) -> bool:
+        """Replace an article's keywords"""
+        now = datetime.now().isoformat()
+
+        with self._get_conn("update_kb_article_keywords") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE kb_articles SET keywords = ?, updated_at = ?
+                WHERE id = ?
+            """, (dumps_str(keywords), now, article_id))
+            return cursor.rowcount > 0
+
+    def get_kb_articles_without_keywords(self, limit: int = 100) -> List[Dict]:
+        """Articles with an empty keyword list and no keyword job pending or failed"""
+        with self._get_conn("get_kb_articles_without_keywords") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT a.id, a.category, a.title, a.description, a.solutions FROM kb_articles a
+                WHERE (a.keywords IS NULL OR json_array_length(a.keywords) = 0)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM batch_jobs j
+                      WHERE j.kind = 'kb_keywords' AND j.target_id = a.id AND j.status IN ('queued', 'submitted', 'failed')
+                  )
+                ORDER BY a.updated_at LIMIT ?
+            """, (limit,))
+            rows = cursor.fetchall()
+
+            return [{
+                "id": row["id"],
+                "category": row["category"],
+                "title": row["title"],
+                "description": row["description"] or "",
+                "solutions": loads(row["solutions"] or "[]")
+            } for row in rows]
+
+    def delete_kb_article(self, article_id: str) -> bool:
+        """Delete a KB article"""
+        with self._get_conn("delete_kb_article") as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM kb_articles WHERE id = ?", (article_id,))
+            return cursor.rowcount > 0
+
     # ========================================================================
     # Task Plans
     # ========================================================================
@@ -214,9 +525,9 @@ class Database:
     def save_task_plan(self, plan: Dict):
         """Save or update a task plan"""
         now = datetime.now().isoformat()
-        steps_json = json.dumps(plan.get("steps", []))
+        steps_json = dumps_str(plan.get("steps", []))
 
-        with self._get_conn() as conn:
+        with self._get_conn("save_task_plan") as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO task_plans (id, session_id, title, description, template_id,
@@ -240,36 +551,158 @@ class Database:
                 plan.get("completed_at")
             ))
 
+    def create_task_plan(self, plan: Dict):
+        """Insert a new task plan with one task_steps row per step"""
+        with self._get_conn("create_task_plan") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO task_plans (id, session_id, title, description, template_id,
+                                        status, created_at, started_at, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                plan["id"],
+                plan.get("session_id"),
+                plan.get("title"),
+                plan.get("description"),
+                plan.get("template_id"),
+                plan.get("status", "created"),
+                plan.get("created_at"),
+                plan.get("started_at"),
+                plan.get("completed_at")
+            ))
+            cursor.executemany("""
+                INSERT INTO task_steps (id, plan_id, step_order, title, description,
+                                        status, error_message, started_at, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                step["id"],
+                plan["id"],
+                step["order"],
+                step["title"],
+                step["description"],
+                step.get("status", "pending"),
+                step.get("error_message"),
+                step.get("started_at"),
+                step.get("completed_at")
+            ) for step in plan.get("steps", [])])
+
+    def update_task_progress(self, plan: Optional[Dict] = None, steps: Optional[List[Dict]] = None):
+        """
+        Write a plan transition in one transaction
+
+        Args:
+            plan: Plan dict whose status/started_at/completed_at changed, if any
+            steps: Step dicts that changed
+        """
+        with self._get_conn("update_task_progress") as conn:
+            cursor = conn.cursor()
+            if plan:
+                cursor.execute("""
+                    UPDATE task_plans SET status = ?, started_at = ?, completed_at = ?
+                    WHERE id = ?
+                """, (plan["status"], plan.get("started_at"), plan.get("completed_at"), plan["id"]))
+            if steps:
+                cursor.executemany("""
+                    UPDATE task_steps SET status = ?, error_message = ?, started_at = ?, completed_at = ?
+                    WHERE id = ?
+                """, [(
+                    step["status"],
+                    step.get("error_message"),
+                    step.get("started_at"),
+                    step.get("completed_at"),
+                    step["id"]
+                ) for step in steps])
+
+    def _task_plan_from_row(self, row, step_rows) -> Dict:
+        if step_rows:
+            steps = [{
+                "id": step["id"],
+                "plan_id": step["plan_id"],
+                "order": step["step_order"],
+                "title": step["title"],
+                "description": step["description"],
+                "status": step["status"],
+                "error_message": step["error_message"],
+                "started_at": step["started_at"],
+                "completed_at": step["completed_at"]
+            } for step in step_rows]
+        else:
+            # Plans saved with save_task_plan keep their steps as JSON
+            steps = loads(row["steps"] or "[]")
+
+        return {
+            "id": row["id"],
+            "session_id": row["session_id"],
+            "title": row["title"],
+            "description": row["description"],
+            "template_id": row["template_id"],
+            "status": row["status"],
+            "steps": steps,
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "completed_at": row["completed_at"]
+        }
+
     def get_task_plan(self, plan_id: str) -> Optional[Dict]:
         """Get a task plan by ID"""
-        with self._get_conn() as conn:
+        with self._get_conn("get_task_plan") as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM task_plans WHERE id = ?", (plan_id,))
             row = cursor.fetchone()
 
             if row:
-                return {
-                    "id": row["id"],
-                    "session_id": row["session_id"],
-                    "title": row["title"],
-                    "description": row["description"],
-                    "template_id": row["template_id"],
-                    "status": row["status"],
-                    "steps": json.loads(row["steps"]),
-                    "created_at": row["created_at"],
-                    "started_at": row["started_at"],
-                    "completed_at": row["completed_at"]
-                }
+                cursor.execute("""
+                    SELECT * FROM task_steps WHERE plan_id = ? ORDER BY step_order
+                """, (plan_id,))
+                return self._task_plan_from_row(row, cursor.fetchall())
         return None
 
-    def get_session_plans(self, session_id: str) -> List[Dict]:
-        """Get all plans for a session"""
-        with self._get_conn() as conn:
+    def get_session_task_plans(self, session_id: str, statuses: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Full plans (with steps) for a session, newest first
+
+        Reads the plans and all their steps in two queries instead of one
+        get_task_plan call per plan.
+        """
+        condition = "session_id = ?"
+        params: List[Any] = [session_id]
+        if statuses:
+            condition += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+
+        with self._get_conn("get_session_task_plans") as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM task_plans WHERE session_id = ?
-                ORDER BY created_at DESC
-            """, (session_id,))
+            cursor.execute(f"SELECT * FROM task_plans WHERE {condition} ORDER BY created_at DESC", params)
+            rows = cursor.fetchall()
+            if not rows:
+                return []
+
+            cursor.execute(f"""
+                SELECT * FROM task_steps
+                WHERE plan_id IN (SELECT id FROM task_plans WHERE {condition})
+                ORDER BY plan_id, step_order
+            """, params)
+            steps_by_plan: Dict[str, List] = {}
+            for step in cursor.fetchall():
+                steps_by_plan.setdefault(step["plan_id"], []).append(step)
+
+            return [self._task_plan_from_row(row, steps_by_plan.get(row["id"])) for row in rows]
+
+    def get_session_plans(self, session_id: str, statuses: Optional[List[str]] = None) -> List[Dict]:
+        """Get all plans for a session, optionally only those in the given statuses"""
+        with self._get_conn("get_session_plans") as conn:
+            cursor = conn.cursor()
+            if statuses:
+                placeholders = ", ".join("?" * len(statuses))
+                cursor.execute(f"""
+                    SELECT * FROM task_plans WHERE session_id = ? AND status IN ({placeholders})
+                    ORDER BY created_at DESC
+                """, (session_id, *statuses))
+            else:
+                cursor.execute("""
+                    SELECT * FROM task_plans WHERE session_id = ?
+                    ORDER BY created_at DESC
+                """, (session_id,))
             rows = cursor.fetchall()
 
             return [{
@@ -280,6 +713,272 @@ class Database:
                 "created_at": row["created_at"]
             } for row in rows]
 
+    # ========================================================================
+    # Batch Jobs
+    # ========================================================================
+
+    def _batch_job_from_row(self, row) -> Dict:
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "target_id": row["target_id"],
+            "payload": loads(row["payload"] or "{}"),
+            "status": row["status"],
+            "batch_id": row["batch_id"],
+            "result": row["result"],
+            "error": row["error"],
+            "input_tokens": row["input_tokens"],
+            "output_tokens": row["output_tokens"],
+            "estimated_tokens": row["estimated_tokens"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"]
+        }
+
+    def create_batch_job(self, job: Dict):
+        """Queue a batch job"""
+        now = datetime.now().isoformat()
+
+        with self._get_conn("create_batch_job") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO batch_jobs (id, kind, target_id, payload, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'queued', ?, ?)
+            """, (job["id"], job["kind"], job.get("target_id"), dumps_str(job.get("payload", {})), now, now))
+
+    def get_batch_job(self, job_id: str) -> Optional[Dict]:
+        with self._get_conn("get_batch_job") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM batch_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+
+            if row:
+                return self._batch_job_from_row(row)
+        return None
+
+    def get_batch_jobs(self, status: Optional[str] = None, limit: int = 100,
+                       batch_id: Optional[str] = None) -> List[Dict]:
+        """Jobs oldest first, optionally filtered by status or batch"""
+        query = "SELECT * FROM batch_jobs"
+        conditions, params = [], []
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if batch_id:
+            conditions.append("batch_id = ?")
+            params.append(batch_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created_at LIMIT ?"
+        params.append(limit)
+
+        with self._get_conn("get_batch_jobs") as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return [self._batch_job_from_row(row) for row in cursor.fetchall()]
+
+    def get_open_batch_ids(self) -> List[str]:
+        """Batches with jobs still waiting for results"""
+        with self._get_conn("get_open_batch_ids") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT batch_id FROM batch_jobs WHERE status = 'submitted'")
+            return [row["batch_id"] for row in cursor.fetchall()]
+
+    def get_batch_job_counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        with self._get_conn("get_batch_job_counts") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) AS count FROM batch_jobs GROUP BY status")
+            return {row["status"]: row["count"] for row in cursor.fetchall()}
+
+    def get_batch_tokens_since(self, since: str) -> int:
+        """
+        Tokens committed to batch jobs since a timestamp
+
+        Finished jobs count their actual input and output tokens, jobs still
+        in a batch count the estimate they were submitted with.
+        """
+        with self._get_conn("get_batch_tokens_since") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COALESCE(SUM(CASE WHEN status = 'submitted' THEN estimated_tokens
+                                         ELSE input_tokens + output_tokens END), 0)
+                FROM batch_jobs
+                WHERE status IN ('submitted', 'succeeded', 'failed') AND updated_at >= ?
+            """, (since,))
+            return cursor.fetchone()[0]
+
+    def mark_batch_jobs_submitted(self, jobs: List[Tuple[str, int]], batch_id: str):
+        """Record the batch a set of queued jobs went out in, with each job's (id, estimated tokens)"""
+        now = datetime.now().isoformat()
+
+        with self._get_conn("mark_batch_jobs_submitted") as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                UPDATE batch_jobs SET status = 'submitted', batch_id = ?, estimated_tokens = ?, updated_at = ?
+                WHERE id = ?
+            """, [(batch_id, estimate, now, job_id) for job_id, estimate in jobs])
+
+    def finish_batch_job(self, job_id: str, status: str, result: Optional[str] = None,
+                         error: Optional[str] = None, input_tokens: int = 0, output_tokens: int = 0):
+        """
+        Store a job's outcome
+
+        Screenshots are dropped from the payload once the job is done with them;
+        requeued jobs ('queued') keep theirs and lose their batch.
+        """
+        now = datetime.now().isoformat()
+
+        with self._get_conn("finish_batch_job") as conn:
+            cursor = conn.cursor()
+            if status == "queued":
+                cursor.execute("""
+                    UPDATE batch_jobs SET status = 'queued', batch_id = NULL, error = ?, updated_at = ?
+                    WHERE id = ?
+                """, (error, now, job_id))
+                return
+            cursor.execute("""
+                UPDATE batch_jobs SET status = ?, result = ?, error = ?, input_tokens = ?, output_tokens = ?,
+                    payload = json_remove(payload, '$.image'), updated_at = ?
+                WHERE id = ?
+            """, (status, result, error, input_tokens, output_tokens, now, job_id))
+
+    # ========================================================================
+    # Session Summaries
+    # ========================================================================
+
+    def save_session_summary(self, session_id: str, summary: str, job_id: Optional[str] = None):
+        now = datetime.now().isoformat()
+
+        with self._get_conn("save_session_summary") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO session_summaries (session_id, summary, job_id, created_at)
+                VALUES (?, ?, ?, ?)
+            """, (session_id, summary, job_id, now))
+
+    def get_session_summary(self, session_id: str) -> Optional[Dict]:
+        with self._get_conn("get_session_summary") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM session_summaries WHERE session_id = ?", (session_id,))
+            row = cursor.fetchone()
+
+            if row:
+                return dict(row)
+        return None
+
+    def get_sessions_to_summarize(self, limit: int = 100) -> List[str]:
+        """Closed sessions with messages, no summary and no summary job pending or failed"""
+        with self._get_conn("get_sessions_to_summarize") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT s.id FROM sessions s
+                WHERE s.status IN ('resolved', 'escalated', 'closed')
+                  AND json_array_length(s.messages) > 0
+                  AND NOT EXISTS (SELECT 1 FROM session_summaries m WHERE m.session_id = s.id)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM batch_jobs j
+                      WHERE j.kind = 'session_summary' AND j.target_id = s.id AND j.status IN ('queued', 'submitted', 'failed')
+                  )
+                ORDER BY s.updated_at LIMIT ?
+            """, (limit,))
+            return [row["id"] for row in cursor.fetchall()]
+
+
+    # ========================================================================
+    # Usage
+    # ========================================================================
+
+    def add_usage(self, session_rows: List[Dict], tenant_rows: List[Dict]):
+        """
+        Add usage deltas to the session and tenant totals in one transaction
+
+        Args:
+            session_rows: Dicts with session_id, tenant_id and the usage counters
+            tenant_rows: Dicts with tenant_id, day and the usage counters
+        """
+        now = datetime.now().isoformat()
+        with self._get_conn("add_usage") as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO session_usage (session_id, tenant_id, requests, input_tokens, output_tokens,
+                                           cache_read_tokens, cache_write_tokens, images, audio_seconds,
+                                           cost_usd, updated_at)
+                VALUES (:session_id, :tenant_id, :requests, :input_tokens, :output_tokens,
+                        :cache_read_tokens, :cache_write_tokens, :images, :audio_seconds, :cost_usd, :updated_at)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    tenant_id = excluded.tenant_id,
+                    requests = requests + excluded.requests,
+                    input_tokens = input_tokens + excluded.input_tokens,
+                    output_tokens = output_tokens + excluded.output_tokens,
+                    cache_read_tokens = cache_read_tokens + excluded.cache_read_tokens,
+                    cache_write_tokens = cache_write_tokens + excluded.cache_write_tokens,
+                    images = images + excluded.images,
+                    audio_seconds = audio_seconds + excluded.audio_seconds,
+                    cost_usd = cost_usd + excluded.cost_usd,
+                    updated_at = excluded.updated_at
+            """, [{**row, "updated_at": now} for row in session_rows])
+            cursor.executemany("""
+                INSERT INTO tenant_usage (tenant_id, day, requests, input_tokens, output_tokens,
+                                          cache_read_tokens, cache_write_tokens, images, audio_seconds,
+                                          cost_usd, updated_at)
+                VALUES (:tenant_id, :day, :requests, :input_tokens, :output_tokens,
+                        :cache_read_tokens, :cache_write_tokens, :images, :audio_seconds, :cost_usd, :updated_at)
+                ON CONFLICT(tenant_id, day) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    input_tokens = input_tokens + excluded.input_tokens,
+                    output_tokens = output_tokens + excluded.output_tokens,
+                    cache_read_tokens = cache_read_tokens + excluded.cache_read_tokens,
+                    cache_write_tokens = cache_write_tokens + excluded.cache_write_tokens,
+                    images = images + excluded.images,
+                    audio_seconds = audio_seconds + excluded.audio_seconds,
+                    cost_usd = cost_usd + excluded.cost_usd,
+                    updated_at = excluded.updated_at
+            """, [{**row, "updated_at": now} for row in tenant_rows])
+
+    def get_session_usage(self, session_id: str) -> Optional[Dict]:
+        with self._get_conn("get_session_usage") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM session_usage WHERE session_id = ?", (session_id,))
+            row = cursor.fetchone()
+
+            if row:
+                return dict(row)
+        return None
+
+    def get_sessions_usage(self, tenant_id: str, limit: int = 20) -> List[Dict]:
+        """A tenant's most expensive sessions"""
+        with self._get_conn("get_sessions_usage") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM session_usage WHERE tenant_id = ?
+                ORDER BY cost_usd DESC LIMIT ?
+            """, (tenant_id, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_tenant_usage(self, tenant_id: str, since_day: str) -> List[Dict]:
+        """A tenant's usage per day (YYYY-MM-DD), oldest first"""
+        with self._get_conn("get_tenant_usage") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM tenant_usage WHERE tenant_id = ? AND day >= ?
+                ORDER BY day
+            """, (tenant_id, since_day))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_tenants_usage(self, since_day: str) -> List[Dict]:
+        """Usage summed per tenant since a day, most expensive first"""
+        with self._get_conn("get_tenants_usage") as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT tenant_id, SUM(requests) AS requests, SUM(input_tokens) AS input_tokens,
+                       SUM(output_tokens) AS output_tokens, SUM(cache_read_tokens) AS cache_read_tokens,
+                       SUM(cache_write_tokens) AS cache_write_tokens, SUM(images) AS images,
+                       SUM(audio_seconds) AS audio_seconds, SUM(cost_usd) AS cost_usd
+                FROM tenant_usage WHERE day >= ?
+                GROUP BY tenant_id ORDER BY cost_usd DESC
+            """, (since_day,))
+            return [dict(row) for row in cursor.fetchall()]
+
 
 # Singleton instance
 db = Database()
@@ -0,0 +1,140 @@
+"""
+KB Cache - Memoized Knowledge Base rankings
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from .metrics import metrics
+
+KB_QUERY_CACHE_REQUESTS = metrics.counter(
+    "akai_kb_query_cache_requests_total", "KB query cache lookups by result", ["result"]
+)
+KB_QUERY_CACHE_INVALIDATIONS = metrics.counter(
+    "akai_kb_query_cache_invalidations_total", "KB query cache entries dropped before expiry", ["reason"]
+)
+
+# (normalized query, lowercased category or "")
+QueryKey = Tuple[str, str]
+
+
+class CachedQuery:
+    """
+    Ranking for one query against one KB generation
+
+    ranked holds (problem index, match score, semantic score) best first;
+    top_solution_ids is the context solution order, filled in on first use.
+    """
+
+    __slots__ = ("state", "ranked", "problem_ids", "top_solution_ids", "expires_at")
+
+    def __init__(self, state: Any, ranked: List[Tuple[int, float, Optional[float]]], problem_ids: List[str]):
+        self.state = state
+        self.ranked = ranked
+        self.problem_ids = problem_ids  # Problems whose feedback can change this entry
+        self.top_solution_ids: Optional[List[str]] = None
+        self.expires_at = 0.0
+
+
+class QueryCache:
+    """
+    LRU + TTL cache of query rankings
+
+    Entries remember the KB state they were computed from and are ignored
+    once another state has been swapped in. Problems map back to the entries
+    that depend on them so feedback on one solution drops only those.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[QueryKey, CachedQuery]" = OrderedDict()
+        self._by_problem: Dict[str, Set[QueryKey]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key: QueryKey, state: Any) -> Optional[CachedQuery]:
+        """Cached ranking for key against state, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.state is not state or entry.expires_at <= time.monotonic()):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                KB_QUERY_CACHE_REQUESTS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            KB_QUERY_CACHE_REQUESTS.labels("hit").inc()
+            return entry
+
+    def put(self, key: QueryKey, entry: CachedQuery):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remove(key)
+            entry.expires_at = time.monotonic() + self.ttl
+            self._entries[key] = entry
+            for problem_id in entry.problem_ids:
+                self._by_problem.setdefault(problem_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_problem(self, problem_id: str) -> int:
+        """Drop entries that depend on a problem (e.g. after feedback on one of its solutions)"""
+        with self._lock:
+            keys = self._by_problem.pop(problem_id, set())
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        if keys:
+            KB_QUERY_CACHE_INVALIDATIONS.labels("feedback").inc(len(keys))
+        return len(keys)
+
+    def clear(self):
+        """Drop everything (problems added or a new KB version loaded)"""
+        with self._lock:
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._by_problem.clear()
+            self.invalidations += dropped
+        if dropped:
+            KB_QUERY_CACHE_INVALIDATIONS.labels("reload").inc(dropped)
+
+    def _remove(self, key: QueryKey):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for problem_id in entry.problem_ids:
+            keys = self._by_problem.get(problem_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_problem[problem_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
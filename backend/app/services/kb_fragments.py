@@ -0,0 +1,77 @@
+"""
+KB Fragments - Pre-encoded JSON for Knowledge Base problems and solutions
+
+Problem and solution content never changes within a KB version, so each
+one is encoded to JSON bytes once. Only the feedback counters and match
+scores are spliced in when a response is written. The output is byte for
+byte what serializing the equivalent to_dict() would produce.
+"""
+
+from typing import Any, Optional
+
+from .serializer import dumps as encode
+
+
+class SolutionFragment:
+    """Encoded solution with a gap for success/failure counts"""
+
+    __slots__ = ("head", "tail")
+
+    def __init__(self, solution):
+        self.head = encode({
+            "id": solution.id,
+            "problem_id": solution.problem_id,
+            "title": solution.title,
+            "steps": solution.steps
+        })[:-1] + b',"success_count":'
+        self.tail = b',"created_at":' + encode(solution.created_at)
+
+    def render(self, solution, problem_title: Optional[bytes] = None) -> bytes:
+        """
+        Args:
+            solution: Live Solution (its counters are read now)
+            problem_title: Encoded title to append as "problem_title"
+        """
+        stats = b'%d,"failure_count":%d,"success_rate":%s' % (
+            solution.success_count, solution.failure_count, repr(solution.success_rate).encode()
+        )
+        if problem_title is None:
+            return self.head + stats + self.tail + b"}"
+        return self.head + stats + self.tail + b',"problem_title":' + problem_title + b"}"
+
+
+class ProblemFragment:
+    """Encoded problem and its solutions"""
+
+    __slots__ = ("head", "title", "solutions")
+
+    def __init__(self, problem):
+        self.head = encode({
+            "id": problem.id,
+            "category": problem.category,
+            "title": problem.title,
+            "description": problem.description,
+            "keywords": problem.keywords,
+            "created_at": problem.created_at
+        })[:-1] + b',"solutions":['
+        self.title = encode(problem.title)
+        self.solutions = {s.id: SolutionFragment(s) for s in problem.solutions}
+
+    def render(
+        self,
+        problem,
+        match_score: Any,
+        semantic_score: Optional[float] = None,
+        with_problem_title: bool = False
+    ) -> bytes:
+        """Problem as a search result (match_score, and semantic_score if set)"""
+        title = self.title if with_problem_title else None
+        solutions = b",".join(self.solutions[s.id].render(s, title) for s in problem.solutions)
+        scores = b'],"match_score":' + repr(match_score).encode()
+        if semantic_score is not None:
+            scores += b',"semantic_score":' + repr(semantic_score).encode()
+        return self.head + solutions + scores + b"}"
+
+    def render_solution(self, solution) -> bytes:
+        """One solution with this problem's title appended (context form)"""
+        return self.solutions[solution.id].render(solution, self.title)
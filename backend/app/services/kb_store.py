@@ -0,0 +1,278 @@
+"""
+KB Store - External knowledge base sources and compiled snapshots
+
+Problems can be authored as JSON/YAML files in a directory or as rows in the
+kb_articles SQLite table. Either source is compiled into a binary snapshot:
+
+    header   magic, format version, record count, source fingerprint,
+             index offset and length
+    offsets  (offset, length) of each record
+    records  one compact JSON object per problem (with its solutions)
+    index    JSON of the prebuilt search index, automaton included
+
+Loading a snapshot maps the file and decodes it without rebuilding the index.
+
+    python -m app.services.kb_store export data/kb            # built-in KB -> JSON files
+    python -m app.services.kb_store compile data/kb data/kb_snapshot.bin
+
+KB_SOURCE can point at the directory, "sqlite", or a compiled snapshot.
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import uuid
+import struct
+import hashlib
+import importlib.util
+from typing import Dict, List, Any, Optional
+
+from .serializer import dumps, loads
+
+# Fixed namespace so problem and solution IDs are stable across restarts and
+# workers (feedback in kb_feedback is keyed by solution ID)
+KB_NAMESPACE = uuid.UUID("6f0b8f3e-2a4d-5c1e-9b7a-3d2e1f0a4b5c")
+
+SNAPSHOT_MAGIC = b"AKAIKBSN"
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct("<8sII32sQQ")  # magic, version, count, fingerprint, index offset, index length
+_ENTRY = struct.Struct("<QI")           # record offset, record length
+
+_HAS_YAML = importlib.util.find_spec("yaml") is not None
+
+
+def problem_id_for(category: str, title: str) -> str:
+    return str(uuid.uuid5(KB_NAMESPACE, f"problem:{category.lower()}:{title.lower()}"))
+
+
+def solution_id_for(problem_id: str, title: str) -> str:
+    return str(uuid.uuid5(KB_NAMESPACE, f"solution:{problem_id}:{title.lower()}"))
+
+
+def normalize_record(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate a problem record and fill in deterministic IDs
+
+    Raises:
+        ValueError: If a required field is missing
+    """
+    for key in ("category", "title"):
+        if not data.get(key):
+            raise ValueError(f"KB problem is missing '{key}': {data!r:.100}")
+
+    problem_id = data.get("id") or problem_id_for(data["category"], data["title"])
+    solutions = []
+    for solution in data.get("solutions", []):
+        if not solution.get("title"):
+            raise ValueError(f"KB solution in '{data['title']}' is missing 'title'")
+        solutions.append({
+            "id": solution.get("id") or solution_id_for(problem_id, solution["title"]),
+            "title": solution["title"],
+            "steps": list(solution.get("steps", []))
+        })
+
+    return {
+        "id": problem_id,
+        "category": data["category"],
+        "title": data["title"],
+        "description": data.get("description", ""),
+        "keywords": list(data.get("keywords", [])),
+        "solutions": solutions,
+        "created_at": data.get("created_at")
+    }
+
+
+def unique_records(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop earlier records that share an ID with a later one"""
+    by_id = {}
+    for record in records:
+        if record["id"] in by_id:
+            print(f"⚠️ Duplicate KB problem '{record['title']}' - keeping the last definition")
+            del by_id[record["id"]]
+        by_id[record["id"]] = record
+    return list(by_id.values())
+
+
+class DirectorySource:
+    """Problems from *.json / *.yaml / *.yml files (one problem, a list, or {"problems": [...]})"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = f"dir:{path}"
+
+    def _files(self) -> List[str]:
+        extensions = (".json", ".yaml", ".yml") if _HAS_YAML else (".json",)
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith(extensions):
+                    files.append(os.path.join(root, name))
+        return sorted(files)
+
+    def fingerprint(self) -> str:
+        """Hash of file names, sizes and mtimes - cheap enough to poll"""
+        digest = hashlib.sha256()
+        for path in self._files():
+            stat = os.stat(path)
+            digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+
+    def load(self) -> List[Dict[str, Any]]:
+        if not _HAS_YAML and any(
+            name.endswith((".yaml", ".yml")) for _, _, names in os.walk(self.path) for name in names
+        ):
+            print("⚠️ Skipping YAML KB files - install PyYAML to load them")
+
+        records = []
+        for path in self._files():
+            with open(path, encoding="utf-8") as f:
+                if path.endswith(".json"):
+                    data = json.load(f)
+                else:
+                    import yaml
+                    data = yaml.safe_load(f)
+            if isinstance(data, dict) and "problems" in data:
+                data = data["problems"]
+            for item in data if isinstance(data, list) else [data]:
+                records.append(normalize_record(item))
+        return unique_records(records)
+
+
+class SQLiteSource:
+    """Problems from the kb_articles table"""
+
+    name = "sqlite:kb_articles"
+
+    def __init__(self, database):
+        self.database = database
+
+    def fingerprint(self) -> str:
+        version = self.database.get_kb_articles_version()
+        return hashlib.sha256(json.dumps(version).encode()).hexdigest()
+
+    def load(self) -> List[Dict[str, Any]]:
+        return unique_records([normalize_record(a) for a in self.database.get_kb_articles()])
+
+
+class SnapshotSource:
+    """A snapshot compiled elsewhere (e.g. in CI) and dropped into place"""
+
+    def __init__(self, path: str):
+        self.snapshot_path = path
+        self.name = f"snapshot:{path}"
+
+    def fingerprint(self) -> str:
+        fingerprint = read_snapshot_fingerprint(self.snapshot_path)
+        if fingerprint is None:
+            raise ValueError(f"Not a readable KB snapshot: {self.snapshot_path}")
+        return fingerprint
+
+
+def open_source(spec: str):
+    """KB_SOURCE value -> source ('sqlite', a directory, or a snapshot file)"""
+    if spec == "sqlite":
+        from .database import db
+        return SQLiteSource(db)
+    if os.path.isdir(spec):
+        return DirectorySource(spec)
+    if os.path.isfile(spec):
+        return SnapshotSource(spec)
+    raise ValueError(f"KB_SOURCE not found: {spec}")
+
+
+class Snapshot:
+    """Decoded contents of a snapshot file"""
+
+    def __init__(self, fingerprint: str, records: List[Dict[str, Any]], index: Dict[str, Any]):
+        self.fingerprint = fingerprint
+        self.records = records
+        self.index = index
+
+
+def write_snapshot(path: str, records: List[Dict[str, Any]], index: Dict[str, Any], fingerprint: str):
+    """Write a snapshot atomically (readers see the old file or the new one)"""
+    encoded = [dumps(r) for r in records]
+    index_bytes = dumps(index)
+
+    data_start = _HEADER.size + _ENTRY.size * len(encoded)
+    entries = []
+    offset = data_start
+    for record in encoded:
+        entries.append(_ENTRY.pack(offset, len(record)))
+        offset += len(record)
+
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(encoded),
+        bytes.fromhex(fingerprint), offset, len(index_bytes)
+    )
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp{os.getpid()}"
+    with open(temp_path, "wb") as out:
+        out.write(header)
+        out.writelines(entries)
+        out.writelines(encoded)
+        out.write(index_bytes)
+    os.replace(temp_path, path)
+
+
+def _read_header(buffer) -> tuple:
+    magic, version, count, fingerprint, index_offset, index_length = _HEADER.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("Not a KB snapshot (or an incompatible format version)")
+    return count, fingerprint.hex(), index_offset, index_length
+
+
+def read_snapshot_fingerprint(path: str) -> Optional[str]:
+    """Source fingerprint a snapshot was compiled from, or None if unreadable"""
+    try:
+        with open(path, "rb") as f:
+            return _read_header(f.read(_HEADER.size))[1]
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def read_snapshot(path: str) -> Snapshot:
+    """Map a snapshot file and decode its records and index"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        count, fingerprint, index_offset, index_length = _read_header(buffer)
+        records = []
+        for i in range(count):
+            offset, length = _ENTRY.unpack_from(buffer, _HEADER.size + i * _ENTRY.size)
+            records.append(loads(buffer[offset:offset + length]))
+        index = loads(buffer[index_offset:index_offset + index_length])
+    return Snapshot(fingerprint, records, index)
+
+
+def _main(argv: List[str]):
+    usage = (
+        "usage: python -m app.services.kb_store export <dir>\n"
+        "       python -m app.services.kb_store compile <dir|sqlite> <snapshot>"
+    )
+    if len(argv) == 2 and argv[0] == "export":
+        from .knowledge_base import KnowledgeBase
+        os.makedirs(argv[1], exist_ok=True)
+        kb = KnowledgeBase(source="")
+        for problem in kb.problems.values():
+            record = problem.to_record()
+            name = re.sub(r"[^a-z0-9]+", "-", f"{problem.category} {problem.title}".lower()).strip("-")
+            with open(os.path.join(argv[1], f"{name}.json"), "w", encoding="utf-8") as out:
+                json.dump(record, out, indent=2)
+        print(f"Exported {len(kb.problems)} problems to {argv[1]}")
+    elif len(argv) == 3 and argv[0] == "compile":
+        from .knowledge_base import build_search_index_spec, Problem
+        source = open_source(argv[1])
+        records = source.load()
+        index = build_search_index_spec([Problem.from_record(r) for r in records])
+        write_snapshot(argv[2], records, index, source.fingerprint())
+        print(f"Compiled {len(records)} problems from {source.name} into {argv[2]}")
+    else:
+        raise SystemExit(usage)
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
@@ -0,0 +1,265 @@
+"""
+KB Vectors - Dense vector retrieval for Knowledge Base matching
+
+Catches paraphrases that keyword matching misses. Each problem is encoded
+into a row of a contiguous float32 matrix and a query is one matrix-vector
+product plus a partial sort. NumPy is optional; without it semantic search
+is simply unavailable.
+
+Encoders:
+    hashed-tfidf   (default) word and character-trigram features hashed into
+                   a fixed number of dimensions, weighted by IDF over the KB
+    sentence model KB_EMBEDDING_MODEL names a sentence-transformers model
+                   (used if that package is installed)
+
+For large KBs an inverted-file (IVF) index clusters the rows with k-means
+and only scans the clusters closest to the query.
+"""
+
+import os
+import re
+import zlib
+import importlib.util
+from typing import Dict, List, Any, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Semantic search is optional
+    np = None
+
+# Above this many rows "auto" switches from an exact scan to IVF
+IVF_MIN_ROWS = 20000
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Function words carry no topic and make unrelated problems look similar
+_STOPWORDS = frozenset(
+    "a an and are be but can cannot do does don for from get got has have how i in is isn it its "
+    "keeps me my no not of on or so t that the this to too up was what when why will with won "
+    "you your".split()
+)
+_models: Dict[str, Any] = {}  # Sentence models are shared across KB reloads
+
+
+def semantic_available() -> bool:
+    return np is not None
+
+
+class HashedTfidfEncoder:
+    """
+    TF-IDF over hashed word and character-trigram features
+
+    Trigrams let related word forms match ("connect" / "connecting"). Signed
+    hashing keeps collisions from systematically inflating similarities.
+    """
+
+    name = "hashed-tfidf"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.idf = np.ones(dim, dtype=np.float32)
+        # KB vocabulary only (filled by fit); query-only words are hashed each time
+        self._word_cache: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def _hash(self, feature: str) -> Tuple[int, float]:
+        h = zlib.crc32(feature.encode("utf-8"))
+        return h % self.dim, (1.0 if h & 0x80000000 else -1.0)
+
+    def _word_features(self, word: str, remember: bool = False) -> Tuple[List[int], List[float]]:
+        """Buckets and weights for one word (the word itself plus its trigrams)"""
+        cached = self._word_cache.get(word)
+        if cached is None:
+            bucket, sign = self._hash(word)
+            buckets, weights = [bucket], [sign]
+            padded = f"#{word}#"
+            trigrams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+            for trigram in trigrams:
+                bucket, sign = self._hash("#3" + trigram)
+                buckets.append(bucket)
+                weights.append(sign / len(trigrams))
+            cached = (buckets, weights)
+            if remember:
+                self._word_cache[word] = cached
+        return cached
+
+    def _term_frequencies(self, texts: List[str], remember: bool = False) -> "np.ndarray":
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            for word in _TOKEN.findall(text.lower()):
+                if word in _STOPWORDS:
+                    continue
+                buckets, weights = self._word_features(word, remember)
+                rows.extend([row] * len(buckets))
+                cols.extend(buckets)
+                values.extend(weights)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)),
+                  np.asarray(values, dtype=np.float32))
+        return matrix
+
+    def fit(self, texts: List[str]) -> "np.ndarray":
+        """Learn IDF weights from the corpus and return its normalized vectors"""
+        matrix = self._term_frequencies(texts, remember=True)
+        df = np.count_nonzero(matrix, axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        return self._weight(matrix)
+
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        return self._weight(self._term_frequencies(texts))
+
+    def _weight(self, matrix: "np.ndarray") -> "np.ndarray":
+        matrix *= self.idf
+        return _normalize(matrix)
+
+
+class SentenceEncoder:
+    """A local sentence-transformers model (CPU)"""
+
+    def __init__(self, model_name: str):
+        if model_name not in _models:
+            from sentence_transformers import SentenceTransformer
+            _models[model_name] = SentenceTransformer(model_name, device="cpu")
+        self.model = _models[model_name]
+        self.name = model_name
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def fit(self, texts: List[str]) -> "np.ndarray":
+        return self.encode(texts)
+
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        vectors = self.model.encode(texts, batch_size=64, normalize_embeddings=True)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def create_encoder():
+    """Encoder selected by KB_EMBEDDING_MODEL / KB_VECTOR_DIM"""
+    model_name = os.getenv("KB_EMBEDDING_MODEL", "")
+    if model_name:
+        if importlib.util.find_spec("sentence_transformers") is not None:
+            return SentenceEncoder(model_name)
+        print(f"⚠️ KB_EMBEDDING_MODEL={model_name} needs sentence-transformers - using hashed TF-IDF")
+    return HashedTfidfEncoder(int(os.getenv("KB_VECTOR_DIM", 512)))
+
+
+def _normalize(matrix: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def _top_k(scores: "np.ndarray", k: int) -> "np.ndarray":
+    """Indexes of the k highest scores along the last axis, best first"""
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+class VectorIndex:
+    """
+    Top-k inner-product search over normalized row vectors
+
+    With ivf_lists > 0 the rows are grouped by nearest k-means centroid and
+    stored list by list, so a query scans the nprobe closest lists as
+    contiguous slices instead of the whole matrix.
+    """
+
+    def __init__(self, vectors: "np.ndarray", ivf_lists: int = 0, nprobe: int = 8, seed: int = 0):
+        self.rows = len(vectors)
+        self.ivf_lists = min(ivf_lists, self.rows)
+        self.nprobe = nprobe
+
+        if self.ivf_lists:
+            self.centroids = _kmeans(vectors, self.ivf_lists, seed=seed)
+            assignment = _assign(vectors, self.centroids)
+            order = np.argsort(assignment, kind="stable")
+            self.row_ids = order.astype(np.int64)
+            self.vectors = np.ascontiguousarray(vectors[order])
+            counts = np.bincount(assignment, minlength=self.ivf_lists)
+            self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        else:
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def search(self, queries: "np.ndarray", k: int) -> List[List[Tuple[int, float]]]:
+        """(row, similarity) pairs per query, best first"""
+        if self.rows == 0:
+            return [[] for _ in range(len(queries))]
+        if not self.ivf_lists:
+            scores = queries @ self.vectors.T
+            top = _top_k(scores, k)
+            return [
+                [(int(i), float(s)) for i, s in zip(top[q], scores[q, top[q]])]
+                for q in range(len(queries))
+            ]
+
+        results = []
+        probe = _top_k(queries @ self.centroids.T, min(self.nprobe, self.ivf_lists))
+        for query, lists in zip(queries, probe):
+            ranges = [(self.offsets[c], self.offsets[c + 1]) for c in lists]
+            candidate_ids = np.concatenate([self.row_ids[start:end] for start, end in ranges])
+            scores = np.concatenate([self.vectors[start:end] @ query for start, end in ranges])
+            top = _top_k(scores, min(k, len(scores)))
+            results.append([(int(candidate_ids[i]), float(scores[i])) for i in top])
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "index": f"ivf{self.ivf_lists}/nprobe{self.nprobe}" if self.ivf_lists else "flat",
+            "matrix_mb": round(self.vectors.nbytes / 1024 / 1024, 1)
+        }
+
+
+def _kmeans(vectors: "np.ndarray", k: int, iterations: int = 10, seed: int = 0) -> "np.ndarray":
+    """Spherical k-means on a sample of the rows"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), k * 64)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        updated = np.zeros_like(centroids)
+        np.add.at(updated, assignment, sample)
+        empty = ~updated.any(axis=1)
+        updated[empty] = centroids[empty]
+        centroids = _normalize(updated)
+    return centroids
+
+
+def _assign(vectors: "np.ndarray", centroids: "np.ndarray", chunk: int = 8192) -> "np.ndarray":
+    """Nearest centroid per row, in chunks to bound the score matrix"""
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), chunk)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+
+class SemanticIndex:
+    """Encoder plus vector index over a list of documents"""
+
+    def __init__(self, texts: List[str], encoder=None, index: str = "auto", nprobe: int = 8):
+        """
+        Args:
+            texts: One document per row (row numbers are returned by search)
+            encoder: Defaults to create_encoder()
+            index: "flat" (exact), "ivf" (approximate) or "auto"
+            nprobe: IVF lists scanned per query
+        """
+        self.encoder = encoder or create_encoder()
+        vectors = self.encoder.fit(texts)
+        use_ivf = index == "ivf" or (index == "auto" and len(texts) >= IVF_MIN_ROWS)
+        ivf_lists = max(1, int(len(texts) ** 0.5)) if use_ivf else 0
+        self.index = VectorIndex(vectors, ivf_lists=ivf_lists, nprobe=nprobe)
+
+    def search(self, query: str, k: int = 10, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        return self.search_batch([query], k, min_score)[0]
+
+    def search_batch(self, queries: List[str], k: int = 10, min_score: float = 0.0) -> List[List[Tuple[int, float]]]:
+        """Top-k (row, similarity) per query with one matrix product for the batch"""
+        results = self.index.search(self.encoder.encode(queries), k)
+        return [[(row, score) for row, score in hits if score >= min_score] for hits in results]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"encoder": self.encoder.name, "dim": self.encoder.dim, **self.index.get_stats()}
@@ -0,0 +1,136 @@
+"""
+Keyword Matcher - Precompiled multi-pattern substring matching
+"""
+
+from bisect import bisect_right
+from collections import deque
+from typing import Any, Dict, Iterable, List, Set
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of patterns
+
+    find() reports every pattern that occurs as a substring of the text in a
+    single pass, so the cost is linear in the text length no matter how many
+    patterns there are. Matching is case-sensitive; lowercase both sides for
+    case-insensitive matching.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = list(dict.fromkeys(patterns))
+        self._always: Set[str] = {p for p in self.patterns if p == ""}
+
+        # State 0 is the root; each state has transitions, a failure link and
+        # the patterns that end there (including those inherited via failure links)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[tuple] = [()]
+
+        for pattern in self.patterns:
+            if pattern:
+                self._insert(pattern)
+        self._link()
+
+    def _insert(self, pattern: str):
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] = self._out[state] + (pattern,)
+
+    def _link(self):
+        """Breadth-first pass computing failure links and merged outputs"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable automaton (see from_dict)"""
+        return {
+            "patterns": self.patterns,
+            "goto": self._goto,
+            "fail": self._fail,
+            "out": [list(out) for out in self._out]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "KeywordMatcher":
+        """Restore a compiled automaton without rebuilding it"""
+        matcher = cls.__new__(cls)
+        matcher.patterns = data["patterns"]
+        matcher._always = {p for p in matcher.patterns if p == ""}
+        matcher._goto = data["goto"]
+        matcher._fail = data["fail"]
+        matcher._out = [tuple(out) for out in data["out"]]
+        return matcher
+
+    def find(self, text: str) -> Set[str]:
+        """All patterns that occur in text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set(self._always)
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class SubstringIndex:
+    """
+    Finds which of many fields contain a pattern (the reverse direction of
+    KeywordMatcher)
+
+    The fields are joined into one corpus so a lookup is a handful of
+    str.find calls in C rather than a Python loop over every field. After a
+    hit the search resumes at the next field, so each field is reported once.
+    """
+
+    SEPARATOR = "\x00"
+
+    def __init__(self, fields: List[str]):
+        self._starts: List[int] = []
+        offset = 0
+        for field in fields:
+            self._starts.append(offset)
+            offset += len(field) + 1
+        self._corpus = self.SEPARATOR.join(fields)
+        self._count = len(fields)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def find(self, pattern: str) -> List[int]:
+        """Indexes of the fields containing pattern, in order"""
+        if not pattern:
+            return list(range(self._count))
+        if self.SEPARATOR in pattern:
+            return []
+
+        fields = []
+        corpus, starts = self._corpus, self._starts
+        position = corpus.find(pattern)
+        while position != -1:
+            index = bisect_right(starts, position) - 1
+            fields.append(index)
+            if index + 1 >= self._count:
+                break
+            position = corpus.find(pattern, starts[index + 1])
+        return fields
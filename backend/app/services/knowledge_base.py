@@ -2,11 +2,43 @@
 Knowledge Base Service - Stores common IT problems and solutions
 """
 
-import uuid
+import os
+import time
+import itertools
+import threading
+from collections import Counter
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass, field
 
+from .metrics import metrics
+from .keyword_matcher import KeywordMatcher, SubstringIndex
+from .kb_vectors import SemanticIndex, semantic_available
+from .kb_cache import QueryCache, CachedQuery
+from .kb_fragments import ProblemFragment, encode
+from .serializer import loads
+from .kb_store import (
+    open_source, problem_id_for, solution_id_for,
+    read_snapshot, read_snapshot_fingerprint, write_snapshot
+)
+
+KB_SEARCH_SECONDS = metrics.histogram("akai_kb_search_seconds", "Knowledge Base search time")
+KB_SEARCHES = metrics.counter(
+    "akai_kb_searches_total", "Knowledge Base searches by outcome", ["result"]
+)
+# Candidates taken from semantic search before fusing with keyword scores
+SEMANTIC_TOP_K = 10
+# Problems and solutions included in the context given to Claude
+CONTEXT_PROBLEMS = 3
+CONTEXT_SOLUTIONS = 5
+
+KB_RELOADS = metrics.counter(
+    "akai_kb_reloads_total", "Knowledge Base reloads from the external source", ["result"]
+)
+KB_FAST_ANSWERS = metrics.counter(
+    "akai_kb_fast_answers_total", "Turns answered from the KB without calling Claude"
+)
+
 
 @dataclass
 class Solution:
@@ -48,6 +80,35 @@ class Problem:
     solutions: List[Solution] = field(default_factory=list)
     created_at: str = field(default_factory=lambda: datetime.now().isoformat())
 
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Problem":
+        """Build from a normalized kb_store record"""
+        problem = cls(
+            id=record["id"],
+            category=record["category"],
+            title=record["title"],
+            description=record["description"],
+            keywords=record["keywords"],
+            created_at=record.get("created_at") or datetime.now().isoformat()
+        )
+        problem.solutions = [
+            Solution(id=s["id"], problem_id=problem.id, title=s["title"], steps=s["steps"])
+            for s in record["solutions"]
+        ]
+        return problem
+
+    def to_record(self) -> Dict[str, Any]:
+        """Content-only form stored in KB source files and snapshots"""
+        return {
+            "id": self.id,
+            "category": self.category,
+            "title": self.title,
+            "description": self.description,
+            "keywords": self.keywords,
+            "solutions": [{"id": s.id, "title": s.title, "steps": s.steps} for s in self.solutions],
+            "created_at": self.created_at
+        }
+
     def to_dict(self, include_solutions: bool = True) -> Dict[str, Any]:
         result = {
             "id": self.id,
@@ -62,29 +123,392 @@ class Problem:
         return result
 
 
+def build_search_index_spec(problems: List[Problem]) -> Dict[str, Any]:
+    """
+    Precompile the lookups search() needs, in a JSON-serializable form
+
+    - name_fields: titles and keywords (lowercased), for "query/word in
+      title" and "query/word in keyword"
+    - descriptions: the same for "query in description"
+    - automaton: keyword matcher over all keywords, for "keyword in query"
+    """
+    name_fields: List[str] = []
+    name_owner: List[int] = []       # Problem index per name field
+    name_is_title: List[bool] = []
+    keyword_fields: Dict[str, List[int]] = {}  # Lowercased keyword -> name field indexes
+
+    for index, problem in enumerate(problems):
+        name_fields.append(problem.title.lower())
+        name_owner.append(index)
+        name_is_title.append(True)
+        for keyword in problem.keywords:
+            keyword_lower = keyword.lower()
+            keyword_fields.setdefault(keyword_lower, []).append(len(name_fields))
+            name_fields.append(keyword_lower)
+            name_owner.append(index)
+            name_is_title.append(False)
+
+    return {
+        "name_fields": name_fields,
+        "name_owner": name_owner,
+        "name_is_title": name_is_title,
+        "descriptions": [p.description.lower() for p in problems],
+        "keyword_fields": keyword_fields,
+        "automaton": KeywordMatcher(keyword_fields).to_dict()
+    }
+
+
+_state_versions = itertools.count(1)
+
+
+class KBState:
+    """
+    One generation of KB content and its search index
+
+    Reloads build a complete new state and swap it in with a single
+    assignment. Readers take one reference to the current state, so a search
+    running during a swap finishes against the generation it started with.
+    """
+
+    def __init__(
+        self,
+        problems: List[Problem],
+        index_spec: Optional[Dict[str, Any]] = None,
+        source: str = "builtin",
+        fingerprint: Optional[str] = None
+    ):
+        self.problems: Dict[str, Problem] = {p.id: p for p in problems}
+        self.solutions: Dict[str, Solution] = {s.id: s for p in problems for s in p.solutions}
+        self.source = source
+        self.fingerprint = fingerprint
+        self.version = next(_state_versions)  # Keys caches derived from this content
+        self.loaded_at = datetime.now().isoformat()
+        self._index_spec = index_spec  # Prebuilt spec from a snapshot, if any
+        self._search_index: Optional[Dict[str, Any]] = None
+        self.vector_index: Optional[SemanticIndex] = None  # Built by KnowledgeBase when semantic search is on
+        self._fragments: Dict[str, ProblemFragment] = {}
+
+    def add(self, problem: Problem):
+        """Add a problem in place (only while the state is being built)"""
+        self.problems[problem.id] = problem
+        for solution in problem.solutions:
+            self.solutions[solution.id] = solution
+        self._index_spec = None
+        self._search_index = None
+        self.vector_index = None
+        self._fragments = {}
+        self.version = next(_state_versions)
+
+    def fragment(self, problem: Problem) -> ProblemFragment:
+        """Pre-encoded JSON for a problem, built on first use"""
+        fragment = self._fragments.get(problem.id)
+        if fragment is None:
+            fragment = self._fragments[problem.id] = ProblemFragment(problem)
+        return fragment
+
+    @property
+    def search_index(self) -> Dict[str, Any]:
+        """Search structures, built on first use"""
+        if self._search_index is None:
+            problems = list(self.problems.values())
+            spec = self._index_spec or build_search_index_spec(problems)
+            self._search_index = {
+                "problems": problems,
+                "names": SubstringIndex(spec["name_fields"]),
+                "name_owner": spec["name_owner"],
+                "name_is_title": spec["name_is_title"],
+                "descriptions": SubstringIndex(spec["descriptions"]),
+                "keywords": KeywordMatcher.from_dict(spec["automaton"]),
+                "keyword_fields": spec["keyword_fields"]
+            }
+        return self._search_index
+
+
+class KBContext:
+    """
+    KB matches for one user query
+
+    Holds the live Problem and Solution objects rather than dict copies.
+    kb_match_json() writes the kb_match event straight from pre-encoded
+    fragments and to_dict() builds the dict form only when asked.
+    """
+
+    __slots__ = ("state", "matches", "top_solutions")
+
+    def __init__(
+        self,
+        state: KBState,
+        matches: List[Tuple[Problem, float, Optional[float]]],
+        top_solutions: List[Solution]
+    ):
+        self.state = state
+        self.matches = matches  # (problem, match score, semantic score), best first
+        self.top_solutions = top_solutions
+
+    @property
+    def has_matches(self) -> bool:
+        return bool(self.matches)
+
+    @property
+    def best_score(self) -> float:
+        """Match score of the top problem (0 when nothing matched)"""
+        return self.matches[0][1] if self.matches else 0.0
+
+    @property
+    def version(self) -> int:
+        """Content version of the KB these matches came from"""
+        return self.state.version
+
+    @property
+    def problems(self) -> List[Problem]:
+        return [problem for problem, _, _ in self.matches]
+
+    def _problem_json(self) -> List[bytes]:
+        return [
+            self.state.fragment(problem).render(problem, score, similarity, with_problem_title=True)
+            for problem, score, similarity in self.matches
+        ]
+
+    def _solution_json(self) -> List[bytes]:
+        problems = self.state.problems
+        return [
+            self.state.fragment(problems[s.problem_id]).render_solution(s)
+            for s in self.top_solutions
+        ]
+
+    def kb_match_json(self) -> bytes:
+        """The kb_match WebSocket event as JSON bytes"""
+        return (
+            b'{"type":"kb_match","problems":[' + b",".join(self._problem_json())
+            + b'],"top_solutions":[' + b",".join(self._solution_json()) + b"]}"
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dict form (has_matches, problems, top_solutions)"""
+        return {
+            "has_matches": self.has_matches,
+            "problems": [loads(p) for p in self._problem_json()],
+            "top_solutions": [loads(s) for s in self._solution_json()]
+        }
+
+
 class KnowledgeBase:
     """Knowledge Base for IT Support - stores common problems and solutions"""
 
-    def __init__(self):
-        self.problems: Dict[str, Problem] = {}
-        self.solutions: Dict[str, Solution] = {}
-        self._init_default_knowledge()
-        self._load_feedback_from_db()
+    def __init__(self, source: Optional[str] = None):
+        """
+        Args:
+            source: Directory of JSON/YAML files, "sqlite" for the kb_articles
+                table, or a compiled snapshot file. Defaults to KB_SOURCE;
+                empty uses the built-in knowledge.
+        """
+        self._state = KBState([])
+        self.source_spec = os.getenv("KB_SOURCE", "") if source is None else source
+        self.snapshot_path = os.getenv("KB_SNAPSHOT_PATH", "data/kb_snapshot.bin")
+        self.watch_interval = float(os.getenv("KB_WATCH_INTERVAL", "5"))
+        self._source = None
+        self._reload_lock = threading.Lock()
+        self._reloads = 0
+        self._last_load_ms: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._failed_fingerprint: Optional[str] = None
+
+        # Semantic search fused with keyword scores (needs numpy)
+        self.semantic = os.getenv("KB_SEMANTIC", "false").lower() == "true"
+        if self.semantic and not semantic_available():
+            print("⚠️ KB_SEMANTIC needs numpy - using keyword search only")
+            self.semantic = False
+        self.semantic_index_type = os.getenv("KB_VECTOR_INDEX", "auto")
+        self._vector_lock = threading.Lock()  # One index build at a time
+        self._vector_build_pending = False
+        self.semantic_weight = float(os.getenv("KB_SEMANTIC_WEIGHT", 10))
+        self.semantic_min_score = float(os.getenv("KB_SEMANTIC_MIN_SCORE", 0.2))
+
+        # Templated answers for strong matches on proven solutions
+        self.fast_path = os.getenv("KB_FAST_PATH", "true").lower() == "true"
+        self.fast_path_min_score = float(os.getenv("KB_FAST_PATH_MIN_SCORE", 20))
+        self.fast_path_min_success_rate = float(os.getenv("KB_FAST_PATH_MIN_SUCCESS_RATE", 0.8))
+        self.fast_path_min_uses = int(os.getenv("KB_FAST_PATH_MIN_USES", 5))
+
+        self._query_cache = QueryCache(
+            max_entries=int(os.getenv("KB_QUERY_CACHE_SIZE", 1024)),
+            ttl=float(os.getenv("KB_QUERY_CACHE_TTL", 300))
+        )
+        metrics.gauge("akai_kb_query_cache_entries", "Cached KB query rankings").set_function(
+            lambda: len(self._query_cache)
+        )
+
+        if self.source_spec:
+            try:
+                self._source = open_source(self.source_spec)
+                self.reload()
+            except Exception as e:
+                self._last_error = str(e)
+                print(f"⚠️ Could not load KB from {self.source_spec}: {e} - using built-in knowledge")
 
-    def _load_feedback_from_db(self):
+        if not self.problems:
+            self._init_default_knowledge()
+            self._load_feedback_from_db()
+            if self.semantic:
+                self._vector_index(self._state)
+
+        if self._source and self.watch_interval > 0:
+            threading.Thread(target=self._watch, name="kb-watcher", daemon=True).start()
+
+    @property
+    def problems(self) -> Dict[str, Problem]:
+        return self._state.problems
+
+    @property
+    def solutions(self) -> Dict[str, Solution]:
+        return self._state.solutions
+
+    def _load_feedback_from_db(self, state: Optional[KBState] = None):
         """Load solution feedback from database"""
+        solutions = (state or self._state).solutions
         try:
             from .database import db
             all_feedback = db.get_all_feedback()
             for fb in all_feedback:
                 sol_id = fb["solution_id"]
-                if sol_id in self.solutions:
-                    self.solutions[sol_id].success_count = fb["success_count"]
-                    self.solutions[sol_id].failure_count = fb["failure_count"]
+                if sol_id in solutions:
+                    solutions[sol_id].success_count = fb["success_count"]
+                    solutions[sol_id].failure_count = fb["failure_count"]
             print(f"📊 Loaded feedback for {len(all_feedback)} solutions")
         except Exception as e:
             print(f"Could not load KB feedback: {e}")
 
+    def reload(self, force: bool = False) -> bool:
+        """
+        Load the external source into a new state and swap it in
+
+        The snapshot is recompiled first when it was built from different
+        source contents (snapshot sources are used as they are).
+
+        Args:
+            force: Recompile and swap even if the source is unchanged
+
+        Returns:
+            True if a new state was swapped in
+        """
+        if self._source is None:
+            return False
+
+        with self._reload_lock:
+            start = time.perf_counter()
+            fingerprint = None
+            try:
+                fingerprint = self._source.fingerprint()
+                if not force and fingerprint == self._state.fingerprint:
+                    self._last_error = None
+                    return False
+                if not force and fingerprint == self._failed_fingerprint:
+                    return False  # Already reported; wait for the next edit
+
+                snapshot_path = getattr(self._source, "snapshot_path", None)
+                if snapshot_path is None:
+                    snapshot_path = self.snapshot_path
+                    if force or read_snapshot_fingerprint(snapshot_path) != fingerprint:
+                        records = self._source.load()
+                        index_spec = build_search_index_spec([Problem.from_record(r) for r in records])
+                        write_snapshot(snapshot_path, records, index_spec, fingerprint)
+                        print(f"📦 Compiled {len(records)} KB problems into {snapshot_path}")
+
+                snapshot = read_snapshot(snapshot_path)
+                state = KBState(
+                    [Problem.from_record(r) for r in snapshot.records],
+                    snapshot.index,
+                    source=self._source.name,
+                    fingerprint=snapshot.fingerprint
+                )
+                state.search_index  # Build now rather than on the first search
+                if self.semantic:
+                    self._vector_index(state)
+
+                # Keep counts for unchanged solutions, then refresh from the database
+                previous = self._state.solutions
+                for solution_id, solution in state.solutions.items():
+                    if solution_id in previous:
+                        solution.success_count = previous[solution_id].success_count
+                        solution.failure_count = previous[solution_id].failure_count
+                self._load_feedback_from_db(state)
+            except Exception as e:
+                self._last_error = str(e)
+                self._failed_fingerprint = fingerprint
+                KB_RELOADS.labels("error").inc()
+                raise
+
+            self._state = state
+            self._query_cache.clear()
+            self._failed_fingerprint = None
+            self._reloads += 1
+            self._last_load_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._last_error = None
+            KB_RELOADS.labels("ok").inc()
+            print(f"📚 Loaded {len(state.problems)} KB problems from {state.source} in {self._last_load_ms}ms")
+            return True
+
+    def _vector_index(self, state: KBState) -> SemanticIndex:
+        """
+        Semantic index over a state's problems (rows follow the search index order)
+
+        Builds it if missing. Slow for large KBs, so only called at load
+        time and from the background build, never from a search.
+        """
+        with self._vector_lock:
+            if state.vector_index is None:
+                texts = [
+                    " ".join([p.title, p.description, *p.keywords, *(s.title for s in p.solutions)])
+                    for p in state.search_index["problems"]
+                ]
+                state.vector_index = SemanticIndex(texts, index=self.semantic_index_type)
+            return state.vector_index
+
+    def _ready_vector_index(self, state: KBState) -> Optional[SemanticIndex]:
+        """The state's semantic index, or None (and a background build) if it isn't built yet"""
+        index = state.vector_index
+        if index is None:
+            with self._vector_lock:
+                if self._vector_build_pending:
+                    return None
+                self._vector_build_pending = True
+            threading.Thread(target=self._build_vector_index, args=(state,), name="kb-vectors", daemon=True).start()
+        return index
+
+    def _build_vector_index(self, state: KBState):
+        try:
+            self._vector_index(state)
+        except Exception as e:
+            print(f"⚠️ KB vector index build failed: {e}")
+        finally:
+            self._vector_build_pending = False
+
+    def _watch(self):
+        """Poll the source and hot-swap the KB when it changes"""
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"⚠️ KB reload failed (keeping the current version): {e}")
+
+    def get_store_stats(self) -> Dict[str, Any]:
+        """Where the KB was loaded from and how the last reload went"""
+        state = self._state
+        return {
+            "source": state.source,
+            "fingerprint": state.fingerprint[:12] if state.fingerprint else None,
+            "loaded_at": state.loaded_at,
+            "reloads": self._reloads,
+            "last_load_ms": self._last_load_ms,
+            "last_error": self._last_error,
+            "watching": bool(self._source and self.watch_interval > 0),
+            "semantic": state.vector_index.get_stats() if state.vector_index else None
+        }
+
+    def get_query_cache_stats(self) -> Dict[str, Any]:
+        return self._query_cache.get_stats()
+
     def _init_default_knowledge(self):
         """Initialize with common IT support problems and solutions"""
 
@@ -740,7 +1164,7 @@ class KnowledgeBase:
     def _add_problem(self, category: str, title: str, description: str,
                      keywords: List[str], solutions: List[Dict]) -> Problem:
         """Helper to add a problem with its solutions"""
-        problem_id = str(uuid.uuid4())
+        problem_id = problem_id_for(category, title)
         problem = Problem(
             id=problem_id,
             category=category,
@@ -750,76 +1174,136 @@ class KnowledgeBase:
         )
 
         for sol_data in solutions:
-            solution_id = str(uuid.uuid4())
             solution = Solution(
-                id=solution_id,
+                id=solution_id_for(problem_id, sol_data["title"]),
                 problem_id=problem_id,
                 title=sol_data["title"],
                 steps=sol_data["steps"]
             )
             problem.solutions.append(solution)
-            self.solutions[solution_id] = solution
 
-        self.problems[problem_id] = problem
+        self._state.add(problem)
+        self._query_cache.clear()
         return problem
 
     def get_categories(self) -> List[str]:
         """Get all unique categories"""
         return list(set(p.category for p in self.problems.values()))
 
-    def search(self, query: str, category: Optional[str] = None) -> List[Dict[str, Any]]:
-        """
-        Search for problems matching the query
-
-        Args:
-            query: Search term
-            category: Optional category filter
-
-        Returns:
-            List of matching problems with solutions
-        """
-        query_lower = query.lower()
-        results = []
-
-        for problem in self.problems.values():
+    def _score(self, state: KBState, query_lower: str, category: Optional[str]) -> List[Tuple[int, float, Optional[float]]]:
+        """Rank problems for a query: (problem index, match score, semantic score), best first"""
+        index = state.search_index
+        owner = index["name_owner"]
+        is_title = index["name_is_title"]
+        scores: Dict[int, int] = {}
+
+        # Query in title (+10) or in description (+5)
+        matched_keywords = set()
+        for field in index["names"].find(query_lower):
+            if is_title[field]:
+                scores[owner[field]] = scores.get(owner[field], 0) + 10
+            else:
+                matched_keywords.add(field)
+        for problem_index in index["descriptions"].find(query_lower):
+            scores[problem_index] = scores.get(problem_index, 0) + 5
+
+        # Keywords containing the query or contained in it (+3 each)
+        for keyword in index["keywords"].find(query_lower):
+            matched_keywords.update(index["keyword_fields"][keyword])
+        for field in matched_keywords:
+            scores[owner[field]] = scores.get(owner[field], 0) + 3
+
+        # Each query word (skipping short words) found in a keyword or the title (+2 each)
+        word_counts = Counter(word for word in query_lower.split() if len(word) > 2)
+        for word, count in word_counts.items():
+            for field in index["names"].find(word):
+                scores[owner[field]] = scores.get(owner[field], 0) + 2 * count
+
+        # Semantic similarity, for paraphrases that share no keywords (+weight x cosine)
+        similarities: Dict[int, float] = {}
+        vector_index = self._ready_vector_index(state) if self.semantic else None
+        if vector_index is not None:
+            hits = vector_index.search(query_lower, SEMANTIC_TOP_K, self.semantic_min_score)
+            similarities = dict(hits)
+
+        ranked = []
+        for problem_index in sorted(scores.keys() | similarities.keys()):
+            problem = index["problems"][problem_index]
             # Filter by category if specified
             if category and problem.category.lower() != category.lower():
                 continue
+            score = scores.get(problem_index, 0)
+            similarity = similarities.get(problem_index)
+            if similarity is not None:
+                score = round(score + self.semantic_weight * similarity, 2)
+                similarity = round(similarity, 3)
+            if score > 0:
+                ranked.append((problem_index, score, similarity))
 
-            # Calculate match score
-            score = 0
-
-            # Check title
-            if query_lower in problem.title.lower():
-                score += 10
+        # Sort by match score (highest first)
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked
+
+    def _ranked(self, state: KBState, query: str, category: Optional[str]) -> CachedQuery:
+        """Ranking for a query, from the query cache when possible"""
+        start = time.perf_counter()
+        query_lower = " ".join(query.lower().split())
+        key = (query_lower, (category or "").lower())
+
+        entry = self._query_cache.get(key, state) if self._query_cache.enabled else None
+        if entry is None:
+            ranked = self._score(state, query_lower, category)
+            problems = state.search_index["problems"]
+            entry = CachedQuery(state, ranked, [problems[i].id for i, _, _ in ranked[:CONTEXT_PROBLEMS]])
+            # Keyword-only rankings from while the vector index builds aren't kept
+            if not self.semantic or state.vector_index is not None:
+                self._query_cache.put(key, entry)
+
+        KB_SEARCH_SECONDS.observe(time.perf_counter() - start)
+        KB_SEARCHES.labels("hit" if entry.ranked else "miss").inc()
+        return entry
+
+    @staticmethod
+    def _materialize(state: KBState, item: Tuple[int, float, Optional[float]]) -> Dict[str, Any]:
+        problem_index, score, similarity = item
+        result = state.search_index["problems"][problem_index].to_dict()
+        result["match_score"] = score
+        if similarity is not None:
+            result["semantic_score"] = similarity
+        return result
 
-            # Check description
-            if query_lower in problem.description.lower():
-                score += 5
+    def search_json(self, query: str, category: Optional[str] = None) -> bytes:
+        """
+        Search results as the JSON body of /api/knowledge/search
 
-            # Check keywords
-            for keyword in problem.keywords:
-                if query_lower in keyword.lower() or keyword.lower() in query_lower:
-                    score += 3
+        Same content as search(), written from pre-encoded fragments.
+        """
+        state = self._state
+        entry = self._ranked(state, query, category)
+        problems = state.search_index["problems"]
+        results = b",".join(
+            state.fragment(problems[i]).render(problems[i], score, similarity)
+            for i, score, similarity in entry.ranked
+        )
+        return (
+            b'{"query":' + encode(query) + b',"category":' + encode(category)
+            + b',"count":%d,"results":[' % len(entry.ranked) + results + b"]}"
+        )
 
-            # Check individual words in query
-            query_words = query_lower.split()
-            for word in query_words:
-                if len(word) > 2:  # Skip short words
-                    for keyword in problem.keywords:
-                        if word in keyword.lower():
-                            score += 2
-                    if word in problem.title.lower():
-                        score += 2
+    def search(self, query: str, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Search for problems matching the query
 
-            if score > 0:
-                result = problem.to_dict()
-                result["match_score"] = score
-                results.append(result)
+        Args:
+            query: Search term (case and extra whitespace are ignored)
+            category: Optional category filter
 
-        # Sort by match score (highest first)
-        results.sort(key=lambda x: x["match_score"], reverse=True)
-        return results
+        Returns:
+            List of matching problems with solutions, best match first
+        """
+        state = self._state
+        entry = self._ranked(state, query, category)
+        return [self._materialize(state, item) for item in entry.ranked]
 
     def get_problem(self, problem_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific problem by ID"""
@@ -851,6 +1335,9 @@ class KnowledgeBase:
         else:
             solution.failure_count += 1
 
+        # Context rankings that include this problem order solutions by success rate
+        self._query_cache.invalidate_problem(solution.problem_id)
+
         # Persist to database
         try:
             from .database import db
@@ -872,13 +1359,14 @@ class KnowledgeBase:
             List of high-success solutions
         """
         results = []
+        state = self._state
 
-        for solution in self.solutions.values():
+        for solution in state.solutions.values():
             total_uses = solution.success_count + solution.failure_count
             if total_uses >= min_uses and solution.success_rate >= min_success_rate:
                 sol_dict = solution.to_dict()
                 # Add problem context
-                problem = self.problems.get(solution.problem_id)
+                problem = state.problems.get(solution.problem_id)
                 if problem:
                     sol_dict["problem_title"] = problem.title
                     sol_dict["problem_category"] = problem.category
@@ -888,32 +1376,65 @@ class KnowledgeBase:
         results.sort(key=lambda x: x["success_rate"], reverse=True)
         return results
 
-    def get_context_for_query(self, query: str) -> Dict[str, Any]:
-        """
-        Get KB context for a user query (for Claude integration)
+    def is_current(self, kb_context: KBContext) -> bool:
+        """Whether kb_context came from the KB version in use now"""
+        return kb_context.state is self._state
 
-        Returns structured data about matching problems/solutions
+    def get_fast_answer(self, kb_context: KBContext) -> Optional[Dict[str, Any]]:
         """
-        matches = self.search(query)
-
-        if not matches:
-            return {"has_matches": False, "problems": [], "top_solutions": []}
+        Templated answer when the top match has a proven solution
 
-        # Get top 3 matching problems
-        top_problems = matches[:3]
+        The best problem must score at least KB_FAST_PATH_MIN_SCORE and its
+        best solution must have KB_FAST_PATH_MIN_USES feedback reports with
+        a success rate of KB_FAST_PATH_MIN_SUCCESS_RATE or more.
 
-        # Collect best solutions from top problems
-        top_solutions = []
-        for problem in top_problems:
-            for solution in problem.get("solutions", []):
-                solution["problem_title"] = problem["title"]
-                top_solutions.append(solution)
-
-        # Sort solutions by success rate
-        top_solutions.sort(key=lambda x: x.get("success_rate", 0), reverse=True)
+        Args:
+            kb_context: Matches for the user's message
 
+        Returns:
+            Dict with 'response' text and the problem/solution used, or None
+        """
+        if not self.fast_path or kb_context.best_score < self.fast_path_min_score:
+            return None
+
+        problem = kb_context.matches[0][0]
+        proven = [
+            s for s in problem.solutions
+            if s.success_count + s.failure_count >= self.fast_path_min_uses
+            and s.success_rate >= self.fast_path_min_success_rate
+        ]
+        if not proven:
+            return None
+        solution = max(proven, key=lambda s: s.success_rate)
+
+        lines = [f"This looks like a known issue: {problem.title}.", f"{solution.title} fixes this {solution.success_rate:.0%} of the time."]
+        lines.extend(f"{i}. {step}" for i, step in enumerate(solution.steps, 1))
+        lines.append("Let me know if that worked.")
+
+        KB_FAST_ANSWERS.inc()
         return {
-            "has_matches": True,
-            "problems": top_problems,
-            "top_solutions": top_solutions[:5]  # Top 5 solutions
+            "response": "\n\n".join(lines),
+            "problem_id": problem.id,
+            "solution_id": solution.id,
+            "match_score": kb_context.best_score,
+            "success_rate": solution.success_rate
         }
+
+    def get_context_for_query(self, query: str) -> KBContext:
+        """
+        Get KB context for a user query (for Claude integration)
+
+        Returns the top matching problems and their best solutions
+        """
+        state = self._state
+        entry = self._ranked(state, query, None)
+        problems = state.search_index["problems"]
+        matches = [(problems[i], score, similarity) for i, score, similarity in entry.ranked[:CONTEXT_PROBLEMS]]
+
+        # Best solutions by success rate (cached until feedback changes a rate)
+        if entry.top_solution_ids is None:
+            candidates = [s for problem, _, _ in matches for s in problem.solutions]
+            candidates.sort(key=lambda s: s.success_rate, reverse=True)
+            entry.top_solution_ids = [s.id for s in candidates[:CONTEXT_SOLUTIONS]]
+
+        return KBContext(state, matches, [state.solutions[sid] for sid in entry.top_solution_ids])
@@ -0,0 +1,225 @@
+"""
+Model Router - Picks the Claude model for each turn
+
+Turns are classified with cheap local signals (screenshot attached,
+message length, KB match strength, active task step). Simple turns go to
+a fast model; screenshots and open-ended questions go to the full model.
+A fast answer that looks unsure or was cut off is retried once on the
+full model.
+"""
+
+import os
+import re
+import time
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from .metrics import metrics
+from .tracing import tracer
+from .claude_pipeline import PipelineStage, LLMRequest, CallNext, Result
+
+LLM_ROUTE_REQUESTS = metrics.counter(
+    "akai_llm_route_requests_total", "Claude requests by route and reason", ["route", "reason"]
+)
+LLM_ROUTE_SECONDS = metrics.histogram(
+    "akai_llm_route_seconds", "Claude call latency by route (an escalated retry counts under full)", ["route"]
+)
+LLM_ROUTE_ESCALATIONS = metrics.counter(
+    "akai_llm_route_escalations_total", "Fast answers retried on the full model", ["reason"]
+)
+LLM_COST = metrics.counter(
+    "akai_llm_cost_usd_total", "Estimated Claude spend in USD", ["route", "model"]
+)
+
+FAST = "fast"
+FULL = "full"
+VISION = "vision"
+
+# USD per million tokens (input, output), matched on model name prefix
+MODEL_PRICES = {
+    "claude-3-5-haiku": (0.80, 4.00),
+    "claude-3-haiku": (0.25, 1.25),
+    "claude-haiku-4": (1.00, 5.00),
+    "claude-sonnet-4": (3.00, 15.00),
+    "claude-3-7-sonnet": (3.00, 15.00),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-opus-4": (15.00, 75.00),
+}
+# Prompt cache reads and writes relative to the input price
+CACHE_READ_FACTOR = 0.1
+CACHE_WRITE_FACTOR = 1.25
+
+_CODE_PATTERN = re.compile(r"```|Traceback|Exception|^\s*(def|class|import|function)\s", re.MULTILINE)
+_UNSURE_PATTERN = re.compile(
+    r"\b(i'?m not sure|i am not sure|not certain|i don'?t know|hard to say|can'?t tell|"
+    r"unable to (help|determine)|need more (info|information|details))\b",
+    re.IGNORECASE
+)
+
+
+def model_price(model: str) -> Tuple[float, float]:
+    """(input, output) USD per million tokens for a model, (0, 0) if unknown"""
+    for prefix, price in MODEL_PRICES.items():
+        if model.startswith(prefix):
+            return price
+    return (0.0, 0.0)
+
+
+def estimate_cost(model: str, usage: Any) -> float:
+    """Estimated USD cost of one API response's usage"""
+    input_price, output_price = model_price(model)
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return (
+        usage.input_tokens * input_price
+        + cache_read * input_price * CACHE_READ_FACTOR
+        + cache_write * input_price * CACHE_WRITE_FACTOR
+        + usage.output_tokens * output_price
+    ) / 1_000_000
+
+
+class ModelRouter:
+    """
+    Chooses fast, full or vision model for a request
+
+    Config (env):
+        LLM_ROUTING: "auto" (default) or "off" to always use the full model
+        LLM_FAST_MODEL / LLM_FULL_MODEL / LLM_VISION_MODEL (the fast model
+            also takes screenshot turns over a soft budget, so it must accept images)
+        LLM_FAST_MAX_CHARS: longer messages always go to the full model
+        LLM_FAST_MAX_WORDS: messages this short are small talk ("thanks!")
+        LLM_ROUTE_KB_MIN_SCORE: KB match score that counts as confident
+    """
+
+    def __init__(self, full_model: str, vision_model: str):
+        self.enabled = os.getenv("LLM_ROUTING", "auto").lower() != "off"
+        self.models = {
+            FAST: os.getenv("LLM_FAST_MODEL", "claude-3-5-haiku-20241022"),
+            FULL: os.getenv("LLM_FULL_MODEL", full_model),
+            VISION: os.getenv("LLM_VISION_MODEL", vision_model),
+        }
+        self.fast_max_chars = int(os.getenv("LLM_FAST_MAX_CHARS", "280"))
+        self.fast_max_words = int(os.getenv("LLM_FAST_MAX_WORDS", "6"))
+        self.kb_min_score = float(os.getenv("LLM_ROUTE_KB_MIN_SCORE", "10"))
+
+        self._lock = threading.Lock()
+        self._stats = {
+            route: {"requests": 0, "escalated": 0, "seconds": 0.0, "cost_usd": 0.0}
+            for route in (FAST, FULL, VISION)
+        }
+
+    def classify(self, request: LLMRequest) -> Tuple[str, str]:
+        """Returns (route, reason)"""
+        # Over a soft budget every turn goes to the fast model, screenshots
+        # included (it must accept images; the default Haiku 3.5 does)
+        if request.downgrade:
+            return FAST, "budget"
+        if request.has_image:
+            return VISION, "image"
+        if not self.enabled:
+            return FULL, "routing_off"
+
+        message = request.message or ""
+        if len(message) > self.fast_max_chars:
+            return FULL, "long_message"
+        if _CODE_PATTERN.search(message):
+            return FULL, "code"
+
+        kb_context = request.kb_context
+        if kb_context is not None and kb_context.best_score >= self.kb_min_score:
+            return FAST, "kb_confident"
+
+        task_context = request.task_context or {}
+        if task_context.get("has_active_plan") and task_context.get("current_step"):
+            return FAST, "task_step"
+
+        if len(message.split()) <= self.fast_max_words:
+            return FAST, "short_message"
+        return FULL, "default"
+
+    def escalation_reason(self, request: LLMRequest, result: Result) -> Optional[str]:
+        """Why a fast answer should be retried on the full model, or None"""
+        response = request.api_response
+        if response is not None and getattr(response, "stop_reason", None) == "max_tokens":
+            return "truncated"
+        text = result.get("response", "").strip()
+        if not text:
+            return "empty"
+        if _UNSURE_PATTERN.search(text):
+            return "unsure"
+        return None
+
+    def record(self, route: str, seconds: float, cost: float, escalated: bool):
+        with self._lock:
+            stats = self._stats[route]
+            stats["requests"] += 1
+            stats["escalated"] += int(escalated)
+            stats["seconds"] += seconds
+            stats["cost_usd"] += cost
+        LLM_ROUTE_SECONDS.labels(route).observe(seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {
+                route: {
+                    "model": self.models[route],
+                    "requests": stats["requests"],
+                    "escalated": stats["escalated"],
+                    "avg_seconds": round(stats["seconds"] / stats["requests"], 3) if stats["requests"] else 0.0,
+                    "cost_usd": round(stats["cost_usd"], 6)
+                }
+                for route, stats in self._stats.items()
+            }
+        return {"enabled": self.enabled, "routes": routes}
+
+
+class RoutingStage(PipelineStage):
+    """Sets the model per turn and escalates unsure fast answers"""
+
+    name = "routing"
+
+    def __init__(self, router: ModelRouter):
+        self.router = router
+
+    def _cost(self, route: str, request: LLMRequest) -> float:
+        response = request.api_response
+        if response is None or request.cache_hit:
+            return 0.0
+        cost = estimate_cost(request.model, response.usage)
+        LLM_COST.labels(route, request.model).inc(cost)
+        return cost
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        route, reason = self.router.classify(request)
+        LLM_ROUTE_REQUESTS.labels(route, reason).inc()
+        request.model = self.router.models[route]
+
+        start = time.perf_counter()
+        with tracer.span("route", route=route, reason=reason, model=request.model):
+            result = await call_next(request)
+        cost = self._cost(route, request)
+
+        escalation = None
+        if route == FAST and not request.downgrade:
+            escalation = self.router.escalation_reason(request, result)
+        self.router.record(route, time.perf_counter() - start, cost, bool(escalation))
+
+        if escalation:
+            # The retry runs (and is billed) on the full model, so it is
+            # costed and timed under FULL rather than the fast route
+            LLM_ROUTE_ESCALATIONS.labels(escalation).inc()
+            route = FULL
+            request.model = self.router.models[FULL]
+            request.api_response = None
+            request.cache_hit = False
+            start = time.perf_counter()
+            with tracer.span("route", route=FULL, reason=f"escalated_{escalation}", model=request.model):
+                result = await call_next(request)
+            self.router.record(FULL, time.perf_counter() - start, self._cost(FULL, request), False)
+
+        result["model"] = request.model
+        result["route"] = route
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.router.get_stats()
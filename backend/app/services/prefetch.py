@@ -0,0 +1,131 @@
+"""
+Prefetch - Speculative turn context computed while the user is still typing
+
+partial_input messages (and finished voice transcripts) run KB search and
+template detection ahead of time. When the final message arrives with the
+same text, the turn uses those results instead of computing them again;
+if the text changed, the speculation is dropped.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable
+
+from .metrics import metrics
+
+PREFETCH_REQUESTS = metrics.counter(
+    "akai_prefetch_requests_total", "Turns by speculative context result", ["result"]
+)
+
+
+def normalize_input(text: str) -> str:
+    """Text as compared between the partial and final input (clients trim what they send)"""
+    return text.strip()
+
+
+class Speculation:
+    """Context computed for one session's partial input"""
+
+    __slots__ = ("text", "kb_context", "template_match", "created_at")
+
+    def __init__(self, text: str, kb_context: Any, template_match: Optional[Dict[str, Any]]):
+        self.text = text
+        self.kb_context = kb_context
+        self.template_match = template_match
+        self.created_at = time.monotonic()
+
+
+class PrefetchCache:
+    """
+    Latest speculation per session
+
+    Entries are used at most once, expire after ttl seconds and are capped
+    at max_sessions (least recently updated dropped first).
+    """
+
+    def __init__(self, ttl: float = 30.0, min_chars: int = 3, max_sessions: int = 10000):
+        self.ttl = ttl
+        self.min_chars = min_chars
+        self.max_sessions = max_sessions
+        self._entries: "OrderedDict[str, Speculation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.speculations = 0
+        self.results = {"hit": 0, "miss": 0, "diverged": 0, "stale": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def wants(self, session_id: str, text: str) -> bool:
+        """Whether text is worth speculating on (long enough and not already done)"""
+        if not self.enabled or len(text) < self.min_chars:
+            return False
+        with self._lock:
+            entry = self._entries.get(session_id)
+        return entry is None or entry.text != text
+
+    def put(self, session_id: str, speculation: Speculation):
+        with self._lock:
+            self._entries[session_id] = speculation
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+            self.speculations += 1
+
+    def take(
+        self,
+        session_id: str,
+        text: str,
+        validate: Optional[Callable[[Speculation], bool]] = None
+    ) -> Optional[Speculation]:
+        """
+        Speculation for the final input, or None
+
+        Args:
+            session_id: Session the input belongs to
+            text: Final message text, normalized like the partial
+            validate: Returns False if the speculation's data is out of date
+
+        Returns:
+            The matching speculation (removed from the cache), or None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is None:
+            result = "miss"
+        elif entry.text != text:
+            result = "diverged"
+        elif time.monotonic() - entry.created_at > self.ttl or (validate and not validate(entry)):
+            result = "stale"
+        else:
+            result = "hit"
+
+        with self._lock:
+            self.results[result] += 1
+        PREFETCH_REQUESTS.labels(result).inc()
+        return entry if result == "hit" else None
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            used = sum(self.results.values())
+            return {
+                "enabled": self.enabled,
+                "sessions": len(self._entries),
+                "speculations": self.speculations,
+                **self.results,
+                "hit_rate": round(self.results["hit"] / used, 3) if used else 0.0
+            }
+
+
+prefetch_cache = PrefetchCache(
+    ttl=float(os.getenv("PREFETCH_TTL", 30)),
+    min_chars=int(os.getenv("PREFETCH_MIN_CHARS", 3))
+)
@@ -0,0 +1,226 @@
+"""
+Profiler Service - On-demand sampling profiler and slow-turn capture
+"""
+
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _fold_stack(frame, root: str) -> str:
+    """Collapse a frame chain into 'root;outer;...;inner' (flamegraph.pl format)"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ";".join(reversed(labels))
+
+
+def _thread_names() -> Dict[int, str]:
+    return {t.ident: t.name for t in threading.enumerate()}
+
+
+class Profile:
+    """One time-boxed statistical profile of the whole process"""
+
+    def __init__(self, duration: float, interval: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.duration = duration
+        self.interval = interval
+        self.started_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.samples = 0
+        self.stacks: Counter = Counter()
+
+    @property
+    def running(self) -> bool:
+        return self.finished_at is None
+
+    def folded(self) -> str:
+        """Collapsed stacks, one 'stack count' line each"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": "running" if self.running else "done",
+            "duration_s": self.duration,
+            "interval_ms": round(self.interval * 1000, 2),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "samples": self.samples,
+            "unique_stacks": len(self.stacks)
+        }
+
+
+class SamplingProfiler:
+    """Samples every thread's stack from a background thread"""
+
+    def __init__(self):
+        self.max_duration = float(os.getenv("PROFILE_MAX_SECONDS", 120))
+        self.profiles: deque = deque(maxlen=5)
+        self._active: Optional[Profile] = None
+
+    def start(self, duration: float = 30, interval_ms: float = 10) -> Optional[Profile]:
+        """
+        Start a profile in the background
+
+        Returns:
+            The new Profile, or None if one is already running
+        """
+        if self._active is not None:
+            return None
+
+        profile = Profile(min(max(duration, 1), self.max_duration), max(interval_ms, 1) / 1000)
+        self._active = profile
+        self.profiles.append(profile)
+        threading.Thread(target=self._run, args=(profile,), name="profiler", daemon=True).start()
+        print(f"🔬 Profiling for {profile.duration}s (profile {profile.id})")
+        return profile
+
+    def _run(self, profile: Profile):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + profile.duration
+        names = _thread_names()
+        try:
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    if thread_id not in names:
+                        names = _thread_names()
+                    profile.stacks[_fold_stack(frame, names.get(thread_id, str(thread_id)))] += 1
+                profile.samples += 1
+                time.sleep(profile.interval)
+        finally:
+            profile.finished_at = datetime.now().isoformat()
+            self._active = None
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        for profile in self.profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+
+class _Turn:
+    __slots__ = ("name", "session_id", "start", "ticks", "samples", "trace")
+
+    def __init__(self, name: str, session_id: str, trace):
+        self.name = name
+        self.session_id = session_id
+        self.start = time.monotonic()
+        self.ticks = 0
+        self.samples: Counter = Counter()
+        self.trace = trace
+
+
+class SlowTurnMonitor:
+    """
+    Captures stack samples and the span breakdown of slow turns
+
+    Once a turn has been in flight longer than SLOW_TURN_MS, a watchdog
+    thread samples every thread's stack until the turn ends. Turns
+    interleave on the event loop and hand work to worker threads, so these
+    are whole-process samples taken during the slow window, labeled by
+    thread: they show what the process was busy with (possibly other
+    sessions), not a profile of the turn alone. The span breakdown is the
+    per-turn view.
+    """
+
+    def __init__(self):
+        self.threshold = float(os.getenv("SLOW_TURN_MS", 2000)) / 1000
+        self.sample_interval = float(os.getenv("SLOW_TURN_SAMPLE_MS", 20)) / 1000
+        self.captures: deque = deque(maxlen=int(os.getenv("SLOW_TURN_BUFFER_SIZE", 50)))
+        self._active: Dict[int, _Turn] = {}
+        self._lock = threading.Lock()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def _ensure_watchdog(self):
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watch, name="slow-turn-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _watch(self):
+        own_id = threading.get_ident()
+        names: Dict[int, str] = {}
+        while True:
+            time.sleep(self.sample_interval)
+            now = time.monotonic()
+            with self._lock:
+                slow = [turn for turn in self._active.values() if now - turn.start >= self.threshold]
+            if not slow:
+                continue
+
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in names:
+                    names = _thread_names()
+                stacks.append(_fold_stack(frame, names.get(thread_id, str(thread_id))))
+            for turn in slow:
+                turn.ticks += 1
+                turn.samples.update(stacks)
+
+    @contextmanager
+    def watch(self, name: str, session_id: str, trace=None):
+        """Watch one turn; record a capture if it exceeds the threshold"""
+        if self.threshold <= 0:
+            yield
+            return
+
+        self._ensure_watchdog()
+        turn = _Turn(name, session_id, trace)
+        key = id(turn)
+        with self._lock:
+            self._active[key] = turn
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._active[key]
+            elapsed = time.monotonic() - turn.start
+            if elapsed >= self.threshold:
+                self._record(turn, elapsed)
+
+    def _record(self, turn: _Turn, elapsed: float):
+        self.captures.append({
+            "name": turn.name,
+            "session_id": turn.session_id,
+            "duration_ms": round(elapsed * 1000, 1),
+            "captured_at": datetime.now().isoformat(),
+            "trace_id": turn.trace.trace_id if turn.trace else None,
+            "spans": turn.trace.breakdown() if turn.trace else {},
+            "stack_samples": turn.ticks,
+            # Every thread in the process while the turn was slow, not just this turn
+            "stack_scope": "process",
+            "stacks": [
+                {"stack": stack, "count": count}
+                for stack, count in turn.samples.most_common(20)
+            ]
+        })
+        print(f"🐢 Slow turn: {turn.name} took {elapsed * 1000:.0f}ms (session {turn.session_id})")
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        return list(self.captures)[-limit:][::-1]
+
+
+# Singleton instances
+profiler = SamplingProfiler()
+slow_turns = SlowTurnMonitor()
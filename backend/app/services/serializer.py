@@ -0,0 +1,83 @@
+"""
+Serializer - JSON encoding and decoding with an optional fast backend
+
+Uses orjson when it is installed (JSON_BACKEND=auto) and the standard
+library otherwise. Both produce compact UTF-8 JSON in the form Starlette
+sends, so clients see the same payloads whichever backend is active.
+"""
+
+import os
+import json
+from typing import Any, Union
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError  # orjson.JSONDecodeError subclasses it
+
+_std_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+_backend = None  # orjson module when active
+
+
+def use_backend(name: str) -> str:
+    """
+    Select the JSON backend
+
+    Args:
+        name: "auto" (orjson if installed), "orjson" or "stdlib"
+
+    Returns:
+        Name of the backend now in use
+    """
+    global _backend
+    if name not in ("auto", "orjson", "stdlib"):
+        raise ValueError(f"Unknown JSON backend: {name}")
+    if name == "orjson" and orjson is None:
+        print("⚠️ JSON_BACKEND=orjson but orjson is not installed - using stdlib json")
+    _backend = orjson if name != "stdlib" else None
+    return backend_name()
+
+
+def backend_name() -> str:
+    return "orjson" if _backend is not None else "stdlib"
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON as UTF-8 bytes"""
+    if _backend is not None:
+        return _backend.dumps(obj, option=_backend.OPT_NON_STR_KEYS)
+    return _std_encoder.encode(obj).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    """Compact JSON as text (SQLite TEXT columns, WebSocket text frames)"""
+    if _backend is not None:
+        return _backend.dumps(obj, option=_backend.OPT_NON_STR_KEYS).decode("utf-8")
+    return _std_encoder.encode(obj)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if _backend is not None:
+        return _backend.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoded by the active backend
+
+    Pre-encoded bytes (e.g. KB fragments) are sent as they are instead of
+    being parsed and encoded again.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
+
+
+use_backend(os.getenv("JSON_BACKEND", "auto"))
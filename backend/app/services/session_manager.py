@@ -3,15 +3,36 @@ Session Manager - Handles support session creation and management
 """
 
 import os
+import sys
+import time
 import uuid
-import random
-import string
+import heapq
+import asyncio
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from dotenv import load_dotenv
 
+from .metrics import metrics
+from .code_allocator import CodeAllocator
+from .session_records import MessageRecord, SessionRecord, from_iso, to_iso
+
 load_dotenv()
 
+SESSION_EVICTIONS = metrics.counter(
+    "akai_session_evictions_total", "Sessions evicted from memory", ["reason"]
+)
+SESSION_CACHE_REQUESTS = metrics.counter(
+    "akai_session_cache_requests_total", "Session cache lookups", ["result"]
+)
+
+# Rough per-object costs for memory accounting: a MessageRecord plus its
+# content string header (see bench/bench_session_memory.py), and a
+# SessionRecord with its containers
+MESSAGE_OVERHEAD_BYTES = 160
+SESSION_OVERHEAD_BYTES = 1000
+SCREENSHOT_BYTES = 600
+
 # Import database (lazy to avoid circular imports)
 _db = None
 def get_db():
@@ -22,126 +43,393 @@ def get_db():
     return _db
 
 
+def _estimate_session_bytes(session: SessionRecord) -> int:
+    """Approximate resident size of a session"""
+    size = SESSION_OVERHEAD_BYTES + SCREENSHOT_BYTES * len(session.screenshots)
+    for message in session.messages:
+        size += MESSAGE_OVERHEAD_BYTES + len(message.content or "")
+        if message.metadata:
+            size += len(str(message.metadata))
+    return size
+
+
+class SessionCache:
+    """
+    LRU cache of hydrated sessions bounded by count and approximate bytes
+
+    Lookups move a session to the most-recently-used end; inserts and growth
+    evict from the other end until both limits hold. The entry being inserted
+    or grown is never evicted, so one oversized session can still be served.
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int, on_evict=None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, SessionRecord]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def values(self) -> List[SessionRecord]:
+        return list(self._entries.values())
+
+    def get(self, session_id: str) -> Optional[SessionRecord]:
+        """Look up a session, counting a hit or miss and marking it recently used"""
+        session = self._entries.get(session_id)
+        if session is None:
+            self.misses += 1
+            SESSION_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        SESSION_CACHE_REQUESTS.labels("hit").inc()
+        return session
+
+    def peek(self, session_id: str) -> Optional[SessionRecord]:
+        """Look up a session without touching LRU order or stats"""
+        return self._entries.get(session_id)
+
+    def put(self, session_id: str, session: SessionRecord):
+        self.pop(session_id)
+        self._entries[session_id] = session
+        self._sizes[session_id] = _estimate_session_bytes(session)
+        self.resident_bytes += self._sizes[session_id]
+        self._evict()
+
+    def resize(self, session_id: str):
+        """Re-measure a session after it changed"""
+        if session_id not in self._entries:
+            return
+        size = _estimate_session_bytes(self._entries[session_id])
+        self.resident_bytes += size - self._sizes[session_id]
+        self._sizes[session_id] = size
+        self._evict()
+
+    def pop(self, session_id: str) -> Optional[SessionRecord]:
+        session = self._entries.pop(session_id, None)
+        if session is not None:
+            self.resident_bytes -= self._sizes.pop(session_id)
+        return session
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_sessions or self.resident_bytes > self.max_bytes
+        ):
+            session_id, session = self._entries.popitem(last=False)
+            self.resident_bytes -= self._sizes.pop(session_id)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(session_id, session)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "resident_mb": round(self.resident_bytes / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions
+        }
+
+
 class SessionManager:
     """Manages support sessions with conversation history"""
 
     def __init__(self):
-        # In-memory cache for fast access
-        self.sessions: Dict[str, Dict[str, Any]] = {}
+        # Bounded in-memory cache for fast access; the database is the source of truth
+        self.sessions = SessionCache(
+            max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", 1000)),
+            max_bytes=int(float(os.getenv("SESSION_CACHE_MAX_MB", 256)) * 1024 * 1024),
+            on_evict=self._on_cache_evict
+        )
         self.code_to_session: Dict[str, str] = {}  # Maps short codes to session IDs
         self.timeout_minutes = int(os.getenv("SESSION_TIMEOUT_MINUTES", 30))
 
-    def _generate_code(self, length: int = 4) -> str:
-        """Generate a short numeric code for easy verbal sharing"""
-        return ''.join(random.choices(string.digits, k=length))
+        # Only the most recent messages are kept in memory; older ones stay in the DB.
+        # A session holds up to twice this many before being trimmed back.
+        self.message_window = int(os.getenv("SESSION_MESSAGE_WINDOW", 50))
+
+        # Idle expiry: last activity per session plus a min-heap of (expires_at, session_id).
+        # Heap entries are lazy - activity only updates _last_activity, and a popped
+        # entry whose session has been active since is pushed back with its real deadline.
+        self._last_activity: Dict[str, float] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._evicted_count = 0
+        self._evicted_codes: Dict[str, str] = {}  # Codes of sessions evicted for capacity
+
+        metrics.gauge("akai_session_expiry_heap_size", "Entries in the session expiry heap").set_function(
+            lambda: len(self._expiry_heap)
+        )
+        # Join codes: SESSION_CODE_LENGTH characters from SESSION_CODE_ALPHABET
+        self.code_allocator = CodeAllocator(
+            alphabet=os.getenv("SESSION_CODE_ALPHABET", "0123456789"),
+            length=int(os.getenv("SESSION_CODE_LENGTH", 4)),
+            load_in_use=lambda: get_db().get_session_codes()
+        )
+        self._load_claimed_codes()
+
+        metrics.gauge("akai_session_codes_in_use", "Join codes currently held").set_function(
+            lambda: self.code_allocator.get_stats()["in_use"]
+        )
+        metrics.gauge("akai_session_cache_bytes", "Approximate bytes held by cached sessions").set_function(
+            lambda: self.sessions.resident_bytes
+        )
+
+    def _load_claimed_codes(self):
+        """
+        Seed the allocator from the database
+
+        Codes of sessions idle past the timeout (e.g. from before a restart)
+        are released first; the rest are marked in use.
+        """
+        try:
+            cutoff = (datetime.now() - timedelta(minutes=self.timeout_minutes)).isoformat()
+            released = get_db().release_stale_session_codes(cutoff)
+            if released:
+                print(f"🔓 Released {released} stale session codes")
+            self.code_allocator.mark_in_use(get_db().get_session_codes())
+        except Exception as e:
+            print(f"DB code load error: {e}")
+
+    def _claim_code(self, session_id: str, created_at: str) -> str:
+        """
+        Allocate a join code and claim it in the database
+
+        The database's UNIQUE constraint arbitrates between workers: a code
+        another worker already holds is marked in use and the next one tried.
+        """
+        while True:
+            code = self.code_allocator.allocate()
+            try:
+                if get_db().claim_session_code(session_id, code, created_at):
+                    return code
+            except Exception as e:
+                print(f"DB save error: {e}")
+                return code
+            self.code_allocator.mark_in_use([code])
+
+    def _release_code(self, session_id: str, code: str):
+        """Make a session's join code available again"""
+        try:
+            get_db().release_session_code(session_id)
+        except Exception as e:
+            print(f"DB code release error: {e}")
+        self.code_allocator.release(code)
 
-    def _cleanup_expired_sessions(self):
-        """Remove expired sessions"""
-        now = datetime.now()
-        expired = []
+    @property
+    def _timeout_seconds(self) -> float:
+        return self.timeout_minutes * 60
 
-        for session_id, session in self.sessions.items():
-            created_at = datetime.fromisoformat(session["created_at"])
-            if now - created_at > timedelta(minutes=self.timeout_minutes):
-                expired.append(session_id)
+    def _schedule_expiry(self, session_id: str):
+        """Record activity and make sure the session has a heap entry"""
+        now = time.time()
+        self._last_activity[session_id] = now
+        heapq.heappush(self._expiry_heap, (now + self._timeout_seconds, session_id))
 
-        for session_id in expired:
-            self.delete_session(session_id)
+    def _touch(self, session_id: str):
+        """Record activity - O(1), the heap entry is corrected lazily"""
+        self._last_activity[session_id] = time.time()
 
-    def create_session(self) -> Dict[str, Any]:
+    def _cleanup_expired_sessions(self, now: Optional[float] = None) -> int:
         """
-        Create a new support session
+        Evict sessions idle longer than the timeout
+
+        Pops only heap entries that are due, so each call costs O(k log n)
+        for k due entries instead of a scan over every session.
 
         Returns:
-            Session dict with id, code, and metadata
+            Number of sessions evicted
         """
-        # Cleanup old sessions first
-        self._cleanup_expired_sessions()
+        now = now if now is not None else time.time()
+        evicted = 0
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, session_id = heapq.heappop(self._expiry_heap)
+            last_activity = self._last_activity.get(session_id)
+            if last_activity is None:
+                continue  # Already deleted
+
+            deadline = last_activity + self._timeout_seconds
+            if deadline > now:
+                heapq.heappush(self._expiry_heap, (deadline, session_id))
+                continue
+
+            if session_id in self.sessions:
+                self._persist_final_state(session_id)
+                self.delete_session(session_id)
+            else:
+                self._expire_evicted(session_id)
+            SESSION_EVICTIONS.labels("expired").inc()
+            self._evicted_count += 1
+            evicted += 1
+
+        return evicted
+
+    def _expire_evicted(self, session_id: str):
+        """Expire a session that was already evicted from the cache"""
+        self._last_activity.pop(session_id, None)
+        code = self._evicted_codes.pop(session_id, None)
+        if code:
+            if self.code_to_session.get(code) == session_id:
+                del self.code_to_session[code]
+            self._release_code(session_id, code)
+
+    def _persist_final_state(self, session_id: str, session: Optional[SessionRecord] = None):
+        """
+        Write a session's last state to the database before it leaves memory
 
-        # Generate unique ID and code
-        session_id = str(uuid.uuid4())
+        Messages are appended to the database as they arrive, so only the
+        status needs writing here.
+        """
+        session = session or self.sessions.peek(session_id)
+        if not session:
+            return
+        try:
+            get_db().update_session_status(session_id, session.status)
+        except Exception as e:
+            print(f"DB save error: {e}")
+
+    def _on_cache_evict(self, session_id: str, session: SessionRecord):
+        """
+        Drop a least-recently-used session from memory (it stays in the DB)
+
+        Its code mapping and expiry entry are kept so the code still resolves
+        and is reclaimed once the session goes idle.
+        """
+        self._persist_final_state(session_id, session)
+        if session.code:
+            self._evicted_codes[session_id] = session.code
+        SESSION_EVICTIONS.labels("capacity").inc()
+
+    async def run_expiry(self, max_interval: float = 60.0):
+        """Background task: sleep until the next deadline, then evict"""
+        while True:
+            self._cleanup_expired_sessions()
+            if self._expiry_heap:
+                delay = self._expiry_heap[0][0] - time.time()
+            else:
+                delay = max_interval
+            await asyncio.sleep(min(max(delay, 1.0), max_interval))
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Session cache occupancy and hit rate (for /health)"""
+        stats = self.sessions.get_stats()
+        stats["message_window"] = self.message_window
+        stats["codes"] = self.code_allocator.get_stats()
+        return stats
+
+    def get_expiry_stats(self) -> Dict[str, Any]:
+        """Expiry scheduler state (for /health)"""
+        next_expiry = self._expiry_heap[0][0] - time.time() if self._expiry_heap else None
+        return {
+            "timeout_minutes": self.timeout_minutes,
+            "scheduled": len(self._expiry_heap),
+            "evicted": self._evicted_count,
+            "next_check_in_s": round(max(next_expiry, 0), 1) if next_expiry is not None else None
+        }
+
+    def create_session(self) -> SessionRecord:
+        """
+        Create a new support session
 
-        # Generate unique short code (retry if collision)
-        code = self._generate_code()
-        while code in self.code_to_session:
-            code = self._generate_code()
+        Returns:
+            SessionRecord with id, code, and metadata
+
+        Raises:
+            CodeSpaceExhausted: If every join code is in use
+        """
+        # Generate unique ID and claim a unique short code (also persists the session)
+        session_id = str(uuid.uuid4())
+        created_at = time.time()
+        code = self._claim_code(session_id, to_iso(created_at))
 
         # Create session
-        session = {
-            "id": session_id,
-            "code": code,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
-            "status": "active",
-            "messages": [],
-            "screenshots": [],
-            "metadata": {
+        session = SessionRecord(
+            session_id,
+            code,
+            created_at=created_at,
+            metadata={
                 "user_agent": None,
                 "platform": None,
                 "resolution": None
             }
-        }
+        )
 
         # Store session in memory and database
-        self.sessions[session_id] = session
+        self.sessions.put(session_id, session)
         self.code_to_session[code] = session_id
-
-        # Persist to database
-        try:
-            get_db().save_session(session_id, code, [])
-        except Exception as e:
-            print(f"DB save error: {e}")
+        self._schedule_expiry(session_id)
 
         print(f"📝 Created session: {session_id} (code: {code})")
 
         return session
 
-    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+    def get_session(self, session_id: str) -> Optional[SessionRecord]:
         """
         Get a session by ID
 
+        Reading a session counts as activity for expiry but does not change
+        its updated_at, which tracks the last modification.
+
         Args:
             session_id: The session UUID
 
         Returns:
-            Session dict or None if not found
+            SessionRecord or None if not found
         """
         session = self.sessions.get(session_id)
 
-        # Try loading from database if not in memory
+        # Try loading from database if not in memory (recent messages only)
         if not session:
             try:
-                db_session = get_db().get_session(session_id)
+                db_session = get_db().get_session(session_id, message_limit=self.message_window)
                 if db_session:
-                    session = {
-                        "id": db_session["id"],
-                        "code": db_session["code"],
-                        "created_at": db_session["created_at"],
-                        "updated_at": datetime.now().isoformat(),
-                        "status": "active",
-                        "messages": db_session.get("messages", []),
-                        "screenshots": [],
-                        "metadata": {}
-                    }
-                    self.sessions[session_id] = session
-                    self.code_to_session[db_session["code"]] = session_id
+                    messages = [MessageRecord.from_dict(m) for m in db_session.get("messages", [])]
+                    session = SessionRecord(
+                        db_session["id"],
+                        db_session["code"],
+                        created_at=from_iso(db_session["created_at"]),
+                        status=db_session.get("status", "active"),
+                        messages=messages,
+                        message_offset=db_session.get("message_count", len(messages)) - len(messages)
+                    )
+                    self.sessions.put(session_id, session)
+                    self._evicted_codes.pop(session_id, None)
+                    if session.code:
+                        self.code_to_session[session.code] = session_id
+                    self._schedule_expiry(session_id)
             except Exception as e:
                 print(f"DB load error: {e}")
 
         if session:
-            session["updated_at"] = datetime.now().isoformat()
+            self._touch(session_id)
 
         return session
 
-    def get_session_by_code(self, code: str) -> Optional[Dict[str, Any]]:
+    def get_session_by_code(self, code: str) -> Optional[SessionRecord]:
         """
         Get a session by short code
 
         Args:
-            code: The 4-digit short code
+            code: The short join code
 
         Returns:
-            Session dict or None if not found
+            SessionRecord or None if not found
         """
         session_id = self.code_to_session.get(code)
         if session_id:
@@ -149,7 +437,7 @@ class SessionManager:
 
         # Try loading from database
         try:
-            db_session = get_db().get_session_by_code(code)
+            db_session = get_db().get_session_by_code(code, message_limit=0)
             if db_session:
                 return self.get_session(db_session["id"])
         except Exception as e:
@@ -180,21 +468,21 @@ class SessionManager:
         if not session:
             return False
 
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        }
+        message = MessageRecord(role, content, metadata=metadata or None)
 
-        if metadata:
-            message["metadata"] = metadata
+        session.messages.append(message)
+        session.updated_at = message.timestamp
 
-        session["messages"].append(message)
-        session["updated_at"] = datetime.now().isoformat()
+        # Trim back to the window once it has doubled, so trimming is amortized
+        if len(session.messages) > 2 * self.message_window:
+            dropped = len(session.messages) - self.message_window
+            session.messages = session.messages[dropped:]
+            session.message_offset += dropped
+        self.sessions.resize(session_id)
 
-        # Persist to database
+        # Persist to database (append only - the full history is never rewritten)
         try:
-            get_db().update_session_messages(session_id, session["messages"])
+            get_db().append_session_message(session_id, message.to_dict())
         except Exception as e:
             print(f"DB message save error: {e}")
 
@@ -228,12 +516,13 @@ class SessionManager:
             "description": description
         }
 
-        session["screenshots"].append(screenshot)
-        session["updated_at"] = datetime.now().isoformat()
+        session.screenshots.append(screenshot)
+        session.updated_at = time.time()
 
         # Keep only last 20 screenshots
-        if len(session["screenshots"]) > 20:
-            session["screenshots"] = session["screenshots"][-20:]
+        if len(session.screenshots) > 20:
+            session.screenshots = session.screenshots[-20:]
+        self.sessions.resize(session_id)
 
         return True
 
@@ -256,8 +545,8 @@ class SessionManager:
         if not session:
             return False
 
-        session["metadata"].update(metadata)
-        session["updated_at"] = datetime.now().isoformat()
+        session.metadata.update(metadata)
+        session.updated_at = time.time()
 
         return True
 
@@ -280,8 +569,13 @@ class SessionManager:
         if status not in valid_statuses:
             return False
 
-        session["status"] = status
-        session["updated_at"] = datetime.now().isoformat()
+        session.status = sys.intern(status)
+        session.updated_at = time.time()
+
+        try:
+            get_db().update_session_status(session_id, status)
+        except Exception as e:
+            print(f"DB status save error: {e}")
 
         print(f"📊 Session {session_id} status changed to: {status}")
 
@@ -297,17 +591,20 @@ class SessionManager:
         Returns:
             True if deleted, False if not found
         """
-        session = self.sessions.get(session_id)
+        session = self.sessions.peek(session_id)
         if not session:
             return False
 
-        # Remove code mapping
-        code = session.get("code")
+        # Remove code mapping and free the code for new sessions
+        code = session.code
         if code and code in self.code_to_session:
             del self.code_to_session[code]
+        if code:
+            self._release_code(session_id, code)
 
         # Remove session
-        del self.sessions[session_id]
+        self.sessions.pop(session_id)
+        self._last_activity.pop(session_id, None)
 
         print(f"🗑️ Deleted session: {session_id}")
 
@@ -327,27 +624,37 @@ class SessionManager:
         if not session:
             return None
 
-        # Extract key information
-        messages = session.get("messages", [])
-        user_messages = [m for m in messages if m["role"] == "user"]
+        return self._summarize(session)
+
+    def _summarize(self, session: SessionRecord) -> Dict[str, Any]:
+        """Build a handoff summary without counting as session activity"""
+        messages = session.messages
+        user_problem = None
+        if session.message_offset:
+            # The opening message may have been trimmed from memory
+            try:
+                first = get_db().get_first_session_message(session.id, "user")
+                user_problem = first["content"] if first else None
+            except Exception as e:
+                print(f"DB load error: {e}")
+        if user_problem is None:
+            user_problem = next((m.content for m in messages if m.role == "user"), "Unknown")
 
         return {
-            "session_id": session_id,
-            "code": session.get("code"),
-            "created_at": session.get("created_at"),
+            "session_id": session.id,
+            "code": session.code,
+            "created_at": to_iso(session.created_at),
             "duration_minutes": self._calculate_duration(session),
-            "status": session.get("status"),
-            "message_count": len(messages),
-            "user_problem": user_messages[0]["content"] if user_messages else "Unknown",
-            "last_message": messages[-1]["content"] if messages else None,
-            "screenshot_count": len(session.get("screenshots", []))
+            "status": session.status,
+            "message_count": session.message_count,
+            "user_problem": user_problem,
+            "last_message": messages[-1].content if messages else None,
+            "screenshot_count": len(session.screenshots)
         }
 
-    def _calculate_duration(self, session: Dict) -> int:
+    def _calculate_duration(self, session: SessionRecord) -> int:
         """Calculate session duration in minutes"""
-        created = datetime.fromisoformat(session["created_at"])
-        updated = datetime.fromisoformat(session["updated_at"])
-        return int((updated - created).total_seconds() / 60)
+        return int((session.updated_at - session.created_at) / 60)
 
     def get_all_active_sessions(self) -> List[Dict[str, Any]]:
         """
@@ -356,10 +663,8 @@ class SessionManager:
         Returns:
             List of session summaries
         """
-        self._cleanup_expired_sessions()
-
         return [
-            self.get_session_summary(sid)
-            for sid, session in self.sessions.items()
-            if session.get("status") == "active"
+            self._summarize(session)
+            for session in self.sessions.values()
+            if session.status == "active"
         ]
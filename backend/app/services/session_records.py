@@ -0,0 +1,126 @@
+"""
+Session Records - Compact in-memory session and message representations
+"""
+
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+# Messages Claude sees as conversation history
+HISTORY_CONTEXT_MESSAGES = 10
+
+
+def to_iso(timestamp: float) -> str:
+    """Epoch seconds to the ISO format used by the API and database"""
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def from_iso(value: Optional[str]) -> float:
+    """ISO string to epoch seconds (now if missing or unparseable)"""
+    if value:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+class MessageRecord:
+    """
+    One chat message
+
+    Roles are interned so every message shares the same few role strings,
+    and the timestamp is kept as epoch seconds; the ISO form is only built
+    by to_dict() when the message crosses the API or database boundary.
+    """
+
+    __slots__ = ("role", "content", "timestamp", "metadata")
+
+    def __init__(
+        self,
+        role: str,
+        content: str,
+        timestamp: Optional[float] = None,
+        metadata: Optional[Dict] = None
+    ):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.metadata = metadata
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MessageRecord":
+        return cls(
+            data["role"],
+            data["content"],
+            from_iso(data.get("timestamp")),
+            data.get("metadata")
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": to_iso(self.timestamp)
+        }
+        if self.metadata:
+            data["metadata"] = self.metadata
+        return data
+
+
+class SessionRecord:
+    """A support session and its most recent messages"""
+
+    __slots__ = (
+        "id", "code", "created_at", "updated_at", "status",
+        "messages", "message_offset", "screenshots", "metadata"
+    )
+
+    def __init__(
+        self,
+        id: str,
+        code: Optional[str],
+        created_at: Optional[float] = None,
+        status: str = "active",
+        messages: Optional[List[MessageRecord]] = None,
+        message_offset: int = 0,
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        now = time.time()
+        self.id = id
+        self.code = code
+        self.created_at = created_at if created_at is not None else now
+        self.updated_at = now
+        self.status = sys.intern(status)
+        self.messages: List[MessageRecord] = messages if messages is not None else []
+        self.message_offset = message_offset  # Messages older than the in-memory window
+        self.screenshots: List[Dict[str, Any]] = []
+        self.metadata: Dict[str, Any] = metadata if metadata is not None else {}
+
+    @property
+    def message_count(self) -> int:
+        return self.message_offset + len(self.messages)
+
+    def conversation_history(self, limit: Optional[int] = HISTORY_CONTEXT_MESSAGES) -> List[Dict[str, str]]:
+        """
+        Recent messages in the role/content form the Claude API expects
+
+        Args:
+            limit: Number of most recent messages (None for all resident ones)
+        """
+        messages = self.messages[-limit:] if limit else self.messages
+        return [{"role": m.role, "content": m.content} for m in messages]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "code": self.code,
+            "created_at": to_iso(self.created_at),
+            "updated_at": to_iso(self.updated_at),
+            "status": self.status,
+            "messages": [m.to_dict() for m in self.messages],
+            "message_offset": self.message_offset,
+            "screenshots": self.screenshots,
+            "metadata": self.metadata
+        }
@@ -4,116 +4,349 @@ Speech Service - Handles Speech-to-Text (Whisper) and Text-to-Speech
 
 import os
 import io
+import time
 import base64
+import asyncio
 import tempfile
-from typing import Optional
-from openai import OpenAI
+import importlib.util
+from typing import Optional, Dict, List, Tuple
 from dotenv import load_dotenv
 
+from .metrics import metrics
+
 load_dotenv()
 
+SPEECH_SECONDS = metrics.histogram(
+    "akai_speech_seconds", "STT/TTS latency", ["operation", "provider"]
+)
+SPEECH_ERRORS = metrics.counter(
+    "akai_speech_errors_total", "Failed STT/TTS calls", ["operation", "provider"]
+)
 
-class SpeechService:
-    """Service for speech recognition and synthesis"""
+
+class SpeechProvider:
+    """Base class for a speech backend (STT and/or TTS)"""
+
+    name = "base"
+
+    def available(self, operation: str) -> bool:
+        """Whether this provider can handle 'transcribe' or 'synthesize'"""
+        return False
+
+    @property
+    def warm(self) -> bool:
+        """Whether the provider can answer without a cold start"""
+        return True
+
+    def transcribe(self, audio_data: bytes, extension: str) -> str:
+        raise NotImplementedError
+
+    def synthesize(self, text: str, voice: Optional[str] = None) -> Tuple[bytes, str]:
+        """Returns (audio bytes, audio format)"""
+        raise NotImplementedError
+
+
+class OpenAISpeechProvider(SpeechProvider):
+    """OpenAI Whisper STT and TTS over the network"""
+
+    name = "openai"
 
     def __init__(self):
         api_key = os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=api_key) if api_key else None
+        self.client = None
+        if api_key:
+            from openai import OpenAI
+            self.client = OpenAI(api_key=api_key)
         self.stt_model = "whisper-1"
         self.tts_model = "tts-1"
         self.tts_voice = "nova"  # Options: alloy, echo, fable, onyx, nova, shimmer
 
-        if not self.client:
-            print("⚠️ OpenAI API key not set - speech features disabled")
+    def available(self, operation: str) -> bool:
+        return self.client is not None
+
+    def transcribe(self, audio_data: bytes, extension: str) -> str:
+        # Create a temporary file
+        with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as temp_file:
+            temp_file.write(audio_data)
+            temp_file_path = temp_file.name
+
+        try:
+            # Transcribe with Whisper
+            with open(temp_file_path, "rb") as audio_file:
+                transcript = self.client.audio.transcriptions.create(
+                    model=self.stt_model,
+                    file=audio_file,
+                    response_format="text"
+                )
+
+            return transcript.strip()
+
+        finally:
+            # Clean up temp file
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+    def synthesize(self, text: str, voice: Optional[str] = None) -> Tuple[bytes, str]:
+        response = self.client.audio.speech.create(
+            model=self.tts_model,
+            voice=voice or self.tts_voice,
+            input=text,
+            response_format="mp3"
+        )
+        return response.content, "mp3"
+
+
+class LocalSpeechProvider(SpeechProvider):
+    """
+    Offline CPU backend: faster-whisper (quantized Whisper) for STT and
+    pyttsx3 for TTS. Both are optional dependencies and are loaded lazily.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self.stt_model_size = os.getenv("LOCAL_STT_MODEL", "base.en")
+        self.stt_compute_type = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+        self.stt_threads = int(os.getenv("LOCAL_STT_THREADS", 0))
+        self.tts_rate = int(os.getenv("LOCAL_TTS_RATE", 180))
+        self._stt_model = None
+        self._has_stt = importlib.util.find_spec("faster_whisper") is not None
+        self._has_tts = importlib.util.find_spec("pyttsx3") is not None
+
+    def available(self, operation: str) -> bool:
+        if operation == "transcribe":
+            return self._has_stt
+        if operation == "synthesize":
+            return self._has_tts
+        return False
+
+    @property
+    def warm(self) -> bool:
+        return self._stt_model is not None
+
+    def _get_stt_model(self):
+        """Load the Whisper model once and keep it resident"""
+        if self._stt_model is None:
+            from faster_whisper import WhisperModel
+            self._stt_model = WhisperModel(
+                self.stt_model_size,
+                device="cpu",
+                compute_type=self.stt_compute_type,
+                cpu_threads=self.stt_threads
+            )
+            print(f"🎙️ Local STT model loaded: {self.stt_model_size} ({self.stt_compute_type})")
+        return self._stt_model
+
+    def warm_up(self):
+        """Preload the STT model so the first request doesn't pay for it"""
+        if self._has_stt:
+            self._get_stt_model()
+
+    def transcribe(self, audio_data: bytes, extension: str) -> str:
+        model = self._get_stt_model()
+        segments, _ = model.transcribe(io.BytesIO(audio_data), beam_size=1, vad_filter=True)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+    def synthesize(self, text: str, voice: Optional[str] = None) -> Tuple[bytes, str]:
+        import pyttsx3
+
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+            temp_file_path = temp_file.name
+
+        try:
+            engine = pyttsx3.init()
+            engine.setProperty("rate", self.tts_rate)
+            engine.save_to_file(text, temp_file_path)
+            engine.runAndWait()
+            with open(temp_file_path, "rb") as audio_file:
+                return audio_file.read(), "wav"
+        finally:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+
+class SpeechService:
+    """Service for speech recognition and synthesis"""
+
+    def __init__(self):
+        self.providers: Dict[str, SpeechProvider] = {
+            "openai": OpenAISpeechProvider(),
+            "local": LocalSpeechProvider()
+        }
+        self.default_provider = os.getenv("SPEECH_PROVIDER", "auto")
+
+        # Requests at or below these sizes prefer a warm local model over the network
+        self.short_audio_bytes = int(os.getenv("SPEECH_SHORT_AUDIO_BYTES", 64000))
+        self.short_text_chars = int(os.getenv("SPEECH_SHORT_TEXT_CHARS", 200))
+
+        # Exponentially weighted latency per (provider, operation), in seconds
+        self._latency: Dict[Tuple[str, str], float] = {}
+        self._latency_alpha = 0.2
+
+        # Failing providers go to the back of the line for a while: (failures, until)
+        self._backoff: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self.backoff_base = float(os.getenv("SPEECH_BACKOFF_SECONDS", 5))
+        self.backoff_max = float(os.getenv("SPEECH_BACKOFF_MAX_SECONDS", 300))
+
+        if not any(p.available("transcribe") for p in self.providers.values()):
+            print("⚠️ No speech provider available - set OPENAI_API_KEY or install faster-whisper")
+
+    @property
+    def tts_voice(self) -> str:
+        return self.providers["openai"].tts_voice
+
+    def _record_latency(self, provider: str, operation: str, seconds: float):
+        key = (provider, operation)
+        previous = self._latency.get(key)
+        if previous is None:
+            self._latency[key] = seconds
+        else:
+            self._latency[key] = previous + self._latency_alpha * (seconds - previous)
+        self._backoff.pop(key, None)
+
+    def _record_failure(self, provider: str, operation: str):
+        """Back off from a provider, doubling the wait on each consecutive failure"""
+        key = (provider, operation)
+        failures = self._backoff.get(key, (0, 0.0))[0] + 1
+        delay = min(self.backoff_base * 2 ** (failures - 1), self.backoff_max)
+        self._backoff[key] = (failures, time.monotonic() + delay)
+
+    def _backing_off(self, provider: str, operation: str) -> bool:
+        backoff = self._backoff.get((provider, operation))
+        return backoff is not None and time.monotonic() < backoff[1]
+
+    def _route(self, operation: str, requested: Optional[str], short: bool) -> List[SpeechProvider]:
+        """
+        Order providers for a request: the requested one first, the rest as fallback
+
+        In 'auto' mode a warm local model wins for short inputs; otherwise the
+        provider with the lowest observed latency goes first. Providers with
+        no measurements come after measured ones, in registration order
+        (OpenAI first), and providers that just failed go last.
+        """
+        candidates = [p for p in self.providers.values() if p.available(operation)]
+        requested = requested or self.default_provider
+
+        if requested in self.providers:
+            candidates.sort(key=lambda p: p.name != requested)
+            return candidates
+
+        order = {name: i for i, name in enumerate(self.providers)}
+
+        def rank(provider: SpeechProvider):
+            if self._backing_off(provider.name, operation):
+                return (3, 0.0, order[provider.name])
+            if short and provider.name == "local" and provider.warm:
+                return (0, 0.0, 0)
+            latency = self._latency.get((provider.name, operation))
+            if latency is None:
+                return (2, 0.0, order[provider.name])
+            return (1, latency, order[provider.name])
+
+        candidates.sort(key=rank)
+        return candidates
+
+    async def _run(self, operation: str, providers: List[SpeechProvider], *args):
+        """Try providers in order, falling back on failure"""
+        last_error = None
+        for provider in providers:
+            start = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(getattr(provider, operation), *args)
+            except Exception as e:
+                print(f"{provider.name} {operation} error: {e}")
+                SPEECH_ERRORS.labels(operation, provider.name).inc()
+                self._record_failure(provider.name, operation)
+                last_error = e
+                continue
+            elapsed = time.perf_counter() - start
+            self._record_latency(provider.name, operation, elapsed)
+            SPEECH_SECONDS.labels(operation, provider.name).observe(elapsed)
+            return provider.name, result
+        raise last_error
 
     async def transcribe(
         self,
         audio_data: bytes,
-        filename: Optional[str] = None
+        filename: Optional[str] = None,
+        provider: Optional[str] = None
     ) -> str:
         """
-        Transcribe audio to text using Whisper API
+        Transcribe audio to text
 
         Args:
             audio_data: Raw audio bytes
             filename: Original filename (used to determine format)
+            provider: 'openai', 'local' or 'auto' (defaults to SPEECH_PROVIDER)
 
         Returns:
             Transcribed text
         """
-        if not self.client:
-            raise Exception("OpenAI API key not configured - speech-to-text unavailable")
-
-        try:
-            # Determine file extension
-            extension = ".webm"  # Default for browser audio
-            if filename:
-                if "." in filename:
-                    extension = "." + filename.split(".")[-1]
+        providers = self._route("transcribe", provider, len(audio_data) <= self.short_audio_bytes)
+        if not providers:
+            raise Exception("No speech-to-text provider configured - speech-to-text unavailable")
 
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_file_path = temp_file.name
-
-            try:
-                # Transcribe with Whisper
-                with open(temp_file_path, "rb") as audio_file:
-                    transcript = self.client.audio.transcriptions.create(
-                        model=self.stt_model,
-                        file=audio_file,
-                        response_format="text"
-                    )
-
-                return transcript.strip()
-
-            finally:
-                # Clean up temp file
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
+        # Determine file extension
+        extension = ".webm"  # Default for browser audio
+        if filename:
+            if "." in filename:
+                extension = "." + filename.split(".")[-1]
 
+        try:
+            _, transcript = await self._run("transcribe", providers, audio_data, extension)
+            return transcript
         except Exception as e:
             print(f"Transcription error: {e}")
             raise Exception(f"Failed to transcribe audio: {str(e)}")
 
-    async def synthesize(
+    async def synthesize_audio(
         self,
         text: str,
-        voice: Optional[str] = None
-    ) -> str:
+        voice: Optional[str] = None,
+        provider: Optional[str] = None
+    ) -> Dict[str, str]:
         """
-        Convert text to speech using OpenAI TTS
+        Convert text to speech
 
         Args:
             text: Text to convert to speech
             voice: Voice to use (optional, defaults to nova)
+            provider: 'openai', 'local' or 'auto' (defaults to SPEECH_PROVIDER)
 
         Returns:
-            Base64 encoded MP3 audio
+            Dict with base64 'audio', its 'format' and the 'provider' used
         """
-        if not self.client:
-            raise Exception("OpenAI API key not configured - text-to-speech unavailable")
+        providers = self._route("synthesize", provider, len(text) <= self.short_text_chars)
+        if not providers:
+            raise Exception("No text-to-speech provider configured - text-to-speech unavailable")
 
         try:
-            response = self.client.audio.speech.create(
-                model=self.tts_model,
-                voice=voice or self.tts_voice,
-                input=text,
-                response_format="mp3"
-            )
-
-            # Get audio bytes
-            audio_bytes = response.content
-
-            # Encode to base64
-            audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-
-            return audio_base64
-
+            name, (audio_bytes, audio_format) = await self._run("synthesize", providers, text, voice)
         except Exception as e:
             print(f"TTS error: {e}")
             raise Exception(f"Failed to synthesize speech: {str(e)}")
 
+        return {
+            "audio": base64.b64encode(audio_bytes).decode('utf-8'),
+            "format": audio_format,
+            "provider": name
+        }
+
+    async def synthesize(
+        self,
+        text: str,
+        voice: Optional[str] = None,
+        provider: Optional[str] = None
+    ) -> str:
+        """
+        Convert text to speech
+
+        Returns:
+            Base64 encoded audio (MP3 from OpenAI, WAV from the local engine)
+        """
+        result = await self.synthesize_audio(text, voice, provider)
+        return result["audio"]
+
     async def transcribe_stream(self, audio_chunk: bytes) -> Optional[str]:
         """
         Transcribe streaming audio (for real-time transcription)
@@ -129,6 +362,28 @@ class SpeechService:
         # True streaming would require a different approach (e.g., local Whisper)
         return await self.transcribe(audio_chunk)
 
+    async def warm_up(self):
+        """Preload local models in the background (SPEECH_LOCAL_PRELOAD=true)"""
+        if os.getenv("SPEECH_LOCAL_PRELOAD", "false").lower() != "true":
+            return
+        try:
+            await asyncio.to_thread(self.providers["local"].warm_up)
+        except Exception as e:
+            print(f"Local speech warm-up failed: {e}")
+
+    def get_status(self) -> Dict[str, Dict]:
+        """Provider availability and observed latency (for /health)"""
+        status = {}
+        for name, provider in self.providers.items():
+            status[name] = {
+                "stt": provider.available("transcribe"),
+                "tts": provider.available("synthesize"),
+                "warm": provider.warm,
+                "stt_latency_ms": round(self._latency.get((name, "transcribe"), 0) * 1000, 1),
+                "tts_latency_ms": round(self._latency.get((name, "synthesize"), 0) * 1000, 1)
+            }
+        return status
+
     def set_voice(self, voice: str):
         """
         Change the TTS voice
@@ -138,6 +393,6 @@ class SpeechService:
         """
         valid_voices = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
         if voice in valid_voices:
-            self.tts_voice = voice
+            self.providers["openai"].tts_voice = voice
         else:
             raise ValueError(f"Invalid voice. Choose from: {valid_voices}")
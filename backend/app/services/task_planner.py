@@ -4,11 +4,26 @@ Task Planner Service - Manages step-by-step task plans for IT support
 
 import uuid
 import re
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 
+from .keyword_matcher import KeywordMatcher
+
+# Sessions remembered as already loaded from the DB
+LOADED_SESSIONS_MAX = 10000
+
+# Import database (lazy to avoid circular imports)
+_db = None
+def get_db():
+    global _db
+    if _db is None:
+        from .database import db
+        _db = db
+    return _db
+
 
 class StepStatus(Enum):
     PENDING = "pending"
@@ -52,10 +67,31 @@ class TaskStep:
             "completed_at": self.completed_at
         }
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TaskStep":
+        return cls(
+            id=data["id"],
+            plan_id=data["plan_id"],
+            order=data["order"],
+            title=data["title"],
+            description=data["description"],
+            status=StepStatus(data.get("status", "pending")),
+            error_message=data.get("error_message"),
+            started_at=data.get("started_at"),
+            completed_at=data.get("completed_at")
+        )
+
 
 @dataclass
 class TaskPlan:
-    """A complete task plan with multiple steps"""
+    """
+    A complete task plan with multiple steps
+
+    Progress counts and the current-step position are maintained as steps
+    change, and to_dict() snapshots are cached until the next change, so
+    reads don't rescan the steps. Change steps and status only through
+    add_step(), update_step() and set_status().
+    """
     id: str
     session_id: str
     title: str
@@ -67,39 +103,127 @@ class TaskPlan:
     started_at: Optional[str] = None
     completed_at: Optional[str] = None
 
+    # Derived state
+    _counts: Dict[StepStatus, int] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _in_progress: set = field(default_factory=set, init=False, repr=False, compare=False)
+    _pending_cursor: int = field(default=0, init=False, repr=False, compare=False)
+    _version: int = field(default=0, init=False, repr=False, compare=False)
+    _snapshots: Dict[bool, Tuple[int, Dict[str, Any]]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        steps, self.steps = self.steps, []
+        for step in steps:
+            self.add_step(step)
+
+    @property
+    def version(self) -> int:
+        """Bumped on every step or status change"""
+        return self._version
+
+    @property
+    def is_active(self) -> bool:
+        """Whether the plan can still change (kept in the in-memory working set)"""
+        return self.status in (PlanStatus.CREATED, PlanStatus.IN_PROGRESS)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TaskPlan":
+        return cls(
+            id=data["id"],
+            session_id=data["session_id"],
+            title=data["title"],
+            description=data["description"],
+            template_id=data.get("template_id"),
+            steps=[
+                TaskStep.from_dict({**step, "plan_id": data["id"], "order": step.get("order", i + 1)})
+                for i, step in enumerate(data.get("steps", []))
+            ],
+            status=PlanStatus(data.get("status", "created")),
+            created_at=data.get("created_at") or datetime.now().isoformat(),
+            started_at=data.get("started_at"),
+            completed_at=data.get("completed_at")
+        )
+
+    def add_step(self, step: TaskStep):
+        """Append a step"""
+        self.steps.append(step)
+        self._counts[step.status] = self._counts.get(step.status, 0) + 1
+        if step.status == StepStatus.IN_PROGRESS:
+            self._in_progress.add(len(self.steps) - 1)
+        self._version += 1
+
+    def update_step(self, index: int, status: StepStatus, error_message: Optional[str] = None) -> TaskStep:
+        """
+        Move a step to a new status, stamping started_at/completed_at
+
+        Returns:
+            The updated step
+        """
+        step = self.steps[index]
+        self._counts[step.status] -= 1
+        self._counts[status] = self._counts.get(status, 0) + 1
+        if status == StepStatus.IN_PROGRESS:
+            self._in_progress.add(index)
+        else:
+            self._in_progress.discard(index)
+
+        step.status = status
+        if status == StepStatus.IN_PROGRESS:
+            step.started_at = datetime.now().isoformat()
+        elif status != StepStatus.PENDING:
+            step.completed_at = datetime.now().isoformat()
+        if error_message is not None:
+            step.error_message = error_message
+
+        self._version += 1
+        return step
+
+    def set_status(self, status: PlanStatus):
+        """Change plan status, stamping started_at/completed_at"""
+        self.status = status
+        if status == PlanStatus.IN_PROGRESS:
+            self.started_at = datetime.now().isoformat()
+        elif status == PlanStatus.COMPLETED:
+            self.completed_at = datetime.now().isoformat()
+        self._version += 1
+
     @property
     def progress(self) -> Dict[str, int]:
         """Calculate progress stats"""
         total = len(self.steps)
-        completed = sum(1 for s in self.steps if s.status == StepStatus.COMPLETED)
-        failed = sum(1 for s in self.steps if s.status == StepStatus.FAILED)
-        skipped = sum(1 for s in self.steps if s.status == StepStatus.SKIPPED)
-        pending = sum(1 for s in self.steps if s.status == StepStatus.PENDING)
-        in_progress = sum(1 for s in self.steps if s.status == StepStatus.IN_PROGRESS)
+        completed = self._counts.get(StepStatus.COMPLETED, 0)
 
         return {
             "total": total,
             "completed": completed,
-            "failed": failed,
-            "skipped": skipped,
-            "pending": pending,
-            "in_progress": in_progress,
+            "failed": self._counts.get(StepStatus.FAILED, 0),
+            "skipped": self._counts.get(StepStatus.SKIPPED, 0),
+            "pending": self._counts.get(StepStatus.PENDING, 0),
+            "in_progress": self._counts.get(StepStatus.IN_PROGRESS, 0),
             "percent": int((completed / total) * 100) if total > 0 else 0
         }
 
     @property
     def current_step(self) -> Optional[TaskStep]:
         """Get the current active step"""
-        for step in self.steps:
-            if step.status == StepStatus.IN_PROGRESS:
-                return step
-        # If no step is in progress, return next pending step
-        for step in self.steps:
+        if self._in_progress:
+            return self.steps[min(self._in_progress)]
+        # If no step is in progress, return next pending step. Steps never go
+        # back to pending, so the cursor only moves forward.
+        while self._pending_cursor < len(self.steps):
+            step = self.steps[self._pending_cursor]
             if step.status == StepStatus.PENDING:
                 return step
+            self._pending_cursor += 1
         return None
 
     def to_dict(self, include_steps: bool = True) -> Dict[str, Any]:
+        """Serialized plan, cached until the next change (treat as read-only)"""
+        cached = self._snapshots.get(include_steps)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
         result = {
             "id": self.id,
             "session_id": self.session_id,
@@ -116,6 +240,8 @@ class TaskPlan:
             result["steps"] = [s.to_dict() for s in self.steps]
         current = self.current_step
         result["current_step"] = current.to_dict() if current else None
+
+        self._snapshots[include_steps] = (self._version, result)
         return result
 
 
@@ -144,10 +270,134 @@ class TaskPlanner:
     """Task Planner for IT Support - manages step-by-step task plans"""
 
     def __init__(self):
+        # Working set of active (created or in-progress) plans; finished plans
+        # live only in the database and are loaded on demand
         self.plans: Dict[str, TaskPlan] = {}
+        # Sessions whose active plans were read from the DB (LRU; a dropped entry is just re-read)
+        self._loaded_sessions: "OrderedDict[str, None]" = OrderedDict()
+
+        # Indexes over the working set, maintained by _track/_untrack and _refresh_active
+        self._session_plans: Dict[str, Dict[str, None]] = {}  # session_id -> plan IDs (insertion-ordered)
+        self._active_plan: Dict[str, str] = {}  # session_id -> in-progress plan ID
+        self._step_index: Dict[str, Tuple[str, int]] = {}  # step_id -> (plan_id, index)
         self.templates: Dict[str, TaskTemplate] = {}
+        self._matcher: Optional[KeywordMatcher] = None  # Rebuilt lazily when templates change
+        self._template_scores: Dict[str, List[Tuple[int, int]]] = {}
+        self._template_order: List[TaskTemplate] = []
         self._init_default_templates()
 
+    def _load_plan(self, plan_id: str) -> Optional[TaskPlan]:
+        """Get a plan from the working set, falling back to the database"""
+        plan = self.plans.get(plan_id)
+        if plan:
+            return plan
+
+        try:
+            data = get_db().get_task_plan(plan_id)
+        except Exception as e:
+            print(f"DB plan load error: {e}")
+            return None
+        if not data:
+            return None
+
+        plan = TaskPlan.from_dict(data)
+        if plan.is_active:
+            self._track(plan)
+        return plan
+
+    def _track(self, plan: TaskPlan):
+        """Add a plan to the working set and its indexes"""
+        self.plans[plan.id] = plan
+        self._session_plans.setdefault(plan.session_id, {})[plan.id] = None
+        for i, step in enumerate(plan.steps):
+            self._step_index[step.id] = (plan.id, i)
+        if plan.status == PlanStatus.IN_PROGRESS:
+            self._active_plan.setdefault(plan.session_id, plan.id)
+
+    def _untrack(self, plan: TaskPlan):
+        """Remove a plan from the working set and its indexes"""
+        self.plans.pop(plan.id, None)
+        session_plans = self._session_plans.get(plan.session_id)
+        if session_plans is not None:
+            session_plans.pop(plan.id, None)
+            if not session_plans:
+                del self._session_plans[plan.session_id]
+                self._loaded_sessions.pop(plan.session_id, None)
+        for step in plan.steps:
+            self._step_index.pop(step.id, None)
+        if self._active_plan.get(plan.session_id) == plan.id:
+            self._refresh_active(plan.session_id)
+
+    def _refresh_active(self, session_id: str):
+        """Point the session at its earliest-created in-progress plan, if any"""
+        self._active_plan.pop(session_id, None)
+        for plan_id in self._session_plans.get(session_id, ()):
+            if self.plans[plan_id].status == PlanStatus.IN_PROGRESS:
+                self._active_plan[session_id] = plan_id
+                return
+
+    def _find_step(self, plan: TaskPlan, step_id: str) -> int:
+        """Index of a step in its plan, or -1"""
+        location = self._step_index.get(step_id)
+        if location is not None:
+            return location[1] if location[0] == plan.id else -1
+        # Plans outside the working set (finished, read from the DB) aren't indexed
+        for i, step in enumerate(plan.steps):
+            if step.id == step_id:
+                return i
+        return -1
+
+    def _mark_session_loaded(self, session_id: str):
+        self._loaded_sessions[session_id] = None
+        self._loaded_sessions.move_to_end(session_id)
+        while len(self._loaded_sessions) > LOADED_SESSIONS_MAX:
+            self._loaded_sessions.popitem(last=False)
+
+    def _merge_plans(self, rows: List[Dict[str, Any]]) -> List[TaskPlan]:
+        """Plans for DB rows, preferring the working-set copy and tracking active ones"""
+        plans = []
+        for data in rows:
+            plan = self.plans.get(data["id"])
+            if plan is None:
+                plan = TaskPlan.from_dict(data)
+                if plan.is_active:
+                    self._track(plan)
+            plans.append(plan)
+        return plans
+
+    def _ensure_session_loaded(self, session_id: str):
+        """Pull a session's active plans into the working set (once per session)"""
+        if session_id in self._loaded_sessions:
+            self._loaded_sessions.move_to_end(session_id)
+            return
+        self._mark_session_loaded(session_id)
+        try:
+            rows = get_db().get_session_task_plans(
+                session_id, statuses=[PlanStatus.CREATED.value, PlanStatus.IN_PROGRESS.value]
+            )
+        except Exception as e:
+            print(f"DB plan load error: {e}")
+            return
+        self._merge_plans(rows)
+
+    def _save_progress(self, plan: TaskPlan, steps: List[TaskStep], plan_changed: bool):
+        """Write the steps (and plan status) a transition touched, then retire finished plans"""
+        plan_data = None
+        if plan_changed:
+            plan_data = {
+                "id": plan.id,
+                "status": plan.status.value,
+                "started_at": plan.started_at,
+                "completed_at": plan.completed_at
+            }
+        try:
+            get_db().update_task_progress(plan_data, [s.to_dict() for s in steps])
+        except Exception as e:
+            print(f"DB plan save error: {e}")
+
+        if not plan.is_active:
+            self._untrack(plan)
+
     def _init_default_templates(self):
         """Initialize with common IT task templates"""
 
@@ -397,8 +647,33 @@ class TaskPlanner:
             steps=steps
         )
         self.templates[template_id] = template
+        self._matcher = None
         return template
 
+    def _build_matcher(self) -> KeywordMatcher:
+        """
+        Compile every template keyword, keyword word and name word into one automaton
+
+        _template_scores maps each pattern to the (template index, points) it
+        is worth, once per place it appears, mirroring detect_template's rules.
+        """
+        scores: Dict[str, List[Tuple[int, int]]] = {}
+        for index, template in enumerate(self.templates.values()):
+            for keyword in template.keywords:
+                keyword_lower = keyword.lower()
+                scores.setdefault(keyword_lower, []).append((index, 3))
+                for word in keyword_lower.split():
+                    if len(word) > 2:
+                        scores.setdefault(word, []).append((index, 1))
+            for word in template.name.lower().split():
+                if len(word) > 2:
+                    scores.setdefault(word, []).append((index, 2))
+
+        self._template_scores = scores
+        self._template_order = list(self.templates.values())
+        self._matcher = KeywordMatcher(scores)
+        return self._matcher
+
     def get_templates(self, category: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all templates, optionally filtered by category"""
         templates = list(self.templates.values())
@@ -416,30 +691,22 @@ class TaskPlanner:
         Returns:
             Best matching template or None
         """
-        message_lower = message.lower()
-        best_match = None
-        best_score = 0
+        matcher = self._matcher or self._build_matcher()
 
-        for template in self.templates.values():
-            score = 0
+        # One pass over the message finds every keyword, keyword word (1 point
+        # each) and name word (2 points) it contains; whole keywords score 3
+        scores: Dict[int, int] = {}
+        for pattern in matcher.find(message.lower()):
+            for index, points in self._template_scores[pattern]:
+                scores[index] = scores.get(index, 0) + points
 
-            # Check keywords
-            for keyword in template.keywords:
-                if keyword.lower() in message_lower:
-                    score += 3
-                # Check individual words
-                for word in keyword.lower().split():
-                    if len(word) > 2 and word in message_lower:
-                        score += 1
-
-            # Check template name
-            for word in template.name.lower().split():
-                if len(word) > 2 and word in message_lower:
-                    score += 2
-
-            if score > best_score:
-                best_score = score
-                best_match = template
+        # First template (in definition order) with the highest score wins
+        best_match = None
+        best_score = 0
+        if scores:
+            best_index = min(scores, key=lambda i: (-scores[i], i))
+            best_match = self._template_order[best_index]
+            best_score = scores[best_index]
 
         if best_match and best_score >= 3:  # Minimum threshold
             result = best_match.to_dict()
@@ -482,9 +749,16 @@ class TaskPlanner:
                 title=step_data["title"],
                 description=step_data["description"]
             )
-            plan.steps.append(step)
+            plan.add_step(step)
+
+        self._track(plan)
+
+        # Persist to database
+        try:
+            get_db().create_task_plan(plan.to_dict())
+        except Exception as e:
+            print(f"DB plan save error: {e}")
 
-        self.plans[plan_id] = plan
         return plan
 
     def create_from_template(self, session_id: str, template_id: str) -> Optional[TaskPlan]:
@@ -531,21 +805,30 @@ class TaskPlanner:
 
     def get_plan(self, plan_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific plan by ID"""
-        plan = self.plans.get(plan_id)
+        plan = self._load_plan(plan_id)
         return plan.to_dict() if plan else None
 
     def get_plans_for_session(self, session_id: str) -> List[Dict[str, Any]]:
-        """Get all plans for a session"""
-        plans = [p for p in self.plans.values() if p.session_id == session_id]
-        plans.sort(key=lambda p: p.created_at, reverse=True)
-        return [p.to_dict(include_steps=False) for p in plans]
+        """Get all plans for a session (finished ones are read from the database)"""
+        plans = {plan_id: self.plans[plan_id] for plan_id in self._session_plans.get(session_id, ())}
+        try:
+            rows = get_db().get_session_task_plans(session_id)
+        except Exception as e:
+            print(f"DB plan load error: {e}")
+        else:
+            # Every plan was just read, active ones included
+            self._mark_session_loaded(session_id)
+            for plan in self._merge_plans(rows):
+                plans.setdefault(plan.id, plan)
+
+        ordered = sorted(plans.values(), key=lambda p: p.created_at, reverse=True)
+        return [p.to_dict(include_steps=False) for p in ordered]
 
     def get_active_plan(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get the active (in-progress) plan for a session"""
-        for plan in self.plans.values():
-            if plan.session_id == session_id and plan.status == PlanStatus.IN_PROGRESS:
-                return plan.to_dict()
-        return None
+        self._ensure_session_loaded(session_id)
+        plan_id = self._active_plan.get(session_id)
+        return self.plans[plan_id].to_dict() if plan_id else None
 
     def start_plan(self, plan_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -553,20 +836,21 @@ class TaskPlanner:
 
         Returns the plan with first step marked in_progress
         """
-        plan = self.plans.get(plan_id)
+        plan = self._load_plan(plan_id)
         if not plan:
             return None
 
         if plan.status != PlanStatus.CREATED:
             return None  # Can only start a new plan
 
-        plan.status = PlanStatus.IN_PROGRESS
-        plan.started_at = datetime.now().isoformat()
+        plan.set_status(PlanStatus.IN_PROGRESS)
 
         # Mark first step as in_progress
         if plan.steps:
-            plan.steps[0].status = StepStatus.IN_PROGRESS
-            plan.steps[0].started_at = datetime.now().isoformat()
+            plan.update_step(0, StepStatus.IN_PROGRESS)
+
+        self._refresh_active(plan.session_id)
+        self._save_progress(plan, plan.steps[:1], plan_changed=True)
 
         return plan.to_dict()
 
@@ -576,36 +860,27 @@ class TaskPlanner:
 
         Returns dict with 'plan', 'completed_step', 'next_step' keys
         """
-        plan = self.plans.get(plan_id)
+        plan = self._load_plan(plan_id)
         if not plan:
             return None
 
         # Find the step
-        step = None
-        step_index = -1
-        for i, s in enumerate(plan.steps):
-            if s.id == step_id:
-                step = s
-                step_index = i
-                break
-
-        if not step:
+        step_index = self._find_step(plan, step_id)
+        if step_index < 0:
             return None
 
         # Mark step completed
-        step.status = StepStatus.COMPLETED
-        step.completed_at = datetime.now().isoformat()
+        step = plan.update_step(step_index, StepStatus.COMPLETED)
 
         # Find next step
         next_step = None
         if step_index + 1 < len(plan.steps):
-            next_step = plan.steps[step_index + 1]
-            next_step.status = StepStatus.IN_PROGRESS
-            next_step.started_at = datetime.now().isoformat()
+            next_step = plan.update_step(step_index + 1, StepStatus.IN_PROGRESS)
         else:
             # All steps done
-            plan.status = PlanStatus.COMPLETED
-            plan.completed_at = datetime.now().isoformat()
+            plan.set_status(PlanStatus.COMPLETED)
+
+        self._save_progress(plan, [s for s in (step, next_step) if s], plan_changed=next_step is None)
 
         return {
             "plan": plan.to_dict(),
@@ -620,26 +895,21 @@ class TaskPlanner:
 
         Returns dict with 'plan' and 'failed_step' keys
         """
-        plan = self.plans.get(plan_id)
+        plan = self._load_plan(plan_id)
         if not plan:
             return None
 
         # Find the step
-        step = None
-        for s in plan.steps:
-            if s.id == step_id:
-                step = s
-                break
-
-        if not step:
+        step_index = self._find_step(plan, step_id)
+        if step_index < 0:
             return None
 
-        step.status = StepStatus.FAILED
-        step.error_message = error_message
-        step.completed_at = datetime.now().isoformat()
+        step = plan.update_step(step_index, StepStatus.FAILED, error_message)
 
         # Optionally mark plan as failed (or could continue with next step)
-        plan.status = PlanStatus.FAILED
+        plan.set_status(PlanStatus.FAILED)
+
+        self._save_progress(plan, [step], plan_changed=True)
 
         return {
             "plan": plan.to_dict(),
@@ -652,36 +922,27 @@ class TaskPlanner:
 
         Returns dict with 'plan', 'skipped_step', 'next_step' keys
         """
-        plan = self.plans.get(plan_id)
+        plan = self._load_plan(plan_id)
         if not plan:
             return None
 
         # Find the step
-        step = None
-        step_index = -1
-        for i, s in enumerate(plan.steps):
-            if s.id == step_id:
-                step = s
-                step_index = i
-                break
-
-        if not step:
+        step_index = self._find_step(plan, step_id)
+        if step_index < 0:
             return None
 
         # Mark step skipped
-        step.status = StepStatus.SKIPPED
-        step.completed_at = datetime.now().isoformat()
+        step = plan.update_step(step_index, StepStatus.SKIPPED)
 
         # Find next step
         next_step = None
         if step_index + 1 < len(plan.steps):
-            next_step = plan.steps[step_index + 1]
-            next_step.status = StepStatus.IN_PROGRESS
-            next_step.started_at = datetime.now().isoformat()
+            next_step = plan.update_step(step_index + 1, StepStatus.IN_PROGRESS)
         else:
             # All steps done (even if some skipped)
-            plan.status = PlanStatus.COMPLETED
-            plan.completed_at = datetime.now().isoformat()
+            plan.set_status(PlanStatus.COMPLETED)
+
+        self._save_progress(plan, [s for s in (step, next_step) if s], plan_changed=next_step is None)
 
         return {
             "plan": plan.to_dict(),
@@ -711,7 +972,8 @@ class TaskPlanner:
             "plan": {
                 "id": active_plan["id"],
                 "title": active_plan["title"],
-                "description": active_plan["description"]
+                "description": active_plan["description"],
+                "version": self.plans[active_plan["id"]].version
             },
             "current_step": active_plan.get("current_step"),
             "progress": active_plan.get("progress")
@@ -0,0 +1,227 @@
+"""
+Tracing Service - Lightweight per-turn spans with an in-memory ring buffer
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def session_ref(session_id: str) -> str:
+    """
+    Stable, non-reversible label for a session in traces
+
+    Session IDs grant access to the session (WebSocket, history), so
+    traces carry this instead.
+    """
+    return hashlib.blake2b(session_id.encode("utf-8"), digest_size=6).hexdigest()
+
+
+class Span:
+    """A timed operation inside a trace"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self, trace_start_ns: int) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_offset_ms": round((self.start_ns - trace_start_ns) / 1e6, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes
+        }
+
+
+class Trace:
+    """All spans recorded for one turn"""
+
+    __slots__ = ("trace_id", "root", "spans")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, None, attributes)
+        self.spans: List[Span] = [self.root]
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def breakdown(self) -> Dict[str, float]:
+        """Total milliseconds per span name (excluding the root)"""
+        totals: Dict[str, float] = {}
+        for span in self.spans[1:]:
+            totals[span.name] = round(totals.get(span.name, 0.0) + span.duration_ms, 3)
+        return totals
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": self.root.start_ns / 1e9,
+            "duration_ms": round(self.root.duration_ms, 3),
+            "attributes": self.root.attributes,
+            "spans": [s.to_dict(self.root.start_ns) for s in self.spans[1:]]
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP/JSON ExportTraceServiceRequest for this trace"""
+        def attributes(attrs: Dict[str, Any]) -> List[Dict]:
+            result = []
+            for key, value in attrs.items():
+                if isinstance(value, bool):
+                    result.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    result.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    result.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    result.append({"key": key, "value": {"stringValue": str(value)}})
+            return result
+
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 2 if span is self.root else 1,  # SERVER for the turn, INTERNAL below it
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                "attributes": attributes(span.attributes)
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "akai"}}]},
+            "scopeSpans": [{"scope": {"name": "akai.tracing"}, "spans": spans}]
+        }]}
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("akai_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("akai_span", default=None)
+
+
+class OTLPFileExporter:
+    """Appends finished traces as OTLP/JSON lines from a background thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Trace]" = queue.SimpleQueue()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+
+    def export(self, trace: Trace):
+        self._queue.put(trace)
+
+    def _run(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                with open(self.path, "a") as out:
+                    out.write(json.dumps(trace.to_otlp()) + "\n")
+            except Exception as e:
+                print(f"Trace export error: {e}")
+
+
+class Tracer:
+    """Records sampled turn traces into a bounded ring buffer"""
+
+    def __init__(self):
+        self.sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+        self.buffer: deque = deque(maxlen=int(os.getenv("TRACE_BUFFER_SIZE", 200)))
+        export_path = os.getenv("TRACE_EXPORT_FILE")
+        self.exporter = OTLPFileExporter(export_path) if export_path else None
+
+    @contextmanager
+    def trace(self, name: str, enabled: bool = True, **attributes):
+        """
+        Start a trace for one turn
+
+        Yields the Trace, or None when tracing is disabled for this turn or it
+        wasn't sampled. Spans opened while it is active nest under it.
+        """
+        if not enabled or self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            yield None
+            return
+
+        trace = Trace(name, attributes)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(trace.root)
+        try:
+            yield trace
+        finally:
+            trace.root.end_ns = time.time_ns()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self.buffer.append(trace)
+            if self.exporter:
+                self.exporter.export(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time a block as a child of the current span (no-op outside a trace)"""
+        trace = _current_trace.get()
+        if trace is None:
+            yield None
+            return
+
+        parent = _current_span.get()
+        span = Span(name, parent.span_id if parent else None, attributes)
+        trace.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+
+    def current_trace(self) -> Optional[Trace]:
+        return _current_trace.get()
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent traces, newest first"""
+        traces = list(self.buffer)[-limit:]
+        return [t.to_dict() for t in reversed(traces)]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        for trace in reversed(self.buffer):
+            if trace.trace_id == trace_id:
+                return trace.to_dict()
+        return None
+
+
+# Singleton instance
+tracer = Tracer()
@@ -0,0 +1,471 @@
+"""
+Usage - Token and cost accounting per session and tenant, with budgets
+
+Every Claude call adds its usage (input, output and prompt cache tokens,
+images, estimated cost) to the session's lifetime totals and to its
+tenant's totals for the day; transcriptions add audio seconds. Totals are
+kept in memory and written to SQLite in batches every USAGE_FLUSH_INTERVAL
+seconds.
+
+Budgets are in estimated USD. Past a soft budget, turns use the fast model
+and a shorter history; past a hard budget, Claude is not called at all.
+"""
+
+import os
+import hmac
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple, List
+
+from .metrics import metrics
+from .claude_pipeline import PipelineStage, LLMRequest, CallNext, Result
+from .model_router import estimate_cost
+
+USAGE_BUDGET_TURNS = metrics.counter(
+    "akai_usage_budget_turns_total", "Claude turns limited by a budget", ["scope", "level"]
+)
+USAGE_FLUSH_ROWS = metrics.counter(
+    "akai_usage_flush_rows_total", "Usage rows written to SQLite"
+)
+
+USAGE_FIELDS = (
+    "requests", "input_tokens", "output_tokens", "cache_read_tokens",
+    "cache_write_tokens", "images", "audio_seconds", "cost_usd"
+)
+
+OK = "ok"
+SOFT = "soft"
+HARD = "hard"
+
+# Import database (lazy to avoid circular imports)
+_db = None
+def get_db():
+    global _db
+    if _db is None:
+        from .database import db
+        _db = db
+    return _db
+
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _parse_tenant_budgets(spec: str) -> Dict[str, Tuple[float, float]]:
+    """"acme=5:20,globex=0:2" -> {"acme": (5.0, 20.0), "globex": (0.0, 2.0)}"""
+    budgets = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        tenant_id, limits = item.split("=", 1)
+        soft, _, hard = limits.partition(":")
+        try:
+            budgets[tenant_id.strip()] = (float(soft or 0), float(hard or 0))
+        except ValueError:
+            print(f"⚠️ Ignoring invalid tenant budget: {item}")
+    return budgets
+
+
+def _parse_tenant_keys(spec: str) -> Dict[str, str]:
+    """"acme=k1,globex=k2" -> {"acme": "k1", "globex": "k2"}"""
+    keys = {}
+    for item in spec.split(","):
+        tenant_id, _, key = item.partition("=")
+        if tenant_id.strip() and key.strip():
+            keys[tenant_id.strip()] = key.strip()
+    return keys
+
+
+class UsageTotals:
+    """Usage counters for one session or one tenant-day"""
+
+    __slots__ = USAGE_FIELDS
+
+    def __init__(self, row: Optional[Dict[str, Any]] = None):
+        for name in USAGE_FIELDS:
+            setattr(self, name, (row.get(name) or 0) if row else 0)
+
+    def add(self, delta: Dict[str, float]):
+        for name, value in delta.items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in USAGE_FIELDS}
+        data["audio_seconds"] = round(data["audio_seconds"], 1)
+        data["cost_usd"] = round(data["cost_usd"], 6)
+        return data
+
+    def to_row(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in USAGE_FIELDS}
+
+
+class SessionUsage:
+    """A session's tenant and lifetime totals"""
+
+    __slots__ = ("tenant_id", "totals")
+
+    def __init__(self, tenant_id: str, totals: UsageTotals):
+        self.tenant_id = tenant_id
+        self.totals = totals
+
+
+class BudgetExceeded(Exception):
+    """Raised when a session or tenant is over its hard budget"""
+    pass
+
+
+class UsageTracker:
+    """
+    Aggregates usage in memory and writes it to SQLite in batches
+
+    Config (env):
+        USAGE_TRACKING: "true" (default) or "false"
+        USAGE_DEFAULT_TENANT: Tenant for sessions created without a tenant key
+        USAGE_TENANT_KEYS: Issued tenant keys, "tenant=key,..."
+        USAGE_FLUSH_INTERVAL: Seconds between batched writes
+        USAGE_SESSION_SOFT_BUDGET / USAGE_SESSION_HARD_BUDGET: USD per session
+        USAGE_TENANT_SOFT_BUDGET / USAGE_TENANT_HARD_BUDGET: USD per tenant per day
+        USAGE_TENANT_BUDGETS: Per-tenant overrides, "tenant=soft:hard,..."
+        USAGE_SOFT_HISTORY_WINDOW: History turns sent once a soft budget is hit
+        USAGE_AUDIO_BYTES_PER_SECOND: Used to estimate audio length from upload size
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("USAGE_TRACKING", "true").lower() == "true"
+        self.default_tenant = os.getenv("USAGE_DEFAULT_TENANT", "default")
+        self.flush_interval = float(os.getenv("USAGE_FLUSH_INTERVAL", 5))
+        self.session_budget = (
+            float(os.getenv("USAGE_SESSION_SOFT_BUDGET", 0)),
+            float(os.getenv("USAGE_SESSION_HARD_BUDGET", 0))
+        )
+        self.tenant_budget = (
+            float(os.getenv("USAGE_TENANT_SOFT_BUDGET", 0)),
+            float(os.getenv("USAGE_TENANT_HARD_BUDGET", 0))
+        )
+        self.tenant_budgets = _parse_tenant_budgets(os.getenv("USAGE_TENANT_BUDGETS", ""))
+        # Only tenants with an issued key (plus the default) can be billed
+        self.tenant_keys = _parse_tenant_keys(os.getenv("USAGE_TENANT_KEYS", ""))
+        self.soft_history_window = int(os.getenv("USAGE_SOFT_HISTORY_WINDOW", 4))
+        # Browser recordings are Opus at roughly 32 kbit/s
+        self.audio_bytes_per_second = float(os.getenv("USAGE_AUDIO_BYTES_PER_SECOND", 4000))
+        self.max_sessions = 10000
+
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, SessionUsage]" = OrderedDict()
+        self._tenants: Dict[str, Tuple[str, UsageTotals]] = {}  # tenant -> (day, totals)
+        # Deltas not written yet
+        self._pending_sessions: Dict[str, SessionUsage] = {}
+        self._pending_tenants: Dict[Tuple[str, str], UsageTotals] = {}
+        self.flushes = 0
+        self.flush_errors = 0
+
+    # ========================================================================
+    # Totals
+    # ========================================================================
+
+    def resolve_tenant(self, tenant_key: Optional[str]) -> Optional[str]:
+        """
+        Tenant a client's key was issued to
+
+        Returns:
+            The default tenant when no key is given, None for an unknown key
+        """
+        if not tenant_key:
+            return self.default_tenant
+        match = None
+        for tenant_id, key in self.tenant_keys.items():
+            if hmac.compare_digest(tenant_key.encode(), key.encode()):
+                match = tenant_id
+        return match
+
+    def _session(self, session_id: str) -> SessionUsage:
+        """In-memory usage for a session, loaded from the database on first use"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                return entry
+
+        row = None
+        try:
+            row = get_db().get_session_usage(session_id)
+        except Exception as e:
+            print(f"Usage load error: {e}")
+        loaded = SessionUsage(row["tenant_id"] if row else self.default_tenant, UsageTotals(row))
+
+        with self._lock:
+            entry = self._sessions.setdefault(session_id, loaded)
+            self._sessions.move_to_end(session_id)
+        return entry
+
+    def _tenant_today(self, tenant_id: str) -> Tuple[str, UsageTotals]:
+        """A tenant's (day, totals) for today, loaded from the database on first use"""
+        day = _today()
+        with self._lock:
+            entry = self._tenants.get(tenant_id)
+            if entry is not None and entry[0] == day:
+                return entry
+
+        rows = []
+        try:
+            rows = get_db().get_tenant_usage(tenant_id, day)
+        except Exception as e:
+            print(f"Usage load error: {e}")
+        loaded = (day, UsageTotals(rows[0] if rows else None))
+
+        with self._lock:
+            entry = self._tenants.get(tenant_id)
+            if entry is None or entry[0] != day:
+                entry = self._tenants[tenant_id] = loaded
+        return entry
+
+    def assign(self, session_id: str, tenant_id: str):
+        """Bill a new session to a tenant (from resolve_tenant)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._sessions[session_id] = SessionUsage(tenant_id, UsageTotals())
+            self._pending_sessions[session_id] = SessionUsage(tenant_id, UsageTotals())
+
+    def record(self, session_id: Optional[str], delta: Dict[str, float]):
+        """Add usage to a session and its tenant's day"""
+        if not self.enabled:
+            return
+        entry = self._session(session_id) if session_id else None
+        tenant_id = entry.tenant_id if entry else self.default_tenant
+        day, tenant_totals = self._tenant_today(tenant_id)
+
+        with self._lock:
+            if entry:
+                entry.totals.add(delta)
+                pending = self._pending_sessions.get(session_id)
+                if pending is None:
+                    pending = self._pending_sessions[session_id] = SessionUsage(tenant_id, UsageTotals())
+                pending.totals.add(delta)
+            tenant_totals.add(delta)
+            pending_tenant = self._pending_tenants.get((tenant_id, day))
+            if pending_tenant is None:
+                pending_tenant = self._pending_tenants[(tenant_id, day)] = UsageTotals()
+            pending_tenant.add(delta)
+
+    def record_response(self, session_id: Optional[str], model: str, usage: Any, images: int = 0):
+        """Add one Messages API response's usage"""
+        self.record(session_id, {
+            "requests": 1,
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cache_read_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+            "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+            "images": images,
+            "cost_usd": estimate_cost(model, usage)
+        })
+
+    def record_audio(self, session_id: Optional[str], audio_bytes: int):
+        """Add transcribed audio, its length estimated from the upload size"""
+        if self.audio_bytes_per_second > 0:
+            self.record(session_id, {"audio_seconds": audio_bytes / self.audio_bytes_per_second})
+
+    # ========================================================================
+    # Budgets
+    # ========================================================================
+
+    def _limits(self, tenant_id: str) -> Dict[str, Tuple[float, float]]:
+        return {
+            "session": self.session_budget,
+            "tenant": self.tenant_budgets.get(tenant_id, self.tenant_budget)
+        }
+
+    def check(self, session_id: Optional[str]) -> Tuple[str, Optional[str]]:
+        """
+        Budget state for a session's next turn
+
+        Returns:
+            (level, scope): level is "ok", "soft" or "hard"; scope is
+            "session" or "tenant" for the budget that was hit, else None
+        """
+        if not self.enabled:
+            return OK, None
+        entry = self._session(session_id) if session_id else None
+        tenant_id = entry.tenant_id if entry else self.default_tenant
+        limits = self._limits(tenant_id)
+        if not any(limits["session"]) and not any(limits["tenant"]):
+            return OK, None
+
+        spent = {
+            "session": entry.totals.cost_usd if entry else 0.0,
+            "tenant": self._tenant_today(tenant_id)[1].cost_usd
+        }
+        for index, level in ((1, HARD), (0, SOFT)):
+            for scope in ("session", "tenant"):
+                limit = limits[scope][index]
+                if limit and spent[scope] >= limit:
+                    return level, scope
+        return OK, None
+
+    # ========================================================================
+    # Persistence
+    # ========================================================================
+
+    def flush(self) -> int:
+        """Write pending deltas to SQLite in one transaction; returns rows written"""
+        with self._lock:
+            sessions, self._pending_sessions = self._pending_sessions, {}
+            tenants, self._pending_tenants = self._pending_tenants, {}
+        if not sessions and not tenants:
+            return 0
+
+        try:
+            get_db().add_usage(
+                [
+                    {"session_id": session_id, "tenant_id": entry.tenant_id, **entry.totals.to_row()}
+                    for session_id, entry in sessions.items()
+                ],
+                [
+                    {"tenant_id": tenant_id, "day": day, **totals.to_row()}
+                    for (tenant_id, day), totals in tenants.items()
+                ]
+            )
+        except Exception as e:
+            # Keep the deltas for the next flush
+            print(f"⚠️ Usage flush error: {e}")
+            with self._lock:
+                self.flush_errors += 1
+                for session_id, entry in sessions.items():
+                    pending = self._pending_sessions.setdefault(session_id, SessionUsage(entry.tenant_id, UsageTotals()))
+                    pending.totals.add(entry.totals.to_row())
+                for key, totals in tenants.items():
+                    self._pending_tenants.setdefault(key, UsageTotals()).add(totals.to_row())
+            return 0
+
+        with self._lock:
+            self.flushes += 1
+            # Written sessions reload from the database on demand
+            excess = len(self._sessions) - self.max_sessions
+            for session_id in list(self._sessions)[:max(excess, 0)]:
+                if session_id not in self._pending_sessions:
+                    del self._sessions[session_id]
+        rows = len(sessions) + len(tenants)
+        USAGE_FLUSH_ROWS.inc(rows)
+        return rows
+
+    async def run(self):
+        """Background task: flush usage every flush_interval seconds"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    # ========================================================================
+    # Reporting
+    # ========================================================================
+
+    def get_session_usage(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """A session's totals and budget state, or None if it has no usage"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        if entry is None:
+            row = get_db().get_session_usage(session_id)
+            if not row:
+                return None
+            entry = SessionUsage(row["tenant_id"], UsageTotals(row))
+
+        level, scope = self.check(session_id)
+        soft, hard = self.session_budget
+        return {
+            "session_id": session_id,
+            "tenant_id": entry.tenant_id,
+            **entry.totals.to_dict(),
+            "budget": {"state": level, "scope": scope, "soft_usd": soft, "hard_usd": hard}
+        }
+
+    def get_tenant_usage(self, tenant_id: str, days: int = 30, top_sessions: int = 20) -> Dict[str, Any]:
+        """A tenant's daily usage and most expensive sessions (flushes first)"""
+        self.flush()
+        since = (datetime.now() - timedelta(days=max(days, 1) - 1)).strftime("%Y-%m-%d")
+        db = get_db()
+        daily = [
+            {"day": row["day"], **UsageTotals(row).to_dict()}
+            for row in db.get_tenant_usage(tenant_id, since)
+        ]
+        sessions = [
+            {"session_id": row["session_id"], **UsageTotals(row).to_dict()}
+            for row in db.get_sessions_usage(tenant_id, top_sessions)
+        ]
+        soft, hard = self._limits(tenant_id)["tenant"]
+        return {
+            "tenant_id": tenant_id,
+            "daily": daily,
+            "top_sessions": sessions,
+            "budget": {"soft_usd_per_day": soft, "hard_usd_per_day": hard}
+        }
+
+    def list_tenants(self, days: int = 1) -> List[Dict[str, Any]]:
+        """Usage per tenant over the last days (flushes first)"""
+        self.flush()
+        since = (datetime.now() - timedelta(days=max(days, 1) - 1)).strftime("%Y-%m-%d")
+        return [
+            {"tenant_id": row["tenant_id"], **UsageTotals(row).to_dict()}
+            for row in get_db().get_tenants_usage(since)
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sessions": len(self._sessions),
+                "pending_rows": len(self._pending_sessions) + len(self._pending_tenants),
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "session_budget_usd": {"soft": self.session_budget[0], "hard": self.session_budget[1]},
+                "tenant_budget_usd_per_day": {"soft": self.tenant_budget[0], "hard": self.tenant_budget[1]}
+            }
+
+
+class BudgetStage(PipelineStage):
+    """
+    Enforces budgets before anything is built (first stage)
+
+    Soft: fast model, shorter history. Hard: raises BudgetExceeded.
+    """
+
+    name = "budget"
+
+    def __init__(self, tracker: UsageTracker):
+        self.tracker = tracker
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        level, scope = self.tracker.check(request.session_id)
+        if level != OK:
+            USAGE_BUDGET_TURNS.labels(scope, level).inc()
+        if level == HARD:
+            raise BudgetExceeded(f"{scope.capitalize()} hard budget reached")
+        if level == SOFT:
+            request.downgrade = True
+            request.history_window = self.tracker.soft_history_window
+
+        result = await call_next(request)
+        if level != OK:
+            result["budget"] = level
+        return result
+
+
+class UsageStage(PipelineStage):
+    """Records the usage of every API call (escalations included, cache hits excluded)"""
+
+    name = "usage"
+
+    def __init__(self, tracker: UsageTracker):
+        self.tracker = tracker
+
+    async def process(self, request: LLMRequest, call_next: CallNext) -> Result:
+        result = await call_next(request)
+        response = request.api_response
+        if response is not None:
+            self.tracker.record_response(
+                request.session_id, request.model, response.usage, int(request.has_image)
+            )
+        return result
+
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,105 @@
+"""
+JSON cost per conversation turn: stdlib vs orjson
+
+Replays the encode/decode work of one chat turn and one screen-share turn
+on sessions of realistic size and reports CPU microseconds per turn:
+
+    python bench/bench_json.py --messages 50 --frame-kb 300
+
+"before" is the previous path (FastAPI's jsonable_encoder plus stdlib json
+for REST, Starlette's send_json/receive_json for WebSocket frames).
+"""
+
+import os
+import sys
+import time
+import json
+import base64
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from app.services import serializer  # noqa: E402
+from app.services.session_records import MessageRecord, SessionRecord  # noqa: E402
+
+WORDS = (
+    "printer offline wifi password restart driver update monitor cable settings "
+    "network sound outlook queue screen click open close try again ünïcode"
+).split()
+
+
+def make_session(messages: int, rng: random.Random) -> SessionRecord:
+    session = SessionRecord("session-1", "1234")
+    for i in range(messages):
+        session.messages.append(MessageRecord(
+            "user" if i % 2 == 0 else "assistant",
+            " ".join(rng.choices(WORDS, k=rng.randint(10, 120)))
+        ))
+    return session
+
+
+def stdlib_send(message) -> str:
+    """What Starlette's send_json did"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def turn_before(session, chat_frame, screen_frame, reply, stored):
+    json.loads(chat_frame)                                   # receive_json
+    json.loads(screen_frame)
+    [json.loads(value) for value in stored]                  # DB window read
+    json.dumps(reply["message"])                             # DB append
+    stdlib_send(reply)                                       # ai_response
+    stdlib_send({"type": "status", "status": "thinking"})
+    body = jsonable_encoder(session.to_dict())               # GET /api/session
+    json.dumps(body, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def turn_after(session, chat_frame, screen_frame, reply, stored):
+    serializer.loads(chat_frame)
+    serializer.loads(screen_frame)
+    [serializer.loads(value) for value in stored]
+    serializer.dumps_str(reply["message"])
+    serializer.dumps_str(reply)
+    serializer.dumps_str({"type": "status", "status": "thinking"})
+    serializer.FastJSONResponse(session.to_dict())
+
+
+def measure(function, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        function()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON cost per turn")
+    parser.add_argument("--messages", type=int, default=50, help="Messages in the session window")
+    parser.add_argument("--frame-kb", type=int, default=300, help="Screen-share frame size (base64)")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    session = make_session(args.messages, rng)
+    frame = base64.b64encode(os.urandom(args.frame_kb * 768)).decode()
+    chat_frame = json.dumps({"type": "chat", "message": "my printer says offline again"})
+    screen_frame = json.dumps({"type": "screen_share", "frame": frame, "message": "what is this error?"})
+    reply = {"type": "ai_response", "message": session.messages[-1].to_dict(), "had_kb_context": True}
+    stored = [json.dumps(m.to_dict()) for m in session.messages]
+
+    print(f"{args.messages} messages in window, {args.frame_kb} KB screen frame")
+    before = measure(lambda: turn_before(session, chat_frame, screen_frame, reply, stored), args.iterations)
+    print(f"{'before (stdlib + jsonable_encoder)':<38}{before:>10.0f} µs/turn")
+
+    backends = ["stdlib"] + (["orjson"] if serializer.orjson is not None else [])
+    for backend in backends:
+        serializer.use_backend(backend)
+        after = measure(lambda: turn_after(session, chat_frame, screen_frame, reply, stored), args.iterations)
+        print(f"{'after (' + backend + ')':<38}{after:>10.0f} µs/turn  ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Semantic KB retrieval at scale: exact scan vs IVF
+
+Builds a synthetic KB, encodes it with the hashed TF-IDF encoder and
+reports build time, single-query and batched latency, and IVF recall
+against the exact results:
+
+    python bench/bench_kb_vectors.py --articles 100000 --dim 256
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.kb_vectors import (  # noqa: E402
+    HashedTfidfEncoder, SemanticIndex, semantic_available
+)
+
+TOPICS = (
+    "printer wifi network email outlook password vpn monitor keyboard mouse audio "
+    "webcam browser disk update driver battery bluetooth teams excel onedrive"
+).split()
+WORDS = (
+    "offline slow broken missing error crash freeze connect disconnect sync login "
+    "reset install restart screen sound display signal access denied full blank "
+    "flicker noise lag timeout certificate license account storage queue"
+).split()
+
+
+def make_articles(count: int, rng: random.Random) -> list:
+    articles = []
+    for i in range(count):
+        topic = rng.choice(TOPICS)
+        words = rng.choices(WORDS, k=rng.randint(6, 20)) + [f"kb{rng.randint(0, count // 10)}"]
+        articles.append(f"{topic} {' '.join(words)} {topic}")
+    return articles
+
+
+def percentile(values: list, pct: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KB vector search benchmark")
+    parser.add_argument("--articles", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    if not semantic_available():
+        raise SystemExit("numpy is required for this benchmark")
+
+    rng = random.Random(args.seed)
+    articles = make_articles(args.articles, rng)
+    queries = [" ".join(rng.choices(TOPICS + WORDS, k=rng.randint(2, 6))) for _ in range(args.queries)]
+    print(f"{args.articles} articles, dim {args.dim}, {args.queries} queries, k={args.k}")
+    print(f"{'index':<18}{'build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'batch ms/q':>12}{'recall':>8}")
+
+    exact = None
+    for name in ("flat", "ivf"):
+        start = time.perf_counter()
+        index = SemanticIndex(articles, encoder=HashedTfidfEncoder(args.dim), index=name, nprobe=args.nprobe)
+        build = time.perf_counter() - start
+
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results.append({row for row, _ in index.search(query, args.k)})
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        for offset in range(0, len(queries), args.batch):
+            index.search_batch(queries[offset:offset + args.batch], args.k)
+        batched = (time.perf_counter() - start) * 1000 / len(queries)
+
+        if exact is None:
+            exact = results
+        recall = statistics.mean(len(r & e) / max(1, len(e)) for r, e in zip(results, exact))
+        label = index.get_stats()["index"]
+        print(f"{label:<18}{build:>9.2f}{statistics.median(latencies):>9.2f}"
+              f"{percentile(latencies, 95):>9.2f}{batched:>12.3f}{recall:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
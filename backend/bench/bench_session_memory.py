@@ -0,0 +1,115 @@
+"""
+Memory cost of session message history: plain dicts vs slotted records
+
+Builds the same conversation both ways and reports bytes per message
+measured with tracemalloc, plus the time to build and serialize it:
+
+    python bench/bench_session_memory.py --sessions 200 --messages 50
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.session_records import MessageRecord, SessionRecord  # noqa: E402
+
+WORDS = (
+    "printer offline wifi password restart driver update monitor cable "
+    "settings network sound outlook queue screen click open close try again"
+).split()
+
+
+def make_contents(count: int, rng: random.Random) -> List[str]:
+    return [" ".join(rng.choices(WORDS, k=rng.randint(5, 40))) for _ in range(count)]
+
+
+def build_dicts(contents: List[str], sessions: int, per_session: int) -> list:
+    """The previous representation: a dict per session and per message"""
+    result = []
+    for s in range(sessions):
+        messages = []
+        for i in range(per_session):
+            messages.append({
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": contents[(s * per_session + i) % len(contents)],
+                "timestamp": datetime.now().isoformat()
+            })
+        result.append({
+            "id": f"session-{s}",
+            "code": f"{s:04d}",
+            "created_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat(),
+            "status": "active",
+            "messages": messages,
+            "screenshots": [],
+            "metadata": {}
+        })
+    return result
+
+
+def build_records(contents: List[str], sessions: int, per_session: int) -> list:
+    result = []
+    for s in range(sessions):
+        session = SessionRecord(f"session-{s}", f"{s:04d}")
+        for i in range(per_session):
+            session.messages.append(MessageRecord(
+                "user" if i % 2 == 0 else "assistant",
+                contents[(s * per_session + i) % len(contents)]
+            ))
+        result.append(session)
+    return result
+
+
+def measure(build: Callable[[], list]):
+    """Bytes allocated by build() and kept alive, excluding shared content strings"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    data = build()
+    elapsed = time.perf_counter() - start
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return data, allocated, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session history memory benchmark")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=50, help="Messages per session")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    total = args.sessions * args.messages
+    contents = make_contents(1000, random.Random(args.seed))
+
+    print(f"{args.sessions} sessions x {args.messages} messages = {total} messages")
+    print(f"{'layout':<10}{'bytes/msg':>12}{'total MB':>12}{'build ms':>12}{'to_dict ms':>12}")
+
+    for name, build in (("dict", build_dicts), ("record", build_records)):
+        data, allocated, elapsed = measure(lambda: build(contents, args.sessions, args.messages))
+
+        # Records pay for ISO formatting only when serialized at the boundary
+        serialize = "-"
+        if name == "record":
+            start = time.perf_counter()
+            for session in data:
+                session.to_dict()
+            serialize = f"{(time.perf_counter() - start) * 1000:.1f}"
+
+        print(f"{name:<10}{allocated / total:>12.1f}{allocated / 1024 / 1024:>12.2f}"
+              f"{elapsed * 1000:>12.1f}{serialize:>12}")
+        del data
+
+
+if __name__ == "__main__":
+    main()
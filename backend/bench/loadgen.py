@@ -0,0 +1,240 @@
+"""
+End-to-end load generator for Akai
+
+Drives N simulated clients through /api/session/create and then chat,
+screen_share and voice turns over /ws/{session_id}, and reports p50/p95/p99
+latency, throughput and server memory. Run it against a server that talks to
+bench/stub_server.py so no API credits are spent:
+
+    python bench/loadgen.py --clients 50 --turns 20 --server-pid $(pgrep -f run.py)
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import asyncio
+import argparse
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+
+CHAT_MESSAGES = [
+    "my printer says offline",
+    "wifi keeps disconnecting every few minutes",
+    "I forgot my windows password",
+    "computer is really slow today",
+    "no sound from my speakers",
+    "how do I connect a second monitor",
+    "outlook won't open",
+    "thanks!",
+    "can you check this layout for me",
+    "print jobs are stuck in the queue",
+]
+
+# Message type that ends each flow
+TERMINAL_EVENT = {
+    "chat": "ai_response",
+    "screen_share": "ai_response",
+    "voice": "transcript",
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def read_rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Resident set size of a local process, from /proc"""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class Results:
+    """Latency samples and error counts per flow"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.rss_samples: List[float] = []
+
+    def record(self, flow: str, seconds: float):
+        self.latencies.setdefault(flow, []).append(seconds)
+
+    def error(self, flow: str):
+        self.errors[flow] = self.errors.get(flow, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict:
+        flows = {}
+        for flow in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(flow, []))
+            flows[flow] = {
+                "count": len(values),
+                "errors": self.errors.get(flow, 0),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+            }
+        turns = sum(f["count"] for name, f in flows.items() if name != "session_create")
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "turns": turns,
+            "throughput_turns_per_s": round(turns / elapsed, 2) if elapsed > 0 else 0.0,
+            "server_rss_mb": {
+                "start": round(self.rss_samples[0], 1) if self.rss_samples else None,
+                "peak": round(max(self.rss_samples), 1) if self.rss_samples else None,
+                "end": round(self.rss_samples[-1], 1) if self.rss_samples else None,
+            },
+            "flows": flows,
+        }
+
+
+def build_turn(flow: str, rng: random.Random, args: argparse.Namespace) -> Dict:
+    message = rng.choice(CHAT_MESSAGES)
+    if flow == "chat":
+        return {"type": "chat", "message": message}
+    if flow == "screen_share":
+        frame = base64.b64encode(rng.randbytes(args.frame_kb * 1024)).decode()
+        return {"type": "screen_share", "frame": frame, "message": message}
+    audio = base64.b64encode(rng.randbytes(args.audio_kb * 1024)).decode()
+    return {"type": "voice", "audio": audio}
+
+
+async def run_client(client_id: int, args: argparse.Namespace, mix: Dict[str, float],
+                     results: Results, http: httpx.AsyncClient):
+    rng = random.Random(f"{args.seed}:{client_id}")
+    flows, weights = zip(*mix.items())
+
+    start = time.perf_counter()
+    try:
+        response = await http.post("/api/session/create")
+        response.raise_for_status()
+        session_id = response.json()["session_id"]
+    except Exception as e:
+        print(f"client {client_id}: session create failed: {e}", file=sys.stderr)
+        results.error("session_create")
+        return
+    results.record("session_create", time.perf_counter() - start)
+
+    ws_url = args.base_url.replace("http", "ws", 1) + f"/ws/{session_id}"
+    ws = None
+    for _ in range(args.turns):
+        # Errors count against the turn; the client reconnects and keeps going
+        if ws is None:
+            try:
+                ws = await websockets.connect(ws_url, max_size=None)
+            except Exception as e:
+                print(f"client {client_id}: websocket connect failed: {e}", file=sys.stderr)
+                results.error("connect")
+                await asyncio.sleep(1.0)
+                continue
+
+        flow = rng.choices(flows, weights)[0]
+        payload = build_turn(flow, rng, args)
+        start = time.perf_counter()
+        try:
+            await ws.send(json.dumps(payload))
+            while True:
+                event = json.loads(await asyncio.wait_for(ws.recv(), args.timeout))
+                if event.get("type") == TERMINAL_EVENT[flow]:
+                    break
+            results.record(flow, time.perf_counter() - start)
+        except Exception:
+            results.error(flow)
+            # Drop the connection so a late reply can't end the next turn
+            await ws.close()
+            ws = None
+        if args.think_ms:
+            await asyncio.sleep(rng.expovariate(1000 / args.think_ms))
+
+    if ws is not None:
+        await ws.close()
+
+
+async def sample_memory(pid: Optional[int], results: Results, stop: asyncio.Event):
+    while not stop.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            results.rss_samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(args: argparse.Namespace):
+    mix = {}
+    for part in args.mix.split(","):
+        name, weight = part.split("=")
+        if name not in TERMINAL_EVENT:
+            raise SystemExit(f"Unknown flow '{name}' (choose from {list(TERMINAL_EVENT)})")
+        mix[name] = float(weight)
+
+    results = Results()
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_memory(args.server_pid, results, stop))
+
+    start = time.perf_counter()
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as http:
+        await asyncio.gather(*(
+            run_client(i, args, mix, results, http) for i in range(args.clients)
+        ))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await sampler
+    summary = results.summary(elapsed)
+
+    print()
+    print(f"{'flow':<16}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for flow, stats in summary["flows"].items():
+        print(f"{flow:<16}{stats['count']:>7}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print()
+    print(f"throughput: {summary['throughput_turns_per_s']} turns/s over {summary['elapsed_s']}s")
+    if results.rss_samples:
+        rss = summary["server_rss_mb"]
+        print(f"server RSS: start {rss['start']} MB, peak {rss['peak']} MB, end {rss['end']} MB")
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(summary, out, indent=2)
+        print(f"wrote {args.json}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Akai end-to-end load generator")
+    parser.add_argument("--base-url", default=os.getenv("AKAI_URL", "http://localhost:8000"))
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=10, help="Turns per client")
+    parser.add_argument("--mix", default="chat=0.7,screen_share=0.2,voice=0.1")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between turns")
+    parser.add_argument("--frame-kb", type=int, default=60)
+    parser.add_argument("--audio-kb", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--server-pid", type=int, help="Sample this process's RSS")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", help="Write the summary to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
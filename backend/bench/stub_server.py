@@ -0,0 +1,286 @@
+"""
+Deterministic local stub for the Anthropic Messages and Message Batches APIs and
+OpenAI audio endpoints
+
+Point Akai at it instead of the real APIs:
+
+    python bench/stub_server.py --port 8100 --latency-ms 400 --error-rate 0.02
+    ANTHROPIC_BASE_URL=http://localhost:8100 \\
+    OPENAI_BASE_URL=http://localhost:8100/v1 \\
+    ANTHROPIC_API_KEY=stub OPENAI_API_KEY=stub python run.py
+
+Responses, latencies and injected errors are derived from a seeded RNG and a
+per-request counter, so two runs with the same seed and request order behave
+identically.
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import hashlib
+import itertools
+from typing import Dict, Any, List
+
+import uvicorn
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+
+class StubConfig:
+    """Latency and error distribution for the stub"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.latency_ms = args.latency_ms              # Median time to first token
+        self.jitter = args.jitter                      # Lognormal sigma applied to latency
+        self.token_latency_ms = args.token_latency_ms  # Per output token
+        self.output_tokens = args.output_tokens        # Mean output tokens per reply
+        self.error_rate = args.error_rate              # Fraction of requests that fail
+        self.batch_latency_ms = args.batch_latency_ms  # Time until a batch ends
+        self.stt_latency_ms = args.stt_latency_ms
+        self.tts_latency_ms = args.tts_latency_ms
+        self.seed = args.seed
+        self._counter = itertools.count()
+
+    def rng(self) -> random.Random:
+        """Per-request RNG: deterministic for a given seed and request order"""
+        return random.Random(f"{self.seed}:{next(self._counter)}")
+
+    def latency(self, rng: random.Random, median_ms: float) -> float:
+        return median_ms * rng.lognormvariate(0, self.jitter) / 1000
+
+
+ERRORS = [
+    (529, "overloaded_error", "Overloaded"),
+    (429, "rate_limit_error", "Number of requests has exceeded your rate limit"),
+    (500, "api_error", "Internal server error"),
+]
+
+WORDS = (
+    "sure let's check the settings first then restart the app and try again "
+    "click the network icon pick your network you should be back online in a sec "
+    "the button needs more contrast try a darker blue open device manager"
+).split()
+
+
+def _estimate_tokens(payload: Any) -> int:
+    return max(1, len(json.dumps(payload)) // 4)
+
+
+def _reply_text(messages: List[Dict], rng: random.Random, mean_tokens: int) -> str:
+    """Deterministic reply seeded by the last user message"""
+    last = json.dumps(messages[-1] if messages else {}, sort_keys=True)
+    digest = int(hashlib.sha256(last.encode()).hexdigest()[:8], 16)
+    local = random.Random(digest ^ rng.getrandbits(16))
+    count = max(4, int(local.gauss(mean_tokens, mean_tokens / 4)))
+    return " ".join(local.choice(WORDS) for _ in range(count))
+
+
+def _message(body: Dict, rng: random.Random, config: StubConfig) -> Dict:
+    """Non-streaming Messages API response for a request body"""
+    text = _reply_text(body.get("messages", []), rng, config.output_tokens)
+    return {
+        "id": f"msg_stub_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "stub-model"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": _estimate_tokens({"system": body.get("system"), "messages": body.get("messages")}),
+            "output_tokens": len(text.split(" "))
+        }
+    }
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="Akai API stub")
+    batches: Dict[str, Dict[str, Any]] = {}
+
+    def error_response(rng: random.Random):
+        status, error_type, message = rng.choice(ERRORS)
+        return JSONResponse(
+            status_code=status,
+            content={"type": "error", "error": {"type": error_type, "message": message}}
+        )
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        rng = config.rng()
+
+        await asyncio.sleep(config.latency(rng, config.latency_ms))
+        if rng.random() < config.error_rate:
+            return error_response(rng)
+
+        message = _message(body, rng, config)
+        model = message["model"]
+        text = message["content"][0]["text"]
+        words = text.split(" ")
+        input_tokens = message["usage"]["input_tokens"]
+        output_tokens = message["usage"]["output_tokens"]
+        message_id = message["id"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(output_tokens * config.token_latency_ms / 1000)
+            return message
+
+        async def events():
+            def sse(event: str, data: Dict) -> str:
+                return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+            yield sse("message_start", {"type": "message_start", "message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model,
+                "content": [], "stop_reason": None, "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": 1}
+            }})
+            yield sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                              "content_block": {"type": "text", "text": ""}})
+            yield sse("ping", {"type": "ping"})
+            for i, word in enumerate(words):
+                await asyncio.sleep(config.token_latency_ms / 1000)
+                delta = word if i == 0 else " " + word
+                yield sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                  "delta": {"type": "text_delta", "text": delta}})
+            yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield sse("message_delta", {"type": "message_delta",
+                                        "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                        "usage": {"output_tokens": output_tokens}})
+            yield sse("message_stop", {"type": "message_stop"})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    def batch_object(batch: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+        ended = time.time() >= batch["ends_at"]
+        counts = {"processing": 0, "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        if ended:
+            for line in batch["results"]:
+                counts[line["result"]["type"]] += 1
+        else:
+            counts["processing"] = len(batch["results"])
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": counts,
+            "created_at": batch["created_at"],
+            "ended_at": batch["ended_at"] if ended else None,
+            "expires_at": batch["expires_at"],
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"{base_url}v1/messages/batches/{batch['id']}/results" if ended else None
+        }
+
+    @app.post("/v1/messages/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        rng = config.rng()
+        if rng.random() < config.error_rate:
+            return error_response(rng)
+
+        # Results are fixed at creation and revealed once the batch "ends"
+        results = []
+        for item in body.get("requests", []):
+            item_rng = config.rng()
+            if item_rng.random() < config.error_rate:
+                _, error_type, message = item_rng.choice(ERRORS)
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": error_type, "message": message}}}
+            else:
+                result = {"type": "succeeded", "message": _message(item["params"], item_rng, config)}
+            results.append({"custom_id": item["custom_id"], "result": result})
+
+        now = time.time()
+        batch_id = f"msgbatch_stub_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}"
+        batches[batch_id] = {
+            "id": batch_id,
+            "results": results,
+            "ends_at": now + config.batch_latency_ms / 1000,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+            "ended_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + config.batch_latency_ms / 1000)),
+            "expires_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + 86400))
+        }
+        return batch_object(batches[batch_id], str(request.base_url))
+
+    @app.get("/v1/messages/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str, request: Request):
+        if batch_id not in batches:
+            return JSONResponse(status_code=404, content={
+                "type": "error", "error": {"type": "not_found_error", "message": "Batch not found"}
+            })
+        return batch_object(batches[batch_id], str(request.base_url))
+
+    @app.get("/v1/messages/batches/{batch_id}/results")
+    async def batch_results(batch_id: str):
+        batch = batches.get(batch_id)
+        if batch is None or time.time() < batch["ends_at"]:
+            return JSONResponse(status_code=404, content={
+                "type": "error", "error": {"type": "not_found_error", "message": "Results not available"}
+            })
+        return PlainTextResponse(
+            "".join(json.dumps(line) + "\n" for line in batch["results"]),
+            media_type="application/binary"
+        )
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(
+        file: UploadFile = File(...),
+        model: str = Form("whisper-1"),
+        response_format: str = Form("json")
+    ):
+        audio = await file.read()
+        rng = config.rng()
+        await asyncio.sleep(config.latency(rng, config.stt_latency_ms))
+        if rng.random() < config.error_rate:
+            return error_response(rng)
+
+        digest = int(hashlib.sha256(audio).hexdigest()[:8], 16)
+        local = random.Random(digest)
+        text = " ".join(local.choice(WORDS) for _ in range(local.randint(4, 12)))
+        if response_format == "text":
+            return PlainTextResponse(text + "\n")
+        return {"text": text}
+
+    @app.post("/v1/audio/speech")
+    async def speech(request: Request):
+        body = await request.json()
+        rng = config.rng()
+        await asyncio.sleep(config.latency(rng, config.tts_latency_ms))
+        if rng.random() < config.error_rate:
+            return error_response(rng)
+
+        # Roughly 1 KB of "audio" per 16 characters, like a 64 kbps MP3
+        size = max(1024, len(body.get("input", "")) * 64)
+        return Response(content=b"\xff\xfb" + bytes(size - 2), media_type="audio/mpeg")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "stub": True, "seed": config.seed}
+
+    return app
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local Anthropic/OpenAI API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("STUB_PORT", 8100)))
+    parser.add_argument("--latency-ms", type=float, default=400)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--token-latency-ms", type=float, default=0)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--batch-latency-ms", type=float, default=2000)
+    parser.add_argument("--stt-latency-ms", type=float, default=300)
+    parser.add_argument("--tts-latency-ms", type=float, default=250)
+    parser.add_argument("--seed", type=int, default=1234)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"🧪 API stub on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms}ms, errors {args.error_rate:.0%}, seed {args.seed})")
+    uvicorn.run(create_app(StubConfig(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,21 @@
+"""
+Shared test setup
+
+Runs before any app module is imported: puts backend/ on the path, points
+the Anthropic client at an address nothing listens on, and moves into a
+scratch directory so the SQLite database under data/ stays out of the tree.
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.update({
+    "ANTHROPIC_API_KEY": "test",
+    "ANTHROPIC_BASE_URL": "http://127.0.0.1:9",
+    "BATCH_JOBS": "false",
+})
+os.chdir(tempfile.mkdtemp(prefix="akai-tests-"))
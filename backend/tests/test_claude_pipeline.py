@@ -0,0 +1,359 @@
+"""
+Tests for ClaudeService and its request pipeline
+
+The Messages API call on the transport stage is replaced with a recorder,
+so each test checks exactly what would have been sent to Claude.
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.claude_service import ClaudeService
+from app.services.claude_pipeline import DEFAULT_SCREEN_PROMPT
+from app.services.knowledge_base import KBContext, KBState, Problem, Solution
+from app.services.model_router import FAST, FULL, VISION
+from app.services.usage import UsageTracker
+
+IMAGE = "aW1hZ2U="
+HISTORY = [
+    {"role": "user", "content": "My wifi keeps dropping", "timestamp": "2024-01-01T10:00:00"},
+    {"role": "assistant", "content": "Which network are you on?", "timestamp": "2024-01-01T10:00:05"},
+]
+SENT_HISTORY = [{"role": m["role"], "content": m["content"]} for m in HISTORY]
+LONG_MESSAGE = "My laptop will not join the office network after the update " * 6
+
+# Pipeline settings each test starts from (routing and response cache off)
+BASE_ENV = {
+    "PROMPT_CACHE": "true",
+    "LLM_ROUTING": "off",
+    "LLM_HISTORY_WINDOW": "10",
+    "LLM_RESPONSE_CACHE_SIZE": "0",
+    "LLM_MAX_CONCURRENCY": "16",
+    "LLM_ADMISSION_TIMEOUT": "30",
+    "USAGE_TRACKING": "false",
+}
+
+
+class FakeAPI:
+    """Stands in for ClaudeService._create_message and records every call"""
+
+    def __init__(self, replies=None):
+        self.calls = []
+        self.replies = list(replies or [])
+
+    def __call__(self, method, **kwargs):
+        self.calls.append({"method": method, **kwargs})
+        text = self.replies.pop(0) if self.replies else "Click the network icon bottom right."
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=text)],
+            stop_reason="end_turn",
+            usage=SimpleNamespace(
+                input_tokens=1000, output_tokens=100,
+                cache_read_input_tokens=0, cache_creation_input_tokens=0
+            )
+        )
+
+
+@pytest.fixture
+def make_service(monkeypatch):
+    """Build a ClaudeService from BASE_ENV plus overrides, wired to a FakeAPI and its own UsageTracker"""
+    for name in ("LLM_FAST_MODEL", "LLM_FULL_MODEL", "LLM_VISION_MODEL"):
+        monkeypatch.delenv(name, raising=False)
+
+    def make(api=None, **env):
+        for name, value in {**BASE_ENV, **env}.items():
+            monkeypatch.setenv(name, value)
+        service = ClaudeService()
+        service.pipeline.stage("transport").create_message = api or FakeAPI()
+        tracker = UsageTracker()
+        service.pipeline.stage("budget").tracker = tracker
+        service.pipeline.stage("usage").tracker = tracker
+        return service
+
+    return make
+
+
+def api_of(service):
+    return service.pipeline.stage("transport").create_message
+
+
+def image_turn(text):
+    return {"role": "user", "content": [
+        {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": IMAGE}},
+        {"type": "text", "text": text}
+    ]}
+
+
+def cached_base(service):
+    return {"type": "text", "text": service.system_prompt, "cache_control": {"type": "ephemeral"}}
+
+
+def make_kb_context():
+    problem = Problem(
+        id="vpn", category="network", title="VPN will not connect",
+        description="The VPN client times out", keywords=["vpn"]
+    )
+    problem.solutions = [Solution(id="vpn-1", problem_id="vpn", title="Restart the VPN client",
+                                  steps=["Quit the client", "Open it again"])]
+    return KBContext(KBState([problem]), [(problem, 20.0, None)], problem.solutions)
+
+
+TASK_CONTEXT = {
+    "has_active_plan": True,
+    "plan": {"id": "plan-1", "title": "Reset password", "version": 1},
+    "progress": {"completed": 0, "total": 2, "percent": 0},
+    "current_step": {"id": "step-1", "order": 1, "title": "Open settings", "description": "Open the account page"},
+}
+
+
+# ============================================================================
+# What each wrapper sends
+# ============================================================================
+
+def test_analyze_screen_request(make_service):
+    service = make_service()
+    result = asyncio.run(service.analyze_screen(IMAGE, "Why is this button greyed out?", HISTORY))
+
+    assert api_of(service).calls == [{
+        "method": "analyze_screen",
+        "model": service.vision_model,
+        "max_tokens": 512,
+        "system": [cached_base(service)],
+        "messages": SENT_HISTORY + [image_turn("Why is this button greyed out?")]
+    }]
+    assert result["response"] == "Click the network icon bottom right."
+    assert result["route"] == VISION
+
+
+def test_analyze_screen_default_prompt(make_service):
+    service = make_service()
+    asyncio.run(service.analyze_screen(IMAGE))
+
+    assert api_of(service).calls[0]["messages"] == [image_turn(DEFAULT_SCREEN_PROMPT)]
+
+
+def test_chat_request(make_service):
+    service = make_service()
+    asyncio.run(service.chat("hello", HISTORY))
+
+    assert api_of(service).calls == [{
+        "method": "chat",
+        "model": service.model,
+        "max_tokens": 512,
+        "system": [cached_base(service)],
+        "messages": SENT_HISTORY + [{"role": "user", "content": "hello"}]
+    }]
+
+
+def test_chat_without_prompt_cache_sends_plain_system(make_service):
+    service = make_service(PROMPT_CACHE="false")
+    asyncio.run(service.chat("hello"))
+
+    assert api_of(service).calls[0]["system"] == service.system_prompt
+
+
+def test_plan_task_request(make_service):
+    service = make_service()
+    asyncio.run(service.plan_task("reset my password", IMAGE))
+
+    call = api_of(service).calls[0]
+    assert call["method"] == "analyze_screen"
+    assert call["model"] == service.vision_model
+    assert call["system"] == [cached_base(service)]
+    (turn,) = call["messages"]
+    assert turn["content"][0]["source"]["data"] == IMAGE
+    assert turn["content"][1]["text"].startswith("The user wants to: reset my password\n")
+
+
+def test_chat_with_context_request(make_service):
+    service = make_service()
+    result = asyncio.run(service.chat_with_context(
+        "vpn broken", HISTORY, kb_context=make_kb_context(), task_context=TASK_CONTEXT
+    ))
+
+    call = api_of(service).calls[0]
+    assert call["method"] == "chat_with_context"
+    assert call["model"] == service.model
+    assert call["messages"] == SENT_HISTORY + [{"role": "user", "content": "vpn broken"}]
+
+    # Base, task (end of the cached prefix), then the per-query KB block
+    base, task, kb = call["system"]
+    assert base == {"type": "text", "text": service.system_prompt}
+    assert task["cache_control"] == {"type": "ephemeral"}
+    assert "Plan: Reset password" in task["text"]
+    assert "Step ID: step-1" in task["text"]
+    assert "cache_control" not in kb
+    assert "Problem 1: VPN will not connect" in kb["text"]
+    assert "Solution 1: Restart the VPN client" in kb["text"]
+
+    assert result["had_kb_context"] is True
+    assert result["had_task_context"] is True
+
+
+def test_analyze_screen_with_context_request(make_service):
+    service = make_service()
+    result = asyncio.run(service.analyze_screen_with_context(
+        IMAGE, "what now?", kb_context=make_kb_context()
+    ))
+
+    call = api_of(service).calls[0]
+    assert call["method"] == "analyze_screen_with_context"
+    assert call["model"] == service.vision_model
+    assert call["messages"] == [image_turn("what now?")]
+    base, kb = call["system"]
+    assert base == cached_base(service)
+    assert "Problem 1: VPN will not connect" in kb["text"]
+
+    assert result["had_kb_context"] is True
+    assert result["had_task_context"] is False
+
+
+# ============================================================================
+# Cache and admission stages
+# ============================================================================
+
+def test_response_cache_replays_identical_request(make_service):
+    service = make_service(LLM_RESPONSE_CACHE_SIZE="8")
+
+    async def scenario():
+        first = await service.chat("hello", HISTORY)
+        second = await service.chat("hello", HISTORY)
+        other = await service.chat("hello again", HISTORY)
+        return first, second, other
+
+    first, second, other = asyncio.run(scenario())
+
+    assert second == first
+    assert len(api_of(service).calls) == 2
+    assert service.pipeline.stage("cache").get_stats()["hits"] == 1
+
+
+def test_admission_rejects_when_no_slot_frees_up(make_service):
+    release = threading.Event()
+
+    class SlowAPI(FakeAPI):
+        def __call__(self, method, **kwargs):
+            release.wait(5)
+            return super().__call__(method, **kwargs)
+
+    service = make_service(api=SlowAPI(), LLM_MAX_CONCURRENCY="1", LLM_ADMISSION_TIMEOUT="0.05")
+
+    async def scenario():
+        first = asyncio.create_task(service.chat("one"))
+        await asyncio.sleep(0.01)  # first takes the only slot
+        second = await service.chat("two")
+        release.set()
+        return await first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert "error" not in first
+    assert second["error"].startswith("No Claude slot free")
+    assert len(api_of(service).calls) == 1
+    assert service.pipeline.stage("admission").get_stats()["rejected"] == 1
+
+
+# ============================================================================
+# Routing (fast/full) and budgets
+# ============================================================================
+
+def test_routing_escalates_unsure_fast_answer(make_service):
+    api = FakeAPI(replies=["I'm not sure what that is.", "That is the VPN client."])
+    service = make_service(api=api, LLM_ROUTING="auto")
+    result = asyncio.run(service.chat("what is this?"))
+
+    models = service.router.models
+    assert [call["model"] for call in api.calls] == [models[FAST], models[FULL]]
+    assert result["response"] == "That is the VPN client."
+    assert result["route"] == FULL
+    assert result["model"] == models[FULL]
+
+    routes = service.router.get_stats()["routes"]
+    assert routes[FAST]["requests"] == 1 and routes[FAST]["escalated"] == 1
+    assert routes[FULL]["requests"] == 1 and routes[FULL]["escalated"] == 0
+    assert routes[FULL]["cost_usd"] > routes[FAST]["cost_usd"] > 0
+
+
+def test_routing_keeps_confident_fast_answer(make_service):
+    service = make_service(LLM_ROUTING="auto")
+    result = asyncio.run(service.chat("wifi help"))
+
+    assert [call["model"] for call in api_of(service).calls] == [service.router.models[FAST]]
+    assert result["route"] == FAST
+
+
+def test_routing_sends_long_message_to_full_model(make_service):
+    service = make_service(LLM_ROUTING="auto")
+    result = asyncio.run(service.chat(LONG_MESSAGE))
+
+    assert api_of(service).calls[0]["model"] == service.router.models[FULL]
+    assert result["route"] == FULL
+
+
+def test_soft_budget_downgrades_to_fast_model_and_short_history(make_service):
+    service = make_service(
+        LLM_ROUTING="auto", USAGE_TRACKING="true",
+        USAGE_SESSION_SOFT_BUDGET="0.001", USAGE_SOFT_HISTORY_WINDOW="1"
+    )
+    tracker = service.pipeline.stage("usage").tracker
+    tracker.assign("s-soft", "default")
+    tracker.record("s-soft", {"cost_usd": 0.01})
+
+    result = asyncio.run(service.chat(LONG_MESSAGE, HISTORY, session_id="s-soft"))
+
+    (call,) = api_of(service).calls
+    assert call["model"] == service.router.models[FAST]
+    assert call["messages"] == SENT_HISTORY[-1:] + [{"role": "user", "content": LONG_MESSAGE}]
+    assert result["budget"] == "soft"
+    assert result["route"] == FAST
+
+
+def test_soft_budget_sends_screenshots_to_fast_model(make_service):
+    service = make_service(USAGE_TRACKING="true", USAGE_SESSION_SOFT_BUDGET="0.001")
+    tracker = service.pipeline.stage("usage").tracker
+    tracker.assign("s-soft-image", "default")
+    tracker.record("s-soft-image", {"cost_usd": 1.0})
+
+    result = asyncio.run(service.analyze_screen(IMAGE, "what now?", session_id="s-soft-image"))
+
+    (call,) = api_of(service).calls
+    assert call["model"] == service.router.models[FAST]
+    assert call["messages"] == [image_turn("what now?")]
+    assert result["budget"] == "soft"
+    assert result["route"] == FAST
+
+
+def test_hard_budget_refuses_without_calling_claude(make_service):
+    service = make_service(USAGE_TRACKING="true", USAGE_SESSION_HARD_BUDGET="0.001")
+    tracker = service.pipeline.stage("usage").tracker
+    tracker.assign("s-hard", "default")
+    tracker.record("s-hard", {"cost_usd": 0.01})
+
+    result = asyncio.run(service.chat("hello", session_id="s-hard"))
+
+    assert api_of(service).calls == []
+    assert result["budget"] == "hard"
+    assert "usage limit" in result["response"]
+
+
+def test_usage_counts_every_api_call_but_not_cache_hits(make_service):
+    api = FakeAPI(replies=["I'm not sure.", "It is the VPN client."])
+    service = make_service(api=api, LLM_ROUTING="auto", USAGE_TRACKING="true", LLM_RESPONSE_CACHE_SIZE="8")
+    tracker = service.pipeline.stage("usage").tracker
+    tracker.assign("s-usage", "default")
+
+    async def scenario():
+        await service.chat("what is this?", session_id="s-usage")  # fast, then escalated to full
+        await service.chat("what is this?", session_id="s-usage")  # replayed from the cache
+
+    asyncio.run(scenario())
+
+    usage = tracker.get_session_usage("s-usage")
+    assert len(api.calls) == 2
+    assert usage["requests"] == 2
+    assert usage["input_tokens"] == 2000
+    assert usage["output_tokens"] == 200
+    assert usage["cost_usd"] > 0
@@ -21,6 +21,10 @@ class ITSupportAgent {
         // KB & Task state
         this.activePlan = null;
         this.currentStep = null;
+        this.lastUserMessage = null;
+        this.partialInputTimer = null;
+        this.lastPartialInput = '';
+        this.fastPathAnswers = {};  // answer_id -> message elements
 
         // DOM Elements
         this.elements = {
@@ -87,6 +91,7 @@ class ITSupportAgent {
         this.elements.messageInput.addEventListener('keypress', (e) => {
             if (e.key === 'Enter') this.sendMessage();
         });
+        this.elements.messageInput.addEventListener('input', () => this.schedulePartialInput());
 
         // Screen sharing events
         this.elements.btnShareScreen.addEventListener('click', () => this.startScreenShare());
@@ -229,10 +234,18 @@ class ITSupportAgent {
     handleWebSocketMessage(data) {
         switch (data.type) {
             case 'ai_response':
-                this.addMessage('assistant', data.response);
+                if (data.fast_path) {
+                    this.addFastPathAnswer(data, this.lastUserMessage);
+                } else {
+                    this.addMessage('assistant', data.response);
+                }
                 this.speakResponse(data.response);
                 break;
 
+            case 'ai_response_polished':
+                this.replaceFastPathAnswer(data.answer_id, data.response);
+                break;
+
             case 'transcript':
                 this.addMessage('user', data.text);
                 break;
@@ -280,9 +293,12 @@ class ITSupportAgent {
 
         // Clear input
         this.elements.messageInput.value = '';
+        clearTimeout(this.partialInputTimer);
+        this.lastPartialInput = '';
 
         // Add user message to chat
         this.addMessage('user', message);
+        this.lastUserMessage = message;
 
         // Show typing indicator
         this.showTypingIndicator();
@@ -314,7 +330,11 @@ class ITSupportAgent {
             this.hideTypingIndicator();
 
             if (response.ok) {
-                this.addMessage('assistant', data.response);
+                if (data.fast_path) {
+                    this.addFastPathAnswer(data, message);
+                } else {
+                    this.addMessage('assistant', data.response);
+                }
                 this.speakResponse(data.response);
             } else {
                 this.addMessage('assistant', 'Sorry, I encountered an error. Please try again.');
@@ -326,6 +346,108 @@ class ITSupportAgent {
         }
     }
 
+    schedulePartialInput() {
+        // Let the server look up KB matches once typing pauses
+        clearTimeout(this.partialInputTimer);
+        this.partialInputTimer = setTimeout(() => {
+            const text = this.elements.messageInput.value.trim();
+            if (text.length < 3 || text === this.lastPartialInput) return;
+            if (!this.websocket || this.websocket.readyState !== WebSocket.OPEN) return;
+
+            this.lastPartialInput = text;
+            this.websocket.send(JSON.stringify({
+                type: 'partial_input',
+                message: text
+            }));
+        }, 300);
+    }
+
+    async askAI(message) {
+        // Same question again, this time answered by Claude instead of the KB
+        this.showTypingIndicator();
+
+        try {
+            const formData = new FormData();
+            formData.append('message', message);
+            formData.append('session_id', this.sessionId);
+            formData.append('ask_ai', 'true');
+
+            const response = await fetch('/api/chat', {
+                method: 'POST',
+                body: formData
+            });
+
+            const data = await response.json();
+            this.hideTypingIndicator();
+
+            if (response.ok) {
+                this.addMessage('assistant', data.response);
+                this.speakResponse(data.response);
+            } else {
+                this.addMessage('assistant', 'Sorry, I encountered an error. Please try again.');
+            }
+        } catch (error) {
+            console.error('Ask AI error:', error);
+            this.hideTypingIndicator();
+            this.addMessage('assistant', 'Connection error. Please check your internet and try again.');
+        }
+    }
+
+    addFastPathAnswer(data, message) {
+        // Templated KB answer, shown at once with an option to ask the AI
+        const chunks = data.response.split(/\n\n+/).map(c => c.trim()).filter(c => c.length > 0);
+        const nodes = chunks.map(chunk => {
+            const messageDiv = document.createElement('div');
+            messageDiv.className = 'message assistant';
+
+            const contentDiv = document.createElement('div');
+            contentDiv.className = 'message-content';
+            contentDiv.textContent = chunk;
+
+            messageDiv.appendChild(contentDiv);
+            this.elements.chatMessages.appendChild(messageDiv);
+            return messageDiv;
+        });
+
+        if (message) {
+            const actionsDiv = document.createElement('div');
+            actionsDiv.className = 'message assistant fast-path-actions';
+            actionsDiv.innerHTML = '<button class="btn-step skip">Ask the AI instead</button>';
+            actionsDiv.querySelector('button').addEventListener('click', () => {
+                actionsDiv.remove();
+                this.askAI(message);
+            });
+            this.elements.chatMessages.appendChild(actionsDiv);
+            nodes.push(actionsDiv);
+        }
+
+        this.fastPathAnswers[data.answer_id] = nodes;
+        this.elements.chatMessages.scrollTop = this.elements.chatMessages.scrollHeight;
+    }
+
+    replaceFastPathAnswer(answerId, response) {
+        // Swap the templated answer for the reworded one from Claude
+        const nodes = this.fastPathAnswers[answerId];
+        if (!nodes) return;
+        delete this.fastPathAnswers[answerId];
+
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message assistant';
+
+        const contentDiv = document.createElement('div');
+        contentDiv.className = 'message-content';
+        contentDiv.textContent = response;
+
+        messageDiv.appendChild(contentDiv);
+        const anchor = nodes.find(node => node.isConnected);
+        if (anchor) {
+            anchor.before(messageDiv);
+        } else {
+            this.elements.chatMessages.appendChild(messageDiv);
+        }
+        nodes.forEach(node => node.remove());
+    }
+
     addMessage(role, content) {
         // For assistant messages, split by double newlines into multiple bubbles
         if (role === 'assistant') {